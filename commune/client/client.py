@@ -2,6 +2,8 @@
 
 from typing import *
 import asyncio
+import random
+from collections import deque
 import commune as c
 import aiohttp
 import json
@@ -10,6 +12,17 @@ import json
 
 class Client(c.Module):
     count = 0
+    # per address routing stats, shared by every client in the process
+    endpoints = {}
+    latency_alpha = 0.2 # ewma weight of the newest latency
+    max_failures = 3 # consecutive transport failures before the endpoint's circuit opens
+    eject_time = 1 # seconds an open circuit fails fast, doubles every time its probe fails
+    connection_errors = (aiohttp.ClientConnectionError, asyncio.TimeoutError, OSError)
+    idempotent_fns = list(c.Module.whitelist) # read only helpers, safe to retry and hedge
+    default_retries = 2 # retries of idempotent calls
+    retry_backoff = 0.05 # base of the full jitter exponential backoff
+    max_backoff = 1.0
+    min_hedge_samples = 10 # latencies needed before hedging at the p95
     def __init__( 
             self,
             address : str = '0.0.0.0:8000',
@@ -35,7 +48,7 @@ class Client(c.Module):
         self.set_client(address = address, network=network)
 
 
-    def prepare_request(self, args: list = None, kwargs: dict = None, params=None, message_type = "v0"):
+    def prepare_request(self, args: list = None, kwargs: dict = None, params=None, message_type = "v0", deadline: float = None):
 
         if isinstance(args, dict):
             kwargs = args
@@ -70,6 +83,8 @@ class Client(c.Module):
                         "kwargs": kwargs,
                         "timestamp": c.timestamp(),
                         }
+            if deadline != None:
+                input['deadline'] = deadline # the server drops calls it cannot answer in time
             request = self.serializer.serialize(input)
             request = self.key.sign(request, return_json=True)
             # key emoji 
@@ -113,7 +128,7 @@ class Client(c.Module):
         c.print(f"🛰️ Call {url} 🛰️  (🔑{self.key.ss58_address})", color='green', verbose=verbose)
         if not hasattr(self, 'session'):
             self.session = aiohttp.ClientSession()
-        response =  await self.session.post(url, json=request, headers=headers)
+        response =  await asyncio.wait_for(self.session.post(url, json=request, headers=headers), timeout=timeout)
         if response.content_type == 'application/json':
             result = await asyncio.wait_for(response.json(), timeout=timeout)
         elif response.content_type == 'text/plain':
@@ -190,38 +205,207 @@ class Client(c.Module):
     def forward(self, *args, **kwargs):
         return self.loop.run_until_complete(self.async_forward(*args, **kwargs))
 
+    # REPLICA ROUTING AND CIRCUIT BREAKING
+
+    @classmethod
+    def endpoint(cls, address:str) -> dict:
+        if address not in cls.endpoints:
+            cls.endpoints[address] = {'inflight': 0, 'latency': None, 'latencies': deque(maxlen=100),
+                                      'calls': 0, 'errors': 0, 'failures': 0,
+                                      'state': 'closed', 'opens': 0, 'open_until': 0}
+        return cls.endpoints[address]
+
+    @classmethod
+    def available(cls, address:str) -> bool:
+        """ The circuit breaker: closed passes, open fails fast until open_until, then one half open probe. """
+        endpoint = cls.endpoint(address)
+        if endpoint['state'] == 'closed':
+            return True
+        if endpoint['state'] == 'open':
+            return c.time() >= endpoint['open_until']
+        return False # half open, the probe is in flight
+
+    @classmethod
+    def select_address(cls, addresses: List[str]) -> Optional[str]:
+        """
+        Picks the least loaded available address: in flight calls weighted by the ewma latency.
+        Unmeasured replicas score 0 so they get probed. Returns None when every circuit is open.
+        """
+        available = [a for a in addresses if cls.available(a)]
+        if len(available) == 0:
+            return None
+        def score(address):
+            endpoint = cls.endpoint(address)
+            return ((endpoint['inflight'] + 1) * (endpoint['latency'] or 0), random.random())
+        return min(available, key=score)
+
+    @classmethod
+    def record(cls, address:str, latency:float = None, error:Exception = None) -> dict:
+        endpoint = cls.endpoint(address)
+        endpoint['calls'] += 1
+        if error != None:
+            endpoint['errors'] += 1
+            endpoint['failures'] += 1
+            if endpoint['state'] == 'half_open' or endpoint['failures'] >= cls.max_failures:
+                endpoint['opens'] += 1
+                eject_time = cls.eject_time * 2 ** (endpoint['opens'] - 1)
+                endpoint['state'] = 'open'
+                endpoint['open_until'] = c.time() + min(eject_time, 300)
+        else:
+            endpoint.update(state='closed', failures=0, opens=0, open_until=0)
+            endpoint['latencies'].append(latency)
+            if endpoint['latency'] == None:
+                endpoint['latency'] = latency
+            else:
+                endpoint['latency'] += cls.latency_alpha * (latency - endpoint['latency'])
+        return endpoint
+
+    @classmethod
+    def latency_quantile(cls, address:str, q:float = 0.95) -> Optional[float]:
+        latencies = sorted(cls.endpoint(address)['latencies'])
+        if len(latencies) < cls.min_hedge_samples:
+            return None
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    def replica_stats(self) -> Dict[str, dict]:
+        stats = {}
+        for a in (self.replicas or [self.address]):
+            endpoint = {k: v for k, v in self.endpoint(a).items() if k != 'latencies'}
+            stats[a] = {**endpoint, 'p95': self.latency_quantile(a, 0.95)}
+        return stats
+
+    async def send_to(self, address:str, fn:str, request:dict, timeout:float, **kwargs):
+        """ One attempt against one address, keeping the routing and breaker stats. """
+        endpoint = self.endpoint(address)
+        if endpoint['state'] == 'open':
+            endpoint['state'] = 'half_open' # this call is the probe
+        endpoint['inflight'] += 1
+        timestamp = c.time()
+        try:
+            result = await self.send_request(url=self.prepare_url(address, fn), request=request, timeout=timeout, **kwargs)
+        except self.connection_errors as e:
+            self.record(address, error=e)
+            raise e
+        except asyncio.CancelledError as e:
+            # a hedge that lost the race says nothing about the endpoint
+            if endpoint['state'] == 'half_open':
+                endpoint['state'] = 'open'
+            raise e
+        except Exception as e:
+            # any other failure still ends the probe, so a half open endpoint never stays half open
+            self.record(address, error=e)
+            raise e
+        finally:
+            endpoint['inflight'] -= 1
+        self.record(address, latency=c.time() - timestamp)
+        return address, result
+
+    async def hedged_send(self, candidates:List[str], fn:str, make_request:Callable, timeout:float, hedge_delay:float = None, **kwargs):
+        """
+        Sends to the best replica and, if it has not answered after its p95 latency (or hedge_delay),
+        sends the same call to the next best. The first success wins and the other is cancelled.
+        """
+        primary = self.select_address(candidates)
+        assert primary != None, f'circuit open for {candidates}'
+        deadline = c.time() + timeout
+        tasks = [asyncio.ensure_future(self.send_to(primary, fn, make_request(), timeout, **kwargs))]
+        hedge_delay = hedge_delay or self.latency_quantile(primary, 0.95)
+        if hedge_delay != None and hedge_delay < timeout:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if len(done) == 0:
+                secondary = self.select_address([a for a in candidates if a != primary]) or primary
+                tasks.append(asyncio.ensure_future(self.send_to(secondary, fn, make_request(), deadline - c.time(), **kwargs)))
+        pending = set(tasks)
+        error = None
+        try:
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, timeout=max(deadline - c.time(), 0), return_when=asyncio.FIRST_COMPLETED)
+                if len(done) == 0:
+                    raise asyncio.TimeoutError(f'no replica answered within {timeout}s')
+                for task in done:
+                    if task.exception() == None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
     async def async_forward(self,
         fn: str,
         args: list = None,
         kwargs: dict = None,
         params: dict = None,
         address : str = None,
-        timeout: int = 10,
+        timeout: int = 10, # the latency budget of the call, retries included, sent to the server as a deadline
         headers : dict ={'Content-Type': 'application/json'},
         message_type = "v0",
         key : str = None,
         verbose = False,
         stream = False,
+        retries: int = None, # defaults to one per replica, at least default_retries for idempotent calls
+        idempotent: bool = None, # defaults to fn in idempotent_fns, only idempotent calls retry after a timeout or hedge
+        hedge: bool = False, # send a second request to another replica after the p95 latency
+        hedge_delay: float = None,
         **extra_kwargs
         ):
+        """
+        Calls fn on the server, extra_kwargs are sent as kwargs of fn. The call options above
+        (timeout, key, stream, retries, idempotent, hedge, hedge_delay, ...) are never forwarded,
+        so a fn kwarg with one of those names goes in kwargs, e.g. kwargs={'retries': 3}.
+        A refused connection never reached the server, so it is tried once more even with retries=0.
+        """
         try:
             key = self.resolve_key(key)
-            url = self.prepare_url(address, fn)
             # resolve the kwargs at least
             kwargs =kwargs or {}
             kwargs.update(extra_kwargs)
-            timestamp = c.time()
-            request = self.prepare_request(args=args, kwargs=kwargs, params=params, message_type=message_type)
-            result = await self.send_request(url=url, request=request, headers=headers, verbose=verbose, stream=stream)
+            deadline = c.time() + timeout
+            # sign per attempt, retries can outlive the server's staleness window
+            make_request = lambda: self.prepare_request(args=args, kwargs=kwargs, params=params, message_type=message_type, deadline=deadline)
+            idempotent = fn in self.idempotent_fns if idempotent == None else idempotent
+            # replica groups route each call to the least loaded replica, and move on when one fails
+            candidates = [address] if address != None else (self.replicas or [self.address])
+            if retries == None:
+                retries = max(len(candidates) - 1, self.default_retries if idempotent else 0)
+            tried = []
+            attempt, reconnected = 0, False
+            while True:
+                remaining = deadline - c.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f'latency budget of {timeout}s exhausted after {attempt} attempts')
+                try:
+                    if hedge and idempotent and not stream:
+                        address, result = await self.hedged_send(candidates, fn, make_request, remaining, hedge_delay=hedge_delay,
+                                                                 headers=headers, verbose=verbose)
+                    else:
+                        address = self.select_address([a for a in candidates if a not in tried] or candidates)
+                        assert address != None, f'circuit open for {candidates}'
+                        tried.append(address)
+                        address, result = await self.send_to(address, fn, make_request(), remaining,
+                                                             headers=headers, verbose=verbose, stream=stream)
+                    break
+                except self.connection_errors as e:
+                    # a refused connection never reached the server, anything else may have
+                    refused = isinstance(e, aiohttp.ClientConnectorError)
+                    if refused and attempt >= retries and not reconnected:
+                        reconnected = True
+                    elif attempt >= retries or not (idempotent or refused):
+                        raise e
+                    backoff = random.uniform(0, min(self.retry_backoff * 2 ** attempt, self.max_backoff))
+                    c.print(f'{fn} failed ({type(e).__name__}), retrying in {backoff:.2f}s', color='yellow', verbose=verbose)
+                    await asyncio.sleep(min(backoff, max(deadline - c.time(), 0)))
+                    attempt += 1
 
             if type(result) in [str, dict, int, float, list, tuple]:
                 result = self.serializer.deserialize(result)
                 if isinstance(result, dict) and 'data' in result:
                     result = result['data']
+                timestamp = deadline - timeout
                 latency = c.time() - timestamp
                 if self.save_history:
-                    output = { 'input': request, 'output': result, 'latency': latency}
-                    path =  self.history_path+ '/' + self.key.ss58_address + '/' + self.address+ '/'+  str(timestamp)
+                    output = { 'input': {'args': args, 'kwargs': kwargs}, 'output': result, 'latency': latency}
+                    path =  self.history_path+ '/' + self.key.ss58_address + '/' + address+ '/'+  str(timestamp)
                     self.put(path, output)
             else: 
                 result = self.iter_over_async(result)
@@ -245,12 +429,18 @@ class Client(c.Module):
             network : str = 'local',
             possible_modes = ['http', 'https'],
             ):
+        self.replicas = None
         # we dont want to load the namespace if we have the address
         if not c.is_address(address):
             module = address # we assume its a module name
             assert module != None, 'module must be provided'
+            replicas = c.replica_addresses(module, network=network)
             namespace = c.get_namespace(search=module, network=network)
-            if module in namespace:
+            if len(replicas) > 0:
+                # a replica group, calls are routed between its endpoints
+                self.replicas = sorted(set(a.replace(c.ip(), '0.0.0.0') for a in replicas.values()))
+                address = self.select_address(self.replicas) or self.replicas[0]
+            elif module in namespace:
                 address = namespace[module]
             else:    
                 address = module
@@ -308,6 +498,27 @@ class Client(c.Module):
 
         return  module.forward(fn=fn, args=args, kwargs=kwargs, stream=stream, timeout=timeout)
 
+    @classmethod
+    async def async_call(cls, 
+                module : str, 
+                fn:str = None,
+                *args,
+                kwargs = None,
+                params = None,
+                network:str = 'local',
+                key:str = None,
+                timeout=40,
+                **extra_kwargs):
+        """ call without blocking the loop, so gathered calls run concurrently """
+        if '/' in module:
+            if fn != None:
+                args = [fn] + list(args)
+            module , fn = module.split('/')
+        client = cls.connect(module, network=network, virtual=False, key=key)
+        kwargs = params if params != None else (kwargs or {})
+        kwargs.update(extra_kwargs)
+        return await client.async_forward(fn=fn, args=list(args), kwargs=kwargs, timeout=timeout)
+
     @classmethod
     def call_search(cls, 
                     search : str, 
@@ -1,46 +1,247 @@
 import commune as c
+import os
+import json
+import time
 import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
 
 class Hash(c.Module):
+    """
+    Hashes of python objects, files and directories.
+    Files are hashed in block_size blocks, directories as a merkle tree of their files hashed in parallel.
+    File digests are cached on disk by (path, size, mtime, inode), so rehashing an unchanged tree only stats it.
+    """
+    block_size = 1024**2 # bytes read per update when hashing a file
+    racy_window = 2 # files modified this recently are not cached, a write within the mtime resolution would go unseen
+    max_cache = 200000 # cached digests, the oldest are dropped first
+    ignore = ['__pycache__', '.git', '.ipynb_checkpoints']
+    xxhash_modes = ['xxh32', 'xxh64', 'xxh128', 'xxh3_64', 'xxh3_128']
+    cache = None # key -> [size, mtime_ns, inode, value], loaded on first use
+    cache_dirty = False
+    cache_lock = threading.Lock()
+
     @classmethod
     def hash(cls, x, mode: str='sha256',*args,**kwargs):
         x = cls.python2str(x)
         if mode == 'keccak':
             return c.import_object('web3.main.Web3').keccak(text=x, *args, **kwargs).hex()
         elif mode == 'ss58':
-            return c.import_object('scalecodec.utils.ss58.ss58_encode')(x, *args,**kwargs) 
+            return c.import_object('scalecodec.utils.ss58.ss58_encode')(x, *args,**kwargs)
         elif mode == 'python':
             return hash(x)
-        elif mode == 'md5':
-            return hashlib.md5(x.encode()).hexdigest()
-        elif mode == 'sha256':
-            return hashlib.sha256(x.encode()).hexdigest()
-        elif mode == 'sha512':
-            return hashlib.sha512(x.encode()).hexdigest()
-        elif mode =='sha3_512':
-            return hashlib.sha3_512(x.encode()).hexdigest()
-        else:
-            raise ValueError(f'unknown mode {mode}')
+        hasher = cls.hasher(mode)
+        hasher.update(x.encode())
+        return hasher.hexdigest()
 
         #TODO: add quantum resistant hash functions
 
+    @classmethod
+    def hasher(cls, mode: str = 'sha256'):
+        """ an incremental hasher (update, hexdigest), blake2 and xxhash are the fast modes """
+        if mode in ['md5', 'sha256', 'sha512', 'sha3_512', 'blake2b', 'blake2s']:
+            return hashlib.new(mode)
+        if mode in cls.xxhash_modes:
+            import xxhash
+            return getattr(xxhash, mode)()
+        raise ValueError(f'unknown mode {mode}')
 
-        return hash_output
-    
     @classmethod
     def hash_modes(cls):
-        return ['keccak', 'ss58', 'python', 'md5', 'sha256', 'sha512', 'sha3_512']
+        return ['keccak', 'ss58', 'python', 'md5', 'sha256', 'sha512', 'sha3_512', 'blake2b', 'blake2s'] + cls.xxhash_modes
+
+    # FILE CACHE
+
+    @classmethod
+    def cache_path(cls) -> str:
+        return cls.resolve_path('file_cache.json')
+
+    @classmethod
+    def load_cache(cls) -> dict:
+        with cls.cache_lock:
+            if cls.cache == None:
+                try:
+                    with open(cls.cache_path()) as f:
+                        cls.cache = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    cls.cache = {}
+        return cls.cache
+
+    @classmethod
+    def save_cache(cls):
+        with cls.cache_lock:
+            if not cls.cache_dirty:
+                return
+            for key in list(cls.cache)[:max(len(cls.cache) - cls.max_cache, 0)]:
+                del cls.cache[key]
+            path = cls.cache_path()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(cls.cache, f, separators=(',', ':'))
+            os.replace(path + '.tmp', path)
+            cls.cache_dirty = False
+
+    @classmethod
+    def clear_cache(cls):
+        with cls.cache_lock:
+            cls.cache, cls.cache_dirty = {}, False
+            if os.path.exists(cls.cache_path()):
+                os.remove(cls.cache_path())
+        return {'success': True, 'msg': 'cleared the file hash cache'}
+
+    @classmethod
+    def cached(cls, path: str, tag: str, compute: Callable, save: bool = True) -> Any:
+        """ compute() for the file at path, reused until the file's size, mtime or inode change """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        key = f'{tag}:{path}'
+        entry = cls.load_cache().get(key, None)
+        if entry != None and entry[:3] == signature:
+            return entry[3]
+        value = compute()
+        # a file that changed while it was read, or may change again unseen, is not cached
+        stat = os.stat(path)
+        if [stat.st_size, stat.st_mtime_ns, stat.st_ino] == signature and time.time() - stat.st_mtime > cls.racy_window:
+            cls.cache.pop(key, None)
+            cls.cache[key] = signature + [value]
+            cls.cache_dirty = True
+            if save:
+                cls.save_cache()
+        return value
+
+    # FILES AND DIRECTORIES
+
+    @classmethod
+    def hash_file(cls, path: str, mode: str = 'sha256', cache: bool = True, save: bool = True) -> str:
+        """ the digest of the file's bytes, read in block_size blocks """
+        def compute():
+            hasher = cls.hasher(mode)
+            buffer = bytearray(cls.block_size)
+            view = memoryview(buffer)
+            with open(path, 'rb', buffering=0) as f:
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    hasher.update(view[:n])
+            return hasher.hexdigest()
+        if not cache:
+            return compute()
+        return cls.cached(path, mode, compute, save=save)
+
+    @classmethod
+    def walk(cls, path: str, ignore: List[str] = None) -> Tuple[List[str], List[str]]:
+        """ the directories and files under path relative to it, skipping the ignored names """
+        ignore = set(cls.ignore if ignore == None else ignore)
+        dirs, files = [], []
+        for root, dirnames, filenames in os.walk(path):
+            dirnames[:] = [d for d in dirnames if d not in ignore]
+            rel = os.path.relpath(root, path)
+            dirs.append(rel)
+            files += [os.path.normpath(os.path.join(rel, f)) for f in filenames if f not in ignore]
+        return dirs, files
+
+    @classmethod
+    def hash_dir(cls, path: str, mode: str = 'sha256', workers: int = None, cache: bool = True,
+                 ignore: List[str] = None, tree: bool = False) -> Union[str, Dict[str, str]]:
+        """
+        The merkle root of a directory: a directory hashes the sorted (type, name, digest) of its entries,
+        so renaming, moving, adding or changing any file changes the root. Files are hashed in parallel.
+        tree returns the digest of every file and directory (the root is '.').
+        """
+        path = os.path.abspath(path)
+        dirs, files = cls.walk(path, ignore=ignore)
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        digests, misses = {}, []
+        cached = cls.load_cache() if cache else {}
+        for f in files:
+            # cache hits are one stat, only the misses go to the pool
+            stat = os.stat(os.path.join(path, f))
+            entry = cached.get(f'{mode}:{path}/{f}', None)
+            if entry != None and entry[:3] == [stat.st_size, stat.st_mtime_ns, stat.st_ino]:
+                digests[f] = entry[3]
+            else:
+                misses.append(f)
+        hash_file = lambda f: cls.hash_file(os.path.join(path, f), mode=mode, cache=cache, save=False)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            digests.update(zip(misses, executor.map(hash_file, misses)))
+        if cache:
+            cls.save_cache()
+
+        entries = {d: [] for d in dirs}
+        for f, digest in digests.items():
+            entries[os.path.dirname(f) or '.'].append(f'f {os.path.basename(f)} {digest}\n')
+        # children before parents
+        for d in sorted(dirs, key=lambda d: -1 if d == '.' else d.count(os.sep), reverse=True):
+            hasher = cls.hasher(mode)
+            hasher.update(''.join(sorted(entries[d])).encode())
+            digests[d] = hasher.hexdigest()
+            if d != '.':
+                entries[os.path.dirname(d) or '.'].append(f'd {os.path.basename(d)} {digests[d]}\n')
+        return digests if tree else digests['.']
+
+    @classmethod
+    def benchmark(cls, path: str = None, mode: str = 'sha256') -> dict:
+        """ a cold and a cached merkle hash of a directory (the library by default), and the file throughput per mode """
+        path = path or c.libpath
+        results = {}
+        for name, cache in [('uncached', False), ('cached_first', True), ('cached_again', True)]:
+            if name == 'cached_first':
+                cls.clear_cache()
+            t = time.time()
+            root = cls.hash_dir(path, mode=mode, cache=cache)
+            results[name] = {'seconds': round(time.time() - t, 4), 'root': root}
+        test_path = cls.resolve_path('benchmark.bin')
+        size = 256 * 1024**2
+        with open(test_path, 'wb') as f:
+            for _ in range(size // cls.block_size):
+                f.write(os.urandom(cls.block_size))
+        results['files'] = len(cls.walk(path)[1])
+        results['file_mb_s'] = {}
+        for mode in ['md5', 'sha256', 'blake2b', 'xxh3_64', 'xxh3_128']:
+            t = time.time()
+            cls.hash_file(test_path, mode=mode, cache=False)
+            results['file_mb_s'][mode] = round(size / (time.time() - t) / 1024**2, 1)
+        os.remove(test_path)
+        return results
 
     @classmethod
     def test(cls, x='bro'):
+        import tempfile
         for mode in cls.hash_modes():
             try:
                 cls.print(f'SUCCESS {mode}: x -> {cls.hash(x, mode=mode)}', color='green')
             except Exception as e:
                 cls.print(f'FAILED {mode}: x -> {e}', color='red')
 
+        path = tempfile.mkdtemp()
+        for name, text in [('a.txt', 'a'), ('sub/b.txt', 'b' * 3000000), ('sub/deeper/c.txt', '')]:
+            os.makedirs(os.path.dirname(f'{path}/{name}'), exist_ok=True)
+            with open(f'{path}/{name}', 'w') as f:
+                f.write(text)
+        assert cls.hash_file(f'{path}/sub/b.txt', cache=False) == hashlib.sha256(b'b' * 3000000).hexdigest()
+        tree = cls.hash_dir(path, tree=True)
+        assert set(tree) == {'.', 'a.txt', 'sub', 'sub/b.txt', 'sub/deeper', 'sub/deeper/c.txt'}, tree
+        assert cls.hash_dir(path, cache=False, workers=1) == tree['.']
+
+        # a rename or a content change reaches the root, unchanged files are served from the cache
+        os.rename(f'{path}/a.txt', f'{path}/sub/a.txt')
+        moved = cls.hash_dir(path, tree=True)
+        assert moved['.'] != tree['.'] and moved['sub/deeper'] == tree['sub/deeper']
+        old_time = time.time() - 10
+        os.utime(f'{path}/sub/b.txt', (old_time, old_time))
+        cls.hash_file(f'{path}/sub/b.txt')
+        assert f'sha256:{path}/sub/b.txt' in cls.load_cache()
+        with open(f'{path}/sub/b.txt', 'a') as f:
+            f.write('b')
+        assert cls.hash_dir(path) != moved['.']
+        c.rm(path)
+        return {'success': True}
+
     def __call__(self, *args, **kwargs):
         return self.hash(*args, **kwargs)
 
 if __name__ == "__main__":
-    Hash.run()
\ No newline at end of file
+    Hash.run()
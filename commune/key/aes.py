@@ -1,14 +1,31 @@
+import os
 import base64
+import struct
 import hashlib
 from Crypto import Random
 from Crypto.Cipher import AES
 from copy import deepcopy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
 import json
 import sys
 import inspect
 import time
 import commune as c
 class AESKey(c.Module):
+    """
+    encrypt/decrypt: small python objects as base64 AES-CBC strings (key files).
+    encrypt_stream/decrypt_stream: bytes, files and iterators of bytes as AES-GCM frames, in constant memory.
+    A stream is a header (magic, cipher, chunk size, random nonce prefix) and frames of
+    (length | final bit, ciphertext, tag). Every frame is authenticated with its index and whether it is
+    the last one, so a tampered, reordered or truncated stream fails to decrypt.
+    """
+    stream_magic = b'cAE1'
+    stream_cipher = 1 # AES-256-GCM
+    chunk_size = 1024**2 # plaintext bytes per frame
+    tag_size = 16
+    final_bit = 1 << 31
 
     def __init__(self, key:str = 'dummy' ): 
         self.bs = AES.block_size
@@ -38,6 +55,149 @@ class AESKey(c.Module):
     def _unpad(s):
         return s[:-ord(s[len(s)-1:])]
 
+    # STREAMING
+
+    @staticmethod
+    def iter_chunks(data, chunk_size:int) -> Iterator[bytes]:
+        """ chunk_size pieces of bytes, a file object or an iterator of bytes (the last piece may be shorter) """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data)
+            for i in range(0, len(view), chunk_size):
+                yield view[i:i + chunk_size]
+            return
+        if hasattr(data, 'read'):
+            for chunk in iter(lambda: data.read(chunk_size), b''):
+                yield chunk
+            return
+        buffer = bytearray()
+        for piece in data:
+            buffer += piece
+            if len(buffer) >= chunk_size:
+                view = memoryview(buffer)
+                n = len(buffer) - len(buffer) % chunk_size
+                for i in range(0, n, chunk_size):
+                    yield bytes(view[i:i + chunk_size])
+                view.release()
+                del buffer[:n]
+        if buffer:
+            yield bytes(buffer)
+
+    @staticmethod
+    def map_ordered(fn:Callable, items:Iterable, workers:int = 1) -> Iterator:
+        """ fn over items in order, with at most 2 * workers items in flight """
+        if workers <= 1:
+            for item in items:
+                yield fn(*item)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            window = deque()
+            for item in items:
+                window.append(executor.submit(fn, *item))
+                if len(window) >= 2 * workers:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+
+    def frame_cipher(self, header:bytes, index:int, final:bool):
+        cipher = AES.new(self.key_phrase, AES.MODE_GCM, nonce=header[-8:] + struct.pack('>I', index), mac_len=self.tag_size)
+        cipher.update(header + struct.pack('>IB', index, final))
+        return cipher
+
+    def encrypt_frame(self, header:bytes, index:int, chunk:bytes, final:bool) -> bytes:
+        ciphertext, tag = self.frame_cipher(header, index, final).encrypt_and_digest(chunk)
+        return struct.pack('>I', len(ciphertext) | (self.final_bit if final else 0)) + ciphertext + tag
+
+    def decrypt_frame(self, header:bytes, index:int, frame:bytes, final:bool) -> bytes:
+        ciphertext, tag = frame[:-self.tag_size], frame[-self.tag_size:]
+        try:
+            return self.frame_cipher(header, index, final).decrypt_and_verify(ciphertext, tag)
+        except ValueError:
+            raise ValueError(f'frame {index} failed authentication, the stream was tampered with or the key is wrong')
+
+    def encrypt_stream(self, data, chunk_size:int = None, workers:int = 1) -> Iterator[bytes]:
+        """ yields the header and the encrypted frames of data (bytes, a file object or an iterator of bytes) """
+        chunk_size = chunk_size or self.chunk_size
+        assert 0 < chunk_size < self.final_bit, f'chunk_size must be below {self.final_bit}'
+        header = self.stream_magic + struct.pack('>BI', self.stream_cipher, chunk_size) + Random.new().read(8)
+        yield header
+
+        def frames():
+            # hold one chunk back to know which one is last, empty data is one empty final frame
+            index, previous = 0, None
+            for chunk in self.iter_chunks(data, chunk_size):
+                if previous != None:
+                    yield header, index, previous, False
+                    index += 1
+                previous = chunk
+            yield header, index, b'' if previous == None else previous, True
+
+        yield from self.map_ordered(self.encrypt_frame, frames(), workers=workers)
+
+    def decrypt_stream(self, data, workers:int = 1) -> Iterator[bytes]:
+        """ yields the plaintext chunks of an encrypted stream, every chunk is authenticated before it is yielded """
+        chunks = self.iter_chunks(data, self.chunk_size)
+        buffer = bytearray()
+
+        def read(n:int) -> bytes:
+            while len(buffer) < n:
+                chunk = next(chunks, None)
+                if chunk == None:
+                    raise ValueError('the encrypted stream is truncated')
+                buffer.extend(chunk)
+            out = bytes(buffer[:n])
+            del buffer[:n]
+            return out
+
+        header = read(17)
+        if header[:4] != self.stream_magic:
+            raise ValueError('not an encrypted stream')
+        cipher, chunk_size = struct.unpack('>BI', header[4:9])
+        if cipher != self.stream_cipher:
+            raise ValueError(f'unknown stream cipher {cipher}')
+
+        def frames():
+            index, final = 0, False
+            while not final:
+                length = struct.unpack('>I', read(4))[0]
+                final = bool(length & self.final_bit)
+                length &= ~self.final_bit
+                if length > chunk_size:
+                    raise ValueError(f'frame {index} is larger than the chunk size')
+                yield header, index, read(length + self.tag_size), final
+                index += 1
+            if buffer or next(chunks, None) != None:
+                raise ValueError('data after the final frame')
+
+        yield from self.map_ordered(self.decrypt_frame, frames(), workers=workers)
+
+    def encrypt_bytes(self, data:bytes, **kwargs) -> bytes:
+        return b''.join(self.encrypt_stream(data, **kwargs))
+
+    def decrypt_bytes(self, data:bytes, **kwargs) -> bytes:
+        return b''.join(self.decrypt_stream(data, **kwargs))
+
+    def encrypt_file(self, path:str, output_path:str = None, **kwargs) -> str:
+        output_path = output_path or path + '.enc'
+        with open(path, 'rb') as f, open(output_path + '.tmp', 'wb') as out:
+            for frame in self.encrypt_stream(f, **kwargs):
+                out.write(frame)
+        os.replace(output_path + '.tmp', output_path)
+        return output_path
+
+    def decrypt_file(self, path:str, output_path:str = None, **kwargs) -> str:
+        """ the output only appears once the whole file is authenticated """
+        output_path = output_path or (path[:-len('.enc')] if path.endswith('.enc') else path + '.dec')
+        try:
+            with open(path, 'rb') as f, open(output_path + '.tmp', 'wb') as out:
+                for chunk in self.decrypt_stream(f, **kwargs):
+                    out.write(chunk)
+        except BaseException:
+            if os.path.exists(output_path + '.tmp'):
+                os.remove(output_path + '.tmp')
+            raise
+        os.replace(output_path + '.tmp', output_path)
+        return output_path
+
 
     @classmethod
     def test_encrypt_decrypt(cls, key='dummy'):
@@ -89,6 +249,89 @@ class AESKey(c.Module):
 
         return True
     
+    @classmethod
+    def test_stream(cls, key='dummy'):
+        import tempfile
+        self = cls(key=key)
+        data = os.urandom(3 * 1000 + 7)
+        for workers in [1, 4]:
+            encrypted = self.encrypt_bytes(data, chunk_size=1000, workers=workers)
+            assert self.decrypt_bytes(encrypted, workers=workers) == data
+        assert self.decrypt_bytes(self.encrypt_bytes(b'')) == b''
+        # iterators of any piece size, decrypted from odd sized pieces
+        pieces = [data[i:i + 333] for i in range(0, len(data), 333)]
+        encrypted = b''.join(self.encrypt_stream(iter(pieces), chunk_size=1000))
+        assert b''.join(self.decrypt_stream(encrypted[i:i + 77] for i in range(0, len(encrypted), 77))) == data
+
+        # tampering, truncation, a foreign header and the wrong key are detected
+        for bad in [encrypted[:100] + bytes([encrypted[100] ^ 1]) + encrypted[101:],
+                    encrypted[:17 + 4 + 1000 + 16],
+                    encrypted + b'x',
+                    b'nope' + encrypted[4:],
+                    encrypted[:4] + bytes([encrypted[4] ^ 1]) + encrypted[5:]]:
+            try:
+                self.decrypt_bytes(bad)
+                assert False, 'a modified stream decrypted'
+            except ValueError:
+                pass
+        try:
+            cls(key='other').decrypt_bytes(encrypted)
+            assert False, 'decrypted with the wrong key'
+        except ValueError:
+            pass
+
+        path = tempfile.mktemp()
+        with open(path, 'wb') as f:
+            f.write(data)
+        encrypted_path = self.encrypt_file(path)
+        os.remove(path)
+        assert self.decrypt_file(encrypted_path) == path
+        with open(path, 'rb') as f:
+            assert f.read() == data
+        os.remove(path), os.remove(encrypted_path)
+        return {'success': True}
+
+    @classmethod
+    def benchmark(cls, size:int = 64 * 1024**2, workers:int = None) -> dict:
+        """ MB/s and peak python memory of the object encryption vs the streaming frames on size bytes """
+        import tracemalloc
+        self = cls()
+        workers = workers or os.cpu_count()
+        data = os.urandom(size)
+        text = data.hex()[:size] # encrypt() takes python objects, compare on a string of the same size
+        results = {}
+        runs = [('object', lambda: self.encrypt(text), lambda encrypted: self.decrypt(encrypted)),
+                ('stream', lambda: self.encrypt_bytes(data), lambda encrypted: self.decrypt_bytes(encrypted)),
+                (f'stream_{workers}_workers', lambda: self.encrypt_bytes(data, workers=workers), lambda encrypted: self.decrypt_bytes(encrypted, workers=workers))]
+        for name, encrypt, decrypt in runs:
+            tracemalloc.start()
+            t = time.time()
+            encrypted = encrypt()
+            encrypt_time = time.time() - t
+            t = time.time()
+            decrypted = decrypt(encrypted)
+            decrypt_time = time.time() - t
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert len(decrypted) == size
+            del encrypted, decrypted
+            results[name] = {'encrypt_mb_s': round(size / encrypt_time / 1024**2, 1),
+                             'decrypt_mb_s': round(size / decrypt_time / 1024**2, 1),
+                             'peak_mb': round(peak / 1024**2, 1)}
+        # files stream in constant memory
+        path = c.resolve_path('aes_benchmark.bin')
+        with open(path, 'wb') as f:
+            f.write(data)
+        del data, text
+        tracemalloc.start()
+        t = time.time()
+        self.decrypt_file(self.encrypt_file(path, workers=workers), output_path=path, workers=workers)
+        results['file_roundtrip'] = {'mb_s': round(size / (time.time() - t) / 1024**2, 1),
+                                     'peak_mb': round(tracemalloc.get_traced_memory()[1] / 1024**2, 1)}
+        tracemalloc.stop()
+        os.remove(path), os.remove(path + '.enc')
+        return results
+
     @classmethod
     def test(cls):
         import streamlit as st
@@ -1,8 +1,14 @@
 
 import json
+import os
+import fcntl
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
 from scalecodec.utils.ss58 import ss58_encode, ss58_decode, get_ss58_format
 from scalecodec.base import ScaleBytes
-from typing import Union, Optional
+from typing import Union, Optional, List
+from concurrent.futures import ProcessPoolExecutor
 import time
 import binascii
 import re
@@ -175,28 +181,176 @@ class Keypair(c.Module):
         key.path = path
         key_json = key.to_json()
         if password != None:
-            key_json = cls.encrypt(data=key_json, password=password)
+            key_json = cls.encrypted_prefix + c.encrypt(key_json, password=password)
         cls.put(path, key_json)
-        cls.add_key_address(path, key.ss58_address)
-        cls.update()
-        return  json.loads(key_json)
+        cls.uncache_key(path)
+        cls.add_key_address(path, key.ss58_address, public_key=key.public_key.hex(), crypto_type=key.crypto_type)
+        return  json.loads(key.to_json())
     
     @classmethod
-    def add_key_address(cls, key, address):
-        key2address = cls.key2address(update=False)
-        key2address[key] = address
-        cls.put('key2address', key2address)
+    def add_key_address(cls, key, address, public_key:str=None, crypto_type:int=None):
+        entry = {'ss58_address': address, 'public_key': public_key, 'crypto_type': crypto_type}
+        return cls.update_key_index(add={key: entry})
 
     @classmethod
     def rm_key_address(cls, key):
-        key2address = cls.key2address(update=False)
-        key2address.pop(key, None)
-        cls.put('key2address', key2address)
+        return cls.update_key_index(rm=[key])
 
     
     @classmethod
     def update(cls, **kwargs):
         return cls.key2address(update=True,**kwargs)
+
+    key_index_path = 'index/keys'
+
+    @classmethod
+    def key_index_file(cls, extension:str = 'json') -> str:
+        # resolved once, resolving module paths is slow and the index is read on the request path
+        if not hasattr(cls, '_key_index_file'):
+            cls._key_index_file = cls.resolve_path(cls.key_index_path)
+        return f'{cls._key_index_file}.{extension}'
+
+    @classmethod
+    @contextmanager
+    def key_index_lock(cls):
+        # serializes index updates across processes, readers never block
+        with open(cls.key_index_file('lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @classmethod
+    def read_key_entry(cls, path:str) -> Optional[dict]:
+        """
+        Reads the address of a key file without deriving the keypair, None if it is encrypted or invalid.
+        """
+        try:
+            key_json = cls.get(path)
+            if cls.is_encrypted(key_json):
+                return None
+            if isinstance(key_json, str):
+                key_json = json.loads(key_json)
+            return {'ss58_address': key_json['ss58_address'], 
+                    'public_key': key_json.get('public_key'), 
+                    'crypto_type': key_json.get('crypto_type')}
+        except Exception as e:
+            return None
+
+    @classmethod
+    def load_key_index(cls) -> Optional[dict]:
+        try:
+            with open(cls.key_index_file()) as f:
+                return json.load(f)
+        except Exception as e:
+            return None
+
+    @classmethod
+    def key_folder(cls) -> str:
+        return os.path.dirname(os.path.dirname(cls.key_index_file()))
+
+    @classmethod
+    def key_folder_mtime(cls) -> float:
+        # the index lives in a subfolder, so writing it does not change the mtime of the key folder
+        return os.path.getmtime(cls.key_folder())
+
+    @classmethod
+    def write_key_index(cls, keys:dict, mtime:float) -> dict:
+        path = cls.key_index_file()
+        index = {'mtime': mtime, 'keys': keys}
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+        return index
+
+    @classmethod
+    def reconcile_key_index(cls, keys:dict) -> dict:
+        """
+        Drops the keys whose files are gone and indexes the key files that are not in the index yet.
+        """
+        names = set(cls.keys())
+        keys = {k: v for k, v in keys.items() if k in names}
+        for name in names - set(keys.keys()):
+            entry = cls.read_key_entry(name)
+            if entry != None:
+                keys[name] = entry
+        return keys
+
+    @classmethod
+    def key_index(cls, update:bool = False) -> dict:
+        """
+        Returns {key: {ss58_address, public_key, crypto_type}} for every key.
+        The key folder is only listed again when its mtime changed since the index was written.
+        """
+        index = None if update else cls.load_key_index()
+        mtime = cls.key_folder_mtime()
+        if index == None or index['mtime'] != mtime:
+            keys = {} if index == None else index['keys']
+            index = cls.write_key_index(cls.reconcile_key_index(keys), mtime=mtime)
+        return index['keys']
+
+    @classmethod
+    def update_key_index(cls, add:dict = None, rm:list = None) -> dict:
+        with cls.key_index_lock():
+            index = cls.load_key_index()
+            mtime = cls.key_folder_mtime()
+            keys = cls.reconcile_key_index({} if index == None else index['keys'])
+            keys.update(add or {})
+            for k in (rm or []):
+                keys.pop(k, None)
+            cls.write_key_index(keys, mtime=mtime)
+        return {'success': True, 'added': list((add or {}).keys()), 'removed': list(rm or [])}
+
+    key_cache = OrderedDict()
+    key_cache_size = 1024
+    key_cache_lock = threading.Lock()
+
+    @classmethod
+    def key_file_signature(cls, path:str) -> Optional[list]:
+        # any process that rewrites, renames or removes the key file changes this
+        try:
+            stat = os.stat(f'{cls.key_folder()}/{path}.json')
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_ino, stat.st_size]
+
+    @classmethod
+    def cache_key(cls, path:str, key:'Keypair') -> 'Keypair':
+        signature = cls.key_file_signature(path)
+        if signature == None:
+            return key
+        with cls.key_cache_lock:
+            cls.key_cache[path] = (signature, key)
+            cls.key_cache.move_to_end(path)
+            while len(cls.key_cache) > cls.key_cache_size:
+                cls.key_cache.popitem(last=False)
+        return key
+
+    @classmethod
+    def cached_key(cls, path:str) -> Optional['Keypair']:
+        """
+        The cached key of path, None if it is not cached or its file changed since (in this process or another one).
+        """
+        with cls.key_cache_lock:
+            entry = cls.key_cache.get(path, None)
+        if entry == None:
+            return None
+        signature, key = entry
+        if cls.key_file_signature(path) != signature:
+            cls.uncache_key(path)
+            return None
+        with cls.key_cache_lock:
+            if path in cls.key_cache:
+                cls.key_cache.move_to_end(path)
+        return key
+
+    @classmethod
+    def uncache_key(cls, *paths):
+        with cls.key_cache_lock:
+            for path in paths:
+                cls.key_cache.pop(path, None)
     
     @classmethod
     def rename_key(self, new_path):
@@ -206,7 +360,10 @@ class Keypair(c.Module):
     def mv_key(cls, path, new_path):
         
         assert cls.key_exists(path), f'key does not exist at {path}'
-        cls.put(new_path, cls.get_key(path).to_json())
+        key = cls.get_key(path)
+        cls.put(new_path, key.to_json())
+        cls.uncache_key(new_path)
+        cls.add_key_address(new_path, key.ss58_address, public_key=key.public_key.hex(), crypto_type=key.crypto_type)
         cls.rm_key(path)
         assert cls.key_exists(new_path), f'key does not exist at {new_path}'
         new_key = cls.get_key(new_path)
@@ -232,6 +389,8 @@ class Keypair(c.Module):
         key2 = c.get_key(path2)   
         cls.put(path1, key2.to_json()) 
         cls.put(path2, key1.to_json())
+        cls.uncache_key(path1, path2)
+        cls.update_key_index(add={path1: cls.read_key_entry(path1), path2: cls.read_key_entry(path2)})
 
 
         after  = {
@@ -246,15 +405,56 @@ class Keypair(c.Module):
     
     swap_keys = switch_keys
     @classmethod
-    def add_keys(cls, name, n=100, verbose:bool = False, **kwargs):
-        response = []
-        for i in range(n):
-            key_name = f'{name}.{i}'
-            if bool == True:
-                c.print(f'generating key {key_name}')
-            response.append(cls.add_key(key_name, **kwargs))
+    def new_key_jsons(cls, n:int = 1, crypto_type:Union[int, str] = 'sr25519', mnemonics:List[str] = None) -> List[dict]:
+        mnemonics = mnemonics or [cls.generate_mnemonic() for _ in range(n)]
+        return [json.loads(cls.new_key(mnemonic=mnemonic, crypto_type=crypto_type).to_json()) for mnemonic in mnemonics]
 
-        return response
+    @classmethod
+    def add_keys(cls, 
+                 name, 
+                 n=100, 
+                 verbose:bool = False, 
+                 crypto_type:Union[int, str] = 'sr25519', 
+                 refresh:bool = False, 
+                 max_workers:int = None,
+                 password:str = None):
+        """
+        Creates the keys {name}.0 ... {name}.{n-1}, deriving them across a process pool
+        and adding them to the key index in one update. Existing keys are kept unless refresh.
+        With a password every key file is encrypted, like add_key.
+        """
+        paths = [f'{name}.{i}' for i in range(n)]
+        if not refresh:
+            existing = set(cls.keys(name))
+            paths = [p for p in paths if p not in existing]
+        if len(paths) == 0:
+            return []
+        # the mnemonics are drawn here, forked workers inherit the rng state and would draw the same ones
+        mnemonics = [cls.generate_mnemonic() for _ in paths]
+        num_workers = min(max_workers or os.cpu_count() or 1, len(paths))
+        if num_workers == 1:
+            key_jsons = cls.new_key_jsons(crypto_type=crypto_type, mnemonics=mnemonics)
+        else:
+            sizes = [len(paths) // num_workers + int(i < len(paths) % num_workers) for i in range(num_workers)]
+            chunks = [mnemonics[sum(sizes[:i]):sum(sizes[:i + 1])] for i in range(num_workers)]
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                key_jsons = sum(executor.map(cls.new_key_jsons, sizes, [crypto_type]*num_workers, chunks), [])
+
+        entries = {}
+        for path, key_json in zip(paths, key_jsons):
+            key_json['path'] = path
+            if verbose:
+                c.print(f'generating key {path}')
+            data = json.dumps(key_json)
+            if password != None:
+                data = cls.encrypted_prefix + c.encrypt(data, password=password)
+            cls.put(path, data)
+            entries[path] = {'ss58_address': key_json['ss58_address'], 
+                             'public_key': key_json['public_key'], 
+                             'crypto_type': key_json['crypto_type']}
+        cls.uncache_key(*paths)
+        cls.update_key_index(add=entries)
+        return key_jsons
     
     @classmethod
     def key_info(cls, path='module', create_if_not_exists=False, **kwargs):
@@ -326,6 +526,11 @@ class Keypair(c.Module):
                 json:bool=False,
                 create_if_not_exists:bool = False,
                 **kwargs):
+        cache = password == None and not json
+        if cache:
+            key = cls.cached_key(path)
+            if key != None:
+                return key
         if not cls.key_exists(path):
             if create_if_not_exists:
                 key = cls.add_key(path, **kwargs)
@@ -350,8 +555,11 @@ class Keypair(c.Module):
         if json:
             key_json['path'] = path
             return key_json
-        else:
-            return cls.from_json(key_json)
+        
+        key = cls.from_json(key_json)
+        if cache:
+            cls.cache_key(path, key)
+        return key
         
         
         
@@ -375,11 +583,7 @@ class Keypair(c.Module):
 
     @classmethod
     def key2address(cls, search=None, update=False, **kwargs):
-        path = 'key2address'
-        key2address =  cls.get(path, [],max_age=None, update=update)
-        if len(key2address) == 0:
-            key2address =  { k: v.ss58_address for k,v  in cls.get_keys(search).items()}
-            cls.put(path, key2address)
+        key2address = {k: v['ss58_address'] for k, v in cls.key_index(update=update).items()}
         if search != None:
             key2address =  {k:v for k,v in key2address.items() if  search in k}
         
@@ -417,7 +621,7 @@ class Keypair(c.Module):
         defines the path for each key
         """
         path2key_fn = lambda path: '.'.join(path.split('/')[-1].split('.')[:-1])
-        key2path = {path2key_fn(path):path for path in cls.key_paths()}
+        key2path = {path2key_fn(path):path for path in cls.key_paths() if path.endswith('.json')}
         return key2path
 
     @classmethod
@@ -454,6 +658,7 @@ class Keypair(c.Module):
         if key not in keys:
             raise Exception(f'key {key} not found, available keys: {keys}')
         c.rm(key2path[key])
+        cls.uncache_key(key)
         cls.rm_key_address(key)
         return {'deleted':[key]}
     
@@ -469,8 +674,13 @@ class Keypair(c.Module):
         
         assert isinstance(rm_keys, list), f'rm_keys must be list, got {type(rm_keys)}'
 
+        key2path = cls.key2path()
         for rm_key in rm_keys:
-            cls.rm_key(rm_key)
+            if rm_key not in key2path:
+                raise Exception(f'key {rm_key} not found, available keys: {list(key2path.keys())}')
+            c.rm(key2path[rm_key])
+        cls.uncache_key(*rm_keys)
+        cls.update_key_index(rm=rm_keys)
         
         return {'removed_keys':rm_keys}
     
@@ -1063,6 +1273,68 @@ class Keypair(c.Module):
             return ss58_encode(public_key, ss58_format=ss58_format)
         return verified
 
+    def sign_many(self, datas: List[bytes]) -> List[bytes]:
+        """
+        Signs many pre-encoded messages, skipping the per call conversions of sign.
+        """
+        if not self.private_key:
+            raise ConfigurationError('No private key set to create signatures')
+        if self.crypto_type == KeypairType.SR25519:
+            keypair = (self.public_key, self.private_key)
+            return [sr25519.sign(keypair, data) for data in datas]
+        elif self.crypto_type == KeypairType.ED25519:
+            return [ed25519_zebra.ed_sign(self.private_key, data) for data in datas]
+        elif self.crypto_type == KeypairType.ECDSA:
+            return [ecdsa_sign(self.private_key, data) for data in datas]
+        else:
+            raise ConfigurationError("Crypto type not supported")
+
+    def verify_many(self, 
+                    datas: List[bytes], 
+                    signatures: List[bytes], 
+                    public_keys: List[bytes] = None) -> List[bool]:
+        """
+        Verifies many pre-encoded messages against their signatures (and public keys, this key by default).
+        """
+        assert len(datas) == len(signatures), f'got {len(datas)} datas and {len(signatures)} signatures'
+        public_keys = public_keys or [self.public_key] * len(datas)
+        if self.crypto_type == KeypairType.SR25519:
+            crypto_verify_fn = sr25519.verify
+        elif self.crypto_type == KeypairType.ED25519:
+            crypto_verify_fn = ed25519_zebra.ed_verify
+        elif self.crypto_type == KeypairType.ECDSA:
+            crypto_verify_fn = ecdsa_verify
+        else:
+            raise ConfigurationError("Crypto type not supported")
+        # like verify, fall back to the <Bytes> wrapped data of polkadot-js signers
+        return [crypto_verify_fn(signature, data, public_key) or crypto_verify_fn(signature, b'<Bytes>' + data + b'</Bytes>', public_key)
+                for data, signature, public_key in zip(datas, signatures, public_keys)]
+
+    @classmethod
+    def benchmark_signing(cls, n:int = 1000, size:int = 64, crypto_types:List[str] = ['sr25519', 'ed25519', 'ecdsa']) -> dict:
+        """
+        Measures signatures and verifications per second of sign_many/verify_many for each crypto type.
+        """
+        datas = [secrets.token_bytes(size) for _ in range(n)]
+        results = {}
+        for crypto_type in crypto_types:
+            key = cls.new_key(crypto_type=crypto_type)
+            t0 = time.time()
+            signatures = key.sign_many(datas)
+            t1 = time.time()
+            verified = key.verify_many(datas, signatures)
+            t2 = time.time()
+            assert all(verified), f'{crypto_type} signatures failed to verify'
+            results[crypto_type] = {'sign_per_second': n / (t1 - t0), 'verify_per_second': n / (t2 - t1)}
+        return results
+
+    def test_sign_many(self, n:int = 10):
+        datas = [secrets.token_bytes(32) for _ in range(n)]
+        signatures = self.sign_many(datas)
+        assert all(self.verify_many(datas, signatures))
+        assert not any(self.verify_many(datas[::-1], signatures))
+        return {'success': True, 'msg': 'test_sign_many passed'}
+
 
 
         
@@ -1204,6 +1476,7 @@ class Keypair(c.Module):
         enc_text =  c.encrypt(data, password=password)
         enc_text = f'{cls.encrypted_prefix}{enc_text}'
         cls.put(path, enc_text)
+        cls.uncache_key(path)
         return {'encrypted':enc_text, 'path':path , 'password':password}
     
 
@@ -1236,6 +1509,7 @@ class Keypair(c.Module):
         data = data[len(cls.encrypted_prefix):]
         enc_text =  c.decrypt(data, password=password)
         cls.put(path, enc_text)
+        cls.uncache_key(path)
         return {'encrypted':enc_text, 'path':path , 'password':password}
 
 
@@ -1572,6 +1846,29 @@ class Keypair(c.Module):
         assert not self.key_exists('testto')
         return {'success':True, 'msg':'test_move_key passed', 'key':new_key.ss58_address}
 
+    def test_key_cache(self, key='test.key_cache'):
+        # another process replacing or removing the file is seen through the cache
+        self.add_key(key, refresh=True)
+        address = self.get_key(key).ss58_address
+        path = self.key2path()[key]
+        other = self.new_key()
+        with open(path, 'w') as f:
+            f.write(json.dumps({'data': other.to_json()}))
+        assert self.get_key(key).ss58_address == other.ss58_address != address
+        os.remove(path)
+        assert self.cached_key(key) == None and not self.key_exists(key)
+        self.update_key_index(rm=[key])
+        return {'success':True, 'msg':'test_key_cache passed'}
+
+    def test_add_keys(self, n:int = 8):
+        # the parent has drawn keys before, the workers must still draw their own
+        self.new_key()
+        key_jsons = self.add_keys('test.add_keys', n=n, max_workers=4, refresh=True)
+        assert len({k['private_key'] for k in key_jsons}) == n, 'add_keys generated duplicate private keys'
+        assert len({k['ss58_address'] for k in key_jsons}) == n, 'add_keys generated duplicate addresses'
+        self.rm_keys('test.add_keys')
+        return {'success':True, 'msg':'test_add_keys passed'}
+
     @staticmethod
     def is_ss58(address):
         # Check address length
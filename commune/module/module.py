@@ -45,6 +45,7 @@ class c:
     repo_path  = os.path.dirname(root_path) # the path to the repo
     console = Console() # the consolve
     blacklist = [] # blacklist of functions to not to access for outside use
+    cache_fns = {'schema': 60, 'server_name': 60} # fn -> ttl of the server response cache
     server_mode = 'http' # http, grpc, ws (websocket)
     default_network = 'local' # local, subnet
     cache = {} # cache for module objects
@@ -127,7 +128,7 @@ class c:
         return c.module('client').call( *args, **kwargs)
     @classmethod
     async def async_call(cls, *args,**kwargs):
-        return c.call(*args, **kwargs)
+        return await c.module('client').async_call(*args, **kwargs)
     @classmethod
     def call_search(cls,*args, **kwargs) -> None:
         return c.m('client').call_search(*args, **kwargs)
@@ -645,26 +646,26 @@ class c:
     # KEY LAND
     @classmethod
     def add_key(cls, *args, **kwargs):
-        return c.module('key').add_key(*args, **kwargs)
+        return c.key_module().add_key(*args, **kwargs)
     
     @classmethod
     def getmem(self, *args, **kwargs):
-        return c.module('key').getmem(*args, **kwargs)
+        return c.key_module().getmem(*args, **kwargs)
     mem = getmem
 
     # KEY LAND
     @classmethod
     def mv_key(cls, *args, **kwargs):
-        return c.module('key').mv_key(*args, **kwargs)
+        return c.key_module().mv_key(*args, **kwargs)
     
     @classmethod
     def mems(cls, *args, **kwargs):
-        return c.module('key').mems(*args, **kwargs)
+        return c.key_module().mems(*args, **kwargs)
 
     # KEY LAND
     @classmethod
     def switch_key(cls, *args, **kwargs):
-        return c.module('key').switch_key(*args, **kwargs)
+        return c.key_module().switch_key(*args, **kwargs)
     
     @classmethod
     def module_info(cls, *args, **kwargs):
@@ -674,33 +675,33 @@ class c:
 
     @classmethod
     def pwd2key(cls, *args, **kwargs):
-        return c.module('key').pwd2key(*args, **kwargs)
+        return c.key_module().pwd2key(*args, **kwargs)
 
     password2key = pwd2key        
     # KEY LAND
     @classmethod
     def rename_key(cls, *args, **kwargs):
-        return c.module('key').rename_key(*args, **kwargs)
+        return c.key_module().rename_key(*args, **kwargs)
     mv_key = rename_key
     @classmethod
     def add_keys(cls, *args, **kwargs):
-        return c.module('key').add_keys(*args, **kwargs)
+        return c.key_module().add_keys(*args, **kwargs)
     @classmethod
     def key_exists(cls, *args, **kwargs):
-        return c.module('key').key_exists(*args, **kwargs)
+        return c.key_module().key_exists(*args, **kwargs)
     @classmethod
     def ls_keys(cls, *args, **kwargs):
-        return c.module('key').ls_keys(*args, **kwargs)
+        return c.key_module().ls_keys(*args, **kwargs)
     @classmethod
     def rm_key(cls, *args, **kwargs):
-        return c.module('key').rm_key(*args, **kwargs)
+        return c.key_module().rm_key(*args, **kwargs)
     @classmethod
     def key_encrypted(cls, *args, **kwargs):
-        return c.module('key').key_encrypted(*args, **kwargs)
+        return c.key_module().key_encrypted(*args, **kwargs)
 
     @classmethod
     def encrypt_key(cls, *args, **kwargs):
-        return c.module('key').encrypt_key(*args, **kwargs)
+        return c.key_module().encrypt_key(*args, **kwargs)
         
 
     @classmethod
@@ -762,6 +763,14 @@ class c:
         return c.module('os').cmd( *args, **kwargs)
     run_command = shell = cmd 
 
+    @classmethod
+    def run_cmd(cls, *args, **kwargs):
+        return c.module('os').run_cmd(*args, **kwargs)
+
+    @classmethod
+    def run_cmds(cls, *args, **kwargs):
+        return c.module('os').run_cmds(*args, **kwargs)
+
  
 
     @classmethod
@@ -853,8 +862,13 @@ class c:
     #     return {'mean': mean, 'stdev': stdev}
 
 
+    local_ips = ['0.0.0.0', '127.0.0.1', 'localhost']
+
     @classmethod
     def port_used(cls, port: int, ip: str = '0.0.0.0', timeout: int = 1):
+        if ip in cls.local_ips:
+            # local ports are read from the kernel's listen table, no connect round trip
+            return int(port) in c.network_module().listening_ports()
         import socket
         
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
@@ -878,37 +892,6 @@ class c:
         return not cls.port_used(port=port, ip=ip)
         
 
-    @classmethod
-    def used_ports(cls, ports:List[int] = None, ip:str = '0.0.0.0', port_range:Tuple[int, int] = None):
-        '''
-        Get availabel ports out of port range
-        
-        Args:
-            ports: list of ports
-            ip: ip address
-        
-        '''
-        port_range = cls.resolve_port_range(port_range=port_range)
-        if ports == None:
-            ports = list(range(*port_range))
-        
-        async def check_port(port, ip):
-            return cls.port_used(port=port, ip=ip)
-        
-        used_ports = []
-        jobs = []
-        for port in ports: 
-            jobs += [check_port(port=port, ip=ip)]
-                
-        results = cls.gather(jobs)
-        for port, result in zip(ports, results):
-            if isinstance(result, bool) and result:
-                used_ports += [port]
-            
-        return used_ports
-    
-
-    get_used_ports = used_ports
     
     @classmethod
     def makedirs(cls, *args, **kwargs):
@@ -997,14 +980,10 @@ class c:
     def get_available_ports(cls, port_range: List[int] = None , ip:str =None) -> int:
         port_range = cls.resolve_port_range(port_range)
         ip = ip if ip else c.default_ip
-        
-        available_ports = []
-        # return only when the port is available
-        for port in range(*port_range): 
-            if not cls.port_used(port=port, ip=ip):
-                available_ports.append(port)
-                  
-        return available_ports
+        if ip not in cls.local_ips:
+            return [port for port in range(*port_range) if not cls.port_used(port=port, ip=ip)]
+        taken = c.network_module().listening_ports() | set(c.network_module().reserved_ports())
+        return [port for port in range(*port_range) if port not in taken]
     available_ports = get_available_ports
     
     
@@ -1043,21 +1022,13 @@ class c:
         return len(self.free_ports(n=n, **kwargs)) > 0
     
     @classmethod
-    def free_ports(cls, n=10, reserve:bool = False, random_selection:bool = False, **kwargs ) -> List[int]:
-        free_ports = []
-        avoid_ports = kwargs.pop('avoid_ports', [])
-        for i in range(n):
-            try:
-                free_ports += [cls.free_port(reserve=reserve, 
-                                            random_selection=random_selection, 
-                                            avoid_ports=avoid_ports, **kwargs)]
-            except Exception as e:
-                c.print(f'Error: {e}', color='red')
-                break
-            avoid_ports += [free_ports[-1]]
-        
-              
-        return free_ports
+    def free_ports(cls, n=10, reserve:bool = True, random_selection:bool = False, **kwargs ) -> List[int]:
+        if not reserve:
+            free_ports = cls.get_available_ports(port_range=kwargs.get('port_range'))
+            if random_selection:
+                free_ports = c.shuffle(free_ports)
+            return free_ports[:n]
+        return c.network_module().reserve_ports(n=n, random_selection=random_selection, **kwargs)
     
     @classmethod
     def random_port(cls, *args, **kwargs):
@@ -1082,13 +1053,14 @@ class c:
         return ports
     
     @classmethod
-    def used_ports(cls, ip='0.0.0.0') -> List[int]:
-        used_ports = []
-        for port in range(*cls.port_range()): 
-            if not cls.port_available(port=port, ip=ip):
-                used_ports += [port]
-                
-        return used_ports
+    def used_ports(cls, ip='0.0.0.0', port_range:List[int] = None) -> List[int]:
+        port_range = cls.resolve_port_range(port_range)
+        if ip not in cls.local_ips:
+            return [port for port in range(*port_range) if cls.port_used(port=port, ip=ip)]
+        listening_ports = c.network_module().listening_ports()
+        return [port for port in range(*port_range) if port in listening_ports]
+
+    get_used_ports = used_ports
     
     @classmethod
     def free_address(cls, **kwargs):
@@ -1100,34 +1072,39 @@ class c:
                   port_range: List[int] = None , 
                   ip:str =None, 
                   avoid_ports = None,
-                  random_selection:bool = True) -> int:
+                  random_selection:bool = True,
+                  reserve:bool = True,
+                  **kwargs) -> int:
         
         '''
         
-        Get an availabldefe port within the {port_range} [start_port, end_poort] and {ip}
+        Get an available port within the {port_range} [start_port, end_poort] and {ip}, 
+        local ports are leased in the reserved ports table so concurrent callers never get the same port
         '''
+        ip = ip if ip else c.default_ip
+        if reserve and ip in cls.local_ips:
+            return c.network_module().reserve_ports(n=1, 
+                                                    ports=ports, 
+                                                    port_range=port_range, 
+                                                    avoid_ports=avoid_ports, 
+                                                    random_selection=random_selection, 
+                                                    **kwargs)[0]
         avoid_ports = avoid_ports if avoid_ports else []
         
         if ports == None:
             port_range = cls.resolve_port_range(port_range)
             ports = list(range(*port_range))
-            
-        ip = ip if ip else c.default_ip
 
         if random_selection:
             ports = c.shuffle(ports)
-        port = None
         for port in ports: 
             if port in avoid_ports:
                 continue
             
             if cls.port_available(port=port, ip=ip):
                 return port
-        
-    
-    
 
-        raise Exception(f'ports {port_range[0]} to {port_range[1]} are occupied, change the port_range to encompase more ports')
+        raise Exception(f'ports {ports[0]} to {ports[-1]} are occupied, change the port_range to encompase more ports')
 
     get_available_port = free_port
 
@@ -2302,6 +2279,18 @@ class c:
     def rm_server(cls, *args, **kwargs):
         return c.module("namespace").rm_server(*args, **kwargs)
 
+    @classmethod
+    def register_replicas(cls, *args, **kwargs):
+        return c.module("namespace").register_replicas(*args, **kwargs)
+
+    @classmethod
+    def deregister_replicas(cls, *args, **kwargs):
+        return c.module("namespace").deregister_replicas(*args, **kwargs)
+
+    @classmethod
+    def replica_addresses(cls, *args, **kwargs):
+        return c.module("namespace").replica_addresses(*args, **kwargs)
+
     @classmethod
     def remote_servers(cls, *args, **kwargs):
         return c.module("namespace").remote_servers(*args, **kwargs)
@@ -2438,6 +2427,8 @@ class c:
               free: bool = False,
               mnemonic = None, # mnemonic for the server
               key = None,
+              replicas:int = 1, # serve n replicas behind the name, clients route to the least loaded
+              replica_timeout:int = 60, # seconds each remote replica gets to register before the group fails
               **extra_kwargs
               ):
         if c.is_module(module):
@@ -2450,13 +2441,44 @@ class c:
             remote = False
         name = server_name or name # name of the server if None, it will be the module name
         name = cls.resolve_server_name(module=module, name=name, tag=tag, tag_seperator=tag_seperator)
+        if replicas > 1:
+            # each replica is its own server, the group records them under the logical name
+            replica_names = [f'{name}{tag_seperator}{i}' if tag_seperator not in name else f'{name}.{i}' for i in range(replicas)]
+            responses = []
+            for i, replica_name in enumerate(replica_names):
+                # a replica is served like a single server, only the first one can have the requested port
+                try:
+                    response = cls.serve(module=module, kwargs=c.copy(kwargs), tag=tag, server_network=server_network, 
+                                         port=port if i == 0 else None, server_name=replica_name, refresh=refresh, 
+                                         remote=remote, tag_seperator=tag_seperator, max_workers=max_workers, 
+                                         free=free, mnemonic=mnemonic, key=key)
+                except Exception as e:
+                    response = c.detailed_error(e)
+                responses.append(response)
+            failed = [n for n, r in zip(replica_names, responses) if not (isinstance(r, dict) and r.get('success', False))]
+            if remote and len(failed) == 0:
+                deadline = c.time() + replica_timeout
+                for replica_name in replica_names:
+                    while not c.server_exists(replica_name, network=server_network) and c.time() < deadline:
+                        c.sleep(0.5)
+                failed = [n for n in replica_names if not c.server_exists(n, network=server_network)]
+            if len(failed) > 0:
+                # no partial groups, the replicas that did start are stopped
+                for replica_name in replica_names:
+                    try:
+                        c.kill(replica_name, network=server_network)
+                    except Exception as e:
+                        pass
+                return {'success': False, 'name': name, 'error': f'replicas {failed} failed to start', 'replicas': responses}
+            c.register_replicas(name, replica_names, network=server_network)
+            return {'success': True, 'name': name, 'replicas': responses}
         if tag_seperator in name:
             module, tag = name.split(tag_seperator)
         # RESOLVE THE PORT FROM THE ADDRESS IF IT ALREADY EXISTS
         if port == None:
             # now if we have the server_name, we can repeat the server
             address = c.get_address(name, network=server_network)
-            port = int(address.split(':')[-1]) if address else c.free_port()
+            port = int(address.split(':')[-1]) if address else c.free_port(name=name)
 
         # NOTE REMOVE THIS FROM THE KWARGS REMOTE
         if remote:
@@ -2565,7 +2587,7 @@ class c:
     def info(self , 
              module = None,
              features = ['schema', 'namespace', 'commit_hash', 'hardware','attributes','functions'], 
-             lite_features = ['name', 'address', 'schema', 'key', 'description'],
+             lite_features = ['name', 'address', 'schema', 'key', 'description', 'cache', 'metrics'],
              lite = True,
              cost = False,
              **kwargs
@@ -2608,6 +2630,10 @@ class c:
             info['commit_hash'] = c.commit_hash()
         if 'description' in features:
             info['description'] = self.description
+        if 'cache' in features and hasattr(self, 'server_cache'):
+            info['cache'] = self.server_cache.stats() # response cache hit rates
+        if 'metrics' in features and hasattr(self, 'server_metrics'):
+            info['metrics'] = self.server_metrics.stats() # latency quantiles, errors and rate per fn
 
         c.put_json('info', info)
         if cost:
@@ -3799,27 +3825,38 @@ class c:
     
     # KEY LAND
 
+    @classmethod
+    def network_module(cls):
+        if not hasattr(cls, '_network_module'):
+            cls._network_module = c.module('network')
+        return cls._network_module
+
+    @classmethod
+    def key_module(cls):
+        if not hasattr(cls, '_key_module'):
+            cls._key_module = c.module('key')
+        return cls._key_module
                
     @classmethod
     def get_keys(cls,*args, **kwargs ):
-        return c.module('key').get_keys(*args, **kwargs )
+        return c.key_module().get_keys(*args, **kwargs )
     
     @classmethod
     def rm_keys(cls,*args, **kwargs ):
-        return c.module('key').rm_keys(*args, **kwargs )
+        return c.key_module().rm_keys(*args, **kwargs )
 
     @classmethod
     def key2address(cls,*args, **kwargs ):
-        return c.module('key').key2address(*args, **kwargs )
+        return c.key_module().key2address(*args, **kwargs )
     
     @classmethod
     def key_addresses(cls,*args, **kwargs ):
-        return c.module('key').addresses(*args, **kwargs )
+        return c.key_module().addresses(*args, **kwargs )
     k2a = key2address
 
     @classmethod
     def is_key(self, key:str) -> bool:
-        return c.module('key').is_key(key)
+        return c.key_module().is_key(key)
 
     @classmethod
     def root_key(cls):
@@ -3867,17 +3904,17 @@ class c:
     
     @classmethod
     def address2key(cls,*args, **kwargs ):
-        return c.module('key').address2key(*args, **kwargs )
+        return c.key_module().address2key(*args, **kwargs )
     
     
     @classmethod
     def key_addresses(cls,*args, **kwargs ):
-        return list(c.module('key').address2key(*args, **kwargs ).keys())
+        return list(c.key_module().address2key(*args, **kwargs ).keys())
     
 
     @classmethod
     def get_key_for_address(cls, address:str):
-         return c.module('key').get_key_for_address(address)
+         return c.key_module().get_key_for_address(address)
 
     @classmethod
     def get_key_address(cls, key):
@@ -3896,7 +3933,7 @@ class c:
         key = cls.resolve_keypath(key)
         if 'Keypair' in c.type_str(key):
             return key
-        module = c.module(mode2module[mode])
+        module = c.key_module() if mode == 'commune' else c.module(mode2module[mode])
         if hasattr(module, 'get_key'):
             key = module.get_key(key, **kwargs)
         else:
@@ -3947,6 +3984,21 @@ class c:
         if not hasattr(cls, '_hash_module'):
             cls._hash_module = c.module('crypto.hash')()
         return cls._hash_module(data, **kwargs)
+
+    @classmethod
+    def hash_module(cls):
+        # kept on Module, a callable attribute on a module class would be listed as one of its functions
+        if not hasattr(c, '_hash_module'):
+            c._hash_module = c.module('crypto.hash')()
+        return c._hash_module
+
+    @classmethod
+    def hash_file(cls, path:str, **kwargs) -> str:
+        return cls.hash_module().hash_file(path, **kwargs)
+
+    @classmethod
+    def hash_dir(cls, path:str, **kwargs) -> Union[str, Dict[str, str]]:
+        return cls.hash_module().hash_dir(path, **kwargs)
     
 
     @classmethod
@@ -4033,7 +4085,7 @@ class c:
         assert isinstance(modules, list), 'modules must be a list'
         futures = []
         for m in modules:
-            job_kwargs = {'module':  m, 'fn': fn, 'network': network, **kwargs}
+            job_kwargs = {'module':  m, 'fn': fn, 'network': network, 'timeout': timeout, **kwargs}
             future = c.submit(c.call, kwargs=job_kwargs, args=[*args] , timeout=timeout)
             futures.append(future)
         responses = c.wait(futures, timeout=timeout)
@@ -4060,14 +4112,14 @@ class c:
             search = cls.module_path()
             if search == 'module':
                 search = None
-        keys = c.module('key').keys(search, *args, **kwargs)
+        keys = c.key_module().keys(search, *args, **kwargs)
         if ss58:
             keys = [c.get_key_address(k) for k in keys]
         return keys
 
     @classmethod  
     def get_mem(cls, *args, **kwargs):
-        return c.module('key').get_mem(*args, **kwargs)
+        return c.key_module().get_mem(*args, **kwargs)
     
     mem = get_mem
     
@@ -4086,30 +4138,30 @@ class c:
         return key
     def create_key(cls , key = None):
         key = cls.resolve_keypath(key)
-        return c.module('key').create_key(key)
+        return c.key_module().create_key(key)
     
     @classmethod
     def add_key(cls, key, *args,  **kwargs):
-        return c.module('key').add_key(key, *args, **kwargs)
+        return c.key_module().add_key(key, *args, **kwargs)
     
     @classmethod
     def new_key(cls,  *args,  **kwargs):
-        return c.module('key').new_key( *args, **kwargs)
+        return c.key_module().new_key( *args, **kwargs)
     
 
     @classmethod
     def save_keys(cls, *args,  **kwargs):
-        return c.module('key').save_keys(*args, **kwargs)
+        return c.key_module().save_keys(*args, **kwargs)
     savemems = savekeys = save_keys
 
     @classmethod
     def load_keys(cls, *args,  **kwargs):
-        return c.module('key').load_keys(*args, **kwargs)
+        return c.key_module().load_keys(*args, **kwargs)
     loadmems = loadkeys = load_keys
 
     @classmethod
     def load_key(cls, *args,  **kwargs):
-        return c.module('key').load_key(*args, **kwargs)
+        return c.key_module().load_key(*args, **kwargs)
 
 
     def sign(self, data:dict  = None, key: str = None, **kwargs) -> bool:
@@ -4123,7 +4175,7 @@ class c:
     
     @classmethod
     def get_signer(cls, data:dict ) -> bool:        
-        return c.module('key').get_signer(data)
+        return c.key_module().get_signer(data)
     
     @classmethod
     def start(cls, *args, **kwargs):
@@ -4290,7 +4342,7 @@ class c:
 
     @classmethod
     def mv_key(cls, key:str, new_key:str):
-        return c.module('key').mv_key(key, new_key)
+        return c.key_module().mv_key(key, new_key)
     
     @classmethod
     def determine_type(cls, x):
@@ -4585,6 +4637,9 @@ class c:
                  end_line:int = None ) -> str:
         # Get the absolute path of the file
         path = cls.resolve_path(path)
+        if tail != None and tail > 0 and start_byte == 0 and end_byte == 0:
+            # seek back from the end instead of reading the whole file
+            return c.tail_text(path, tail)
 
         # Read the contents of the file
         with open(path, 'rb') as file:
@@ -4634,6 +4689,36 @@ class c:
     
     load_text = get_text
 
+    @staticmethod
+    def tail_offset(path:str, n:int, block_size:int = 64 * 1024) -> int:
+        """ byte offset where the last n newline separated pieces start, read in blocks backwards from the end """
+        with open(path, 'rb') as file:
+            pos = file.seek(0, 2)
+            while pos > 0:
+                size = min(block_size, pos)
+                pos -= size
+                file.seek(pos)
+                block = file.read(size)
+                count = block.count(b'\n')
+                if count >= n:
+                    idx = len(block)
+                    for _ in range(n):
+                        idx = block.rindex(b'\n', 0, idx)
+                    return pos + idx + 1
+                n -= count
+        return 0
+
+    @classmethod
+    def tail_text(cls, path:str, tail:int = 20) -> str:
+        """ the same text as get_text(path, tail=tail) while only reading the tail of the file """
+        with open(path, 'rb') as file:
+            file.seek(cls.tail_offset(path, tail))
+            content_bytes = file.read()
+        try:
+            return content_bytes.decode()
+        except UnicodeDecodeError:
+            return content_bytes.hex()
+
 
     @classmethod
     def free_gpu_memory(cls, *args, **kwargs) -> Dict[int, float]:
@@ -5329,9 +5414,12 @@ class c:
         return fn2str
     @classmethod
     def fn2hash(cls, fn=None , mode='sha256', **kwargs):
-        fn2hash = {}
-        for k,v in cls.fn2str(**kwargs).items():
-            fn2hash[k] = c.hash(v,mode=mode)
+        compute = lambda: {k: c.hash(v,mode=mode) for k,v in cls.fn2str(**kwargs).items()}
+        if len(kwargs) == 0:
+            # recomputed only when the module file changes
+            fn2hash = cls.hash_module().cached(cls.pypath(), f'fn2hash:{cls.module_path()}:{mode}', compute)
+        else:
+            fn2hash = compute()
         if fn:
             return fn2hash[fn]
         return fn2hash
@@ -5793,6 +5881,9 @@ class c:
         """
         The hash of the code, where the code is the code of the class (cls)
         """
+        if len(args) == 0 and len(kwargs) == 0:
+            # the code is the whole file, its digest is cached until the file changes
+            return cls.hash_file(cls.pypath())
         code = cls.code(*args, **kwargs)
         return c.hash(code)
     
@@ -6083,7 +6174,7 @@ class c:
 
     @classmethod
     def random_word(cls, *args, n=1, seperator='_', **kwargs):
-        random_words = c.module('key').generate_mnemonic(*args, **kwargs).split(' ')[0]
+        random_words = c.key_module().generate_mnemonic(*args, **kwargs).split(' ')[0]
         random_words = random_words.split(' ')[:n]
         if n == 1:
             return random_words[0]
@@ -6091,7 +6182,7 @@ class c:
             return seperator.join(random_words.split(' ')[:n])
     @classmethod
     def random_words(cls, n=2, **kwargs):
-        return c.module('key').generate_mnemonic(n=n, **kwargs)
+        return c.key_module().generate_mnemonic(n=n, **kwargs)
     @classmethod
     def unstake_many(cls, *args, **kwargs):
         return c.module('subspace')().unstake_many(*args, **kwargs)
@@ -6168,22 +6259,22 @@ class c:
     
     @classmethod
     def key_info(cls, *args, **kwargs):
-        return c.module('key').key_info(*args, **kwargs)
+        return c.key_module().key_info(*args, **kwargs)
 
 
 
     @classmethod
     def key2mem(cls, *args, **kwargs):
-        return c.module('key').key2mem(*args, **kwargs)
+        return c.key_module().key2mem(*args, **kwargs)
     @classmethod
     def key_info_map(cls, *args, **kwargs):
-        return c.module('key').key_info_map(*args, **kwargs)
+        return c.key_module().key_info_map(*args, **kwargs)
     
 
 
     @staticmethod
     def valid_ss58_address(address:str):
-        return c.module('key').valid_ss58_address(str(address))
+        return c.key_module().valid_ss58_address(str(address))
     is_valid_ss58_address = valid_ss58_address
 
     @classmethod
@@ -6469,6 +6560,16 @@ class c:
             f.cancel()
         return {'success': True, 'msg': 'cancelled futures'}
        
+    @staticmethod
+    def cacheable(ttl: float = 60):
+        '''
+        marks a module function for the server response cache (single-flight, lru + ttl)
+        '''
+        def decorator(fn):
+            fn.__cache__ = {'ttl': ttl}
+            return fn
+        return decorator
+
     @classmethod
     def cachefn(cls, func, max_age=60, update=False, cache=True, cache_folder='cachefn'):
         import functools
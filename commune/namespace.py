@@ -1,5 +1,8 @@
+import os
+import fcntl
 import commune as c
 from typing import *
+from contextlib import contextmanager
 
 # THIS IS WHAT THE INTERNET IS, A BUNCH OF NAMESPACES, AND A BUNCH OF SERVERS, AND A BUNCH OF MODULES.
 # THIS IS THE INTERNET OF INTERNETS.
@@ -7,6 +10,8 @@ class Namespace(c.Module):
 
 
     remote_modules_path ='remote_modules'
+    replicas_path = 'replicas' # logical name -> replica server names, per network
+    locks_path = 'locks'
 
     # the default
     network : str = 'local'
@@ -54,28 +59,42 @@ class Namespace(c.Module):
     
     namespace = namespace
 
+    @classmethod
+    @contextmanager
+    def namespace_lock(cls, network:str=network):
+        # serializes read-modify-write of a namespace, servers (and replicas) register concurrently
+        path = cls.resolve_path(f'{cls.locks_path}/{network}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
     @classmethod
     def register_server(cls, name:str, address:str, network=network) -> None:
-        namespace = cls.namespace(network=network)
-        namespace[name] = address
-        cls.put_namespace(network, namespace)
+        with cls.namespace_lock(network):
+            namespace = cls.namespace(network=network)
+            namespace[name] = address
+            cls.put_namespace(network, namespace)
         return {'success': True, 'msg': f'Block {name} registered to {network}.'}
     
     
     @classmethod
     def deregister_server(cls, name:str, network=network) -> Dict:
-
-        namespace = cls.namespace(network=network)
-        address2name = {v: k for k, v in namespace.items()}
-        if name in address2name:
-            name = address2name[name]
-        
-        if name in namespace:
-            del namespace[name]
-            cls.put_namespace(network, namespace)
-            return {'status': 'success', 'msg': f'Block {name} deregistered.'}
-        else:
-            return {'success': False, 'msg': f'Block {name} not found.'}
+        with cls.namespace_lock(network):
+            namespace = cls.namespace(network=network)
+            address2name = {v: k for k, v in namespace.items()}
+            if name in address2name:
+                name = address2name[name]
+            
+            if name in namespace:
+                del namespace[name]
+                cls.put_namespace(network, namespace)
+                return {'status': 'success', 'msg': f'Block {name} deregistered.'}
+            else:
+                return {'success': False, 'msg': f'Block {name} not found.'}
     
     @classmethod
     def rm_server(self,  name:str, network=network):
@@ -125,7 +144,42 @@ class Namespace(c.Module):
     
     @classmethod
     def networks(cls) -> dict:
-        return [p.split('/')[-1].split('.')[0] for p in cls.ls()]
+        return [p.split('/')[-1].split('.')[0] for p in cls.ls() if p.split('/')[-1] not in [cls.replicas_path, cls.locks_path]]
+
+    # REPLICA GROUPS: one logical name served by several servers, clients route between them
+
+    @classmethod
+    def replica_groups(cls, network:str=network) -> Dict[str, List[str]]:
+        return cls.get(f'{cls.replicas_path}/{network}', {})
+
+    @classmethod
+    def register_replicas(cls, name:str, replicas:List[str], network:str=network) -> Dict:
+        with cls.namespace_lock(network):
+            groups = cls.replica_groups(network=network)
+            groups[name] = sorted(set(groups.get(name, []) + list(replicas)))
+            cls.put(f'{cls.replicas_path}/{network}', groups)
+        return {'success': True, 'msg': f'{name} has {len(groups[name])} replicas on {network}', 'replicas': groups[name]}
+
+    @classmethod
+    def deregister_replicas(cls, name:str, replicas:List[str]=None, network:str=network) -> Dict:
+        with cls.namespace_lock(network):
+            groups = cls.replica_groups(network=network)
+            if name not in groups:
+                return {'success': False, 'msg': f'{name} is not a replica group'}
+            groups[name] = [r for r in groups[name] if replicas != None and r not in replicas]
+            if len(groups[name]) == 0:
+                del groups[name]
+            cls.put(f'{cls.replicas_path}/{network}', groups)
+        return {'success': True, 'msg': f'{name} replicas deregistered', 'replicas': groups.get(name, [])}
+
+    @classmethod
+    def replica_addresses(cls, name:str, network:str=network) -> Dict[str, str]:
+        """ The registered endpoints of a replica group ({} when name is a plain server). """
+        replicas = cls.replica_groups(network=network).get(name, [])
+        if len(replicas) == 0:
+            return {}
+        namespace = cls.namespace(network=network)
+        return {r: namespace[r] for r in replicas if r in namespace}
     
     @classmethod
     def namespace_exists(cls, network:str) -> bool:
@@ -365,6 +419,14 @@ class Namespace(c.Module):
         assert cls.namespace_exists(network) == False
         cls.rm_namespace(network2)
         assert cls.namespace_exists(network2) == False
+
+        cls.register_server('test::0', '0.0.0.0:1', network=network)
+        cls.register_server('test::1', '0.0.0.0:2', network=network)
+        cls.register_replicas('test', ['test::0', 'test::1', 'test::2'], network=network)
+        assert cls.replica_addresses('test', network=network) == {'test::0': '0.0.0.0:1', 'test::1': '0.0.0.0:2'}
+        cls.deregister_replicas('test', network=network)
+        assert cls.replica_addresses('test', network=network) == {}
+        cls.rm_namespace(network)
         
         return {'success': True, 'msg': 'Namespace tests passed.'}
     
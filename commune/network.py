@@ -1,9 +1,14 @@
 # hey/thanks bittensor
 import os
+import json
+import time
+import fcntl
 import urllib
 import commune as c
 import requests
 import logging
+from typing import List, Optional
+from contextlib import contextmanager
 
 class Network(c.Module):
 
@@ -182,43 +187,216 @@ class Network(c.Module):
         except Exception as e:
             raise Exception(e) from e
 
+    reserved_ports_path = 'reserved_ports'
+    port_lease = 60 # seconds a reservation holds a port for a process that has not bound it yet
+
+    @staticmethod
+    def listening_ports() -> set:
+        """
+        Returns the local tcp ports in the LISTEN state, read from /proc/net/tcp and /proc/net/tcp6 in one pass.
+        """
+        ports = set()
+        paths = [p for p in ['/proc/net/tcp', '/proc/net/tcp6'] if os.path.exists(p)]
+        if len(paths) == 0:
+            # no procfs (macos), ask the kernel through psutil instead
+            import psutil
+            return {conn.laddr.port for conn in psutil.net_connections(kind='tcp') if conn.status == psutil.CONN_LISTEN}
+        for path in paths:
+            with open(path) as f:
+                next(f, None) # header
+                for line in f:
+                    fields = line.split()
+                    # local_address is HEXIP:HEXPORT and st 0A is TCP_LISTEN
+                    if len(fields) > 3 and fields[3] == '0A':
+                        ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+        return ports
+
     @classmethod
-    def unreserve_port(cls,port:int, 
-                       var_path='reserved_ports'):
-        reserved_ports =  cls.get(var_path, {}, root=True)
-        
-        port_info = reserved_ports.pop(port,None)
-        if port_info == None:
-            port_info = reserved_ports.pop(str(port),None)
-        
-        output = {}
-        if port_info != None:
-            c.put(var_path, reserved_ports, root=True)
-            output['msg'] = 'port removed'
-        else:
-            output['msg'] =  f'port {port} doesnt exist, so your good'
-
-        output['reserved'] =  cls.reserved_ports()
-        return output
-    
-    
+    def reserved_ports_file(cls, extension:str = 'json') -> str:
+        # resolved once, resolving module paths is slow and ports are allocated on the serve path
+        if not hasattr(cls, '_reserved_ports_file'):
+            cls._reserved_ports_file = cls.resolve_path(cls.reserved_ports_path)
+        return f'{cls._reserved_ports_file}.{extension}'
+
+    @classmethod
+    @contextmanager
+    def port_lock(cls):
+        # serializes reservations across processes so two servers never get the same port
+        with open(cls.reserved_ports_file('lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def pid_alive(pid:int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass # alive but owned by another user
+        return True
+
+    @classmethod
+    def lease_alive(cls, lease:dict, timestamp:float = None) -> bool:
+        """
+        A lease holds while it is young, after that only while the process that took it is still running.
+        """
+        timestamp = timestamp or time.time()
+        if timestamp - lease.get('time', 0) < lease.get('lease', cls.port_lease):
+            return True
+        return cls.pid_alive(lease.get('pid', -1))
+
+    @classmethod
+    def load_reserved_ports(cls) -> dict:
+        try:
+            with open(cls.reserved_ports_file()) as f:
+                reserved_ports = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        timestamp = time.time()
+        return {int(port): lease for port, lease in reserved_ports.items() if cls.lease_alive(lease, timestamp)}
+
+    @classmethod
+    def save_reserved_ports(cls, reserved_ports:dict) -> dict:
+        path = cls.reserved_ports_file()
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({str(port): lease for port, lease in reserved_ports.items()}, f)
+        os.replace(tmp_path, path)
+        return reserved_ports
+
+    @classmethod
+    def reserved_ports(cls) -> dict:
+        return cls.load_reserved_ports()
 
-    
     @classmethod
-    def unreserve_ports(cls,*ports, 
-                       var_path='reserved_ports' ):
-        reserved_ports =  cls.get(var_path, {})
-        if len(ports) == 0:
-            # if zero then do all fam, tehe
-            ports = list(reserved_ports.keys())
-        elif len(ports) == 1 and isinstance(ports[0],list):
+    def reserve_ports(cls, 
+                      n:int = 1, 
+                      ports:List[int] = None,
+                      port_range:List[int] = None, 
+                      avoid_ports:List[int] = None,
+                      pid:int = None,
+                      name:str = None,
+                      lease:int = None,
+                      random_selection:bool = True) -> List[int]:
+        """
+        Hands out n ports that are neither listening nor leased, and leases them to {pid} under the lock.
+        """
+        if ports == None:
+            port_range = c.resolve_port_range(port_range)
+            ports = list(range(*port_range))
+        avoid_ports = set(map(int, avoid_ports or []))
+        with cls.port_lock():
+            reserved_ports = cls.load_reserved_ports()
+            taken = cls.listening_ports() | set(reserved_ports) | avoid_ports
+            candidates = [int(p) for p in ports if int(p) not in taken]
+            if random_selection:
+                candidates = c.shuffle(candidates)
+            assert len(candidates) >= n, f'only {len(candidates)} of {n} ports are free in {ports[0]} to {ports[-1]}, change the port_range to encompase more ports'
+            candidates = candidates[:n]
+            lease = {'pid': pid or os.getpid(), 'name': name, 'time': time.time(), 'lease': lease or cls.port_lease}
+            for port in candidates:
+                reserved_ports[port] = dict(lease)
+            cls.save_reserved_ports(reserved_ports)
+        return candidates
+
+    @classmethod
+    def reserve_port(cls, port:int = None, **kwargs) -> int:
+        """
+        Reserves {port} if it is free, otherwise any free port in the port range.
+        """
+        if port != None:
+            kwargs['ports'] = [port]
+            try:
+                return cls.reserve_ports(n=1, **kwargs)[0]
+            except AssertionError:
+                kwargs.pop('ports')
+        return cls.reserve_ports(n=1, **kwargs)[0]
+
+    @staticmethod
+    def parent_pid(pid:int) -> Optional[int]:
+        if pid == os.getpid():
+            return os.getppid()
+        try:
+            import psutil
+            return psutil.Process(pid).ppid()
+        except Exception:
+            return None
+
+    @classmethod
+    def can_claim(cls, lease:dict, pid:int, name:str = None) -> bool:
+        """
+        A lease can be taken over once it expired or its process is gone, by the process (or the child of the process) that holds it,
+        or by the server it was reserved for (c.serve reserves the port under the server's name before pm2 starts it).
+        """
+        if time.time() - lease.get('time', 0) >= lease.get('lease', cls.port_lease):
+            return True
+        if not cls.pid_alive(lease.get('pid', -1)):
+            return True
+        if lease.get('pid') in [pid, cls.parent_pid(pid)]:
+            return True
+        return name != None and lease.get('name') == name
+
+    @classmethod
+    def claim_port(cls, port:int, pid:int = None, name:str = None, lease:int = None) -> bool:
+        """
+        Moves the lease on {port} to the process that is about to bind it (e.g. a server started with a port its parent reserved).
+        Fails if something is already listening on the port, or if the port is leased to someone else (see can_claim).
+        """
+        port = int(port)
+        pid = pid or os.getpid()
+        with cls.port_lock():
+            if port in cls.listening_ports():
+                return False
+            reserved_ports = cls.load_reserved_ports()
+            if port in reserved_ports and not cls.can_claim(reserved_ports[port], pid=pid, name=name):
+                return False
+            reserved_ports[port] = {'pid': pid, 'name': name, 'time': time.time(), 'lease': lease or cls.port_lease}
+            cls.save_reserved_ports(reserved_ports)
+        return True
+
+    @classmethod
+    def unreserve_ports(cls, *ports) -> dict:
+        if len(ports) == 1 and isinstance(ports[0], list):
             ports = ports[0]
-        ports = list(map(str, ports))
-        reserved_ports = {rp:v for rp,v in reserved_ports.items() if not any([p in ports for p in [str(rp), int(rp)]] )}
-        c.put(var_path, reserved_ports)
-        return cls.reserved_ports()
-    
-    
+        ports = set(map(int, ports))
+        with cls.port_lock():
+            reserved_ports = cls.load_reserved_ports()
+            if len(ports) == 0:
+                # if zero then do all fam, tehe
+                ports = set(reserved_ports)
+            reserved_ports = {p:v for p,v in reserved_ports.items() if p not in ports}
+            cls.save_reserved_ports(reserved_ports)
+        return reserved_ports
+
+    @classmethod
+    def unreserve_port(cls, port:int) -> dict:
+        return cls.unreserve_ports(port)
+
+    @classmethod
+    def test_reserve_ports(cls, n:int = 20):
+        ports = cls.reserve_ports(n=n)
+        assert len(set(ports)) == n, f'duplicate ports {ports}'
+        reserved_ports = cls.reserved_ports()
+        assert all(p in reserved_ports for p in ports)
+        more_ports = cls.reserve_ports(n=n)
+        assert len(set(ports) & set(more_ports)) == 0, 'reserved ports were handed out twice'
+        # a live lease is only handed to its holder, its child or the server it was reserved for
+        import subprocess
+        other = subprocess.Popen(['sleep', '30'])
+        port = cls.reserve_ports(n=1, pid=other.pid, name='other')[0]
+        assert not cls.claim_port(port), 'claimed a port leased to another process'
+        assert cls.claim_port(port, name='other')
+        assert cls.claim_port(port), 'could not claim its own lease'
+        other.kill()
+        other.wait()
+        reserved_ports = cls.unreserve_ports(ports + more_ports + [port])
+        assert not any(p in reserved_ports for p in ports + more_ports)
+        return {'success': True, 'ports': ports + more_ports}
+
     @classmethod
     def check_used_ports(cls, start_port = 8501, end_port = 8600, timeout=5):
         port_range = [start_port, end_port]
@@ -1,7 +1,7 @@
 
 import os
 import commune as c
-from typing import Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 class OsModule(c.Module):
     @staticmethod
@@ -188,6 +188,69 @@ class OsModule(c.Module):
     def add_rsa_key(self, b=2048, t='rsa'):
         return c.cmd(f"ssh-keygen -b {b} -t {t}")
     
+    cmd_chunk_size = 64 * 1024 # bytes read from a pipe at a time
+    cmd_kill_timeout = 3 # seconds between SIGTERM and SIGKILL of a timed out command
+
+    @staticmethod
+    def cmd_args(command:Union[str, list], args:list = None, sudo:bool = False, bash:bool = False) -> List[str]:
+        """
+        The argv of a command: a list is taken as is and a string is split like a shell would,
+        args are appended as one argument each. With bash a string goes to bash -c unchanged.
+        """
+        import shlex
+        args = [str(a) for a in (args or [])]
+        if bash:
+            script = command if isinstance(command, str) else shlex.join(map(str, command))
+            script = ' '.join([script] + [shlex.quote(a) for a in args])
+            return ['bash', '-c', f'sudo {script}' if sudo else script]
+        argv = shlex.split(command) if isinstance(command, str) else [str(a) for a in command]
+        return (['sudo'] if sudo else []) + argv + args
+
+    @classmethod
+    def read_process(cls, process:'subprocess.Popen', timeout:float = None, chunk_size:int = None):
+        """
+        Yields (stream, bytes) chunks from the stdout and stderr pipes as they arrive,
+        without blocking on either one. Raises TimeoutError once the timeout has passed.
+        """
+        import selectors
+        import time
+        chunk_size = chunk_size or cls.cmd_chunk_size
+        deadline = None if timeout == None else time.time() + timeout
+        selector = selectors.DefaultSelector()
+        for stream in ['stdout', 'stderr']:
+            pipe = getattr(process, stream)
+            if pipe != None:
+                selector.register(pipe, selectors.EVENT_READ, stream)
+        try:
+            while len(selector.get_map()) > 0:
+                remaining = None if deadline == None else deadline - time.time()
+                if remaining != None and remaining <= 0:
+                    raise TimeoutError(f'command {process.args} timed out after {timeout}s')
+                for key, _ in selector.select(remaining):
+                    data = os.read(key.fd, chunk_size)
+                    if data:
+                        yield key.data, data
+                    else:
+                        selector.unregister(key.fileobj)
+        finally:
+            selector.close()
+
+    @classmethod
+    def kill_group(cls, process:'subprocess.Popen', timeout:float = None):
+        """ SIGTERM the process group of a command started in its own session, SIGKILL it if it lingers """
+        import signal
+        import subprocess
+        timeout = cls.cmd_kill_timeout if timeout == None else timeout
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            process.kill() if process.poll() == None else None
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
     @classmethod
     def cmd(cls, 
                     command:Union[str, list],
@@ -201,77 +264,171 @@ class OsModule(c.Module):
                     generator: bool =  False,
                     color : str = 'white',
                     cwd : str = None,
+                    timeout : float = None,
                     **kwargs) -> 'subprocess.Popen':
         
         '''
-        Runs  a command in the shell.
-        
+        Runs  a command in the shell and returns its output, stderr merged into stdout.
+        The output is read in chunks, generator=True yields it as it arrives.
+        With a timeout the command runs in its own process group, which is killed when it expires.
         '''
         import subprocess
-        import shlex
-        
-        if len(args) > 0:
-            command = ' '.join([command] + list(args))
+        import codecs
 
-        
-        def kill_process(process):
-            import signal
-            process.stdout.close()
-            process.send_signal(signal.SIGINT)
-            process.wait()
-            # sys.exit(0)
-            
         if password != None:
             sudo = True
-            
-        if sudo:
-            command = f'sudo {command}'
-            
-            
-        if bash:
-            command = f'bash -c "{command}"'
 
-        process = subprocess.Popen(shlex.split(command),
+        process = subprocess.Popen(cls.cmd_args(command, args, sudo=sudo, bash=bash),
                                     stdout=subprocess.PIPE, 
                                     stderr=subprocess.STDOUT,
                                     cwd = cwd,
-                                    env={**os.environ, **env}, **kwargs)
+                                    env={**os.environ, **env},
+                                    start_new_session= timeout != None,
+                                    **kwargs)
         
         if return_process:
             return process
 
         def stream_output(process):
-            pipe = process.stdout
-            for ch in iter(lambda: pipe.read(1), b""):
-                # if the the terminal is stuck and needs to enter
-                process.poll() 
-                try:
-                    yield ch.decode()
-                except Exception as e:
-                    pass       
-            kill_process(process)
-
-
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            try:
+                for _, data in cls.read_process(process, timeout=timeout):
+                    text = decoder.decode(data)
+                    if text:
+                        yield text
+                text = decoder.decode(b'', final=True)
+                if text:
+                    yield text
+                process.wait()
+            finally:
+                # a timeout, an interrupt or an abandoned generator
+                if process.poll() == None:
+                    cls.kill_group(process) if timeout != None else (process.kill(), process.wait())
 
         if generator:
             return stream_output(process)
 
-        else:
-            text = ''
-            new_line = ''
-            
-            for ch in stream_output(process):
-                
-                text += ch
-                # only for verbose
-                if verbose:
-                    new_line += ch
+        chunks = []
+        new_line = ''
+        for text in stream_output(process):
+            chunks.append(text)
+            # only for verbose
+            if verbose:
+                lines = (new_line + text).split('\n')
+                new_line = lines.pop()
+                for line in lines:
+                    c.print(line, color=color)
+        if verbose and new_line:
+            c.print(new_line, color=color)
+        return ''.join(chunks)
+
+    @classmethod
+    def run_cmd(cls,
+                command:Union[str, list],
+                timeout:float = None,
+                cwd:str = None,
+                env:Dict[str, str] = None,
+                sudo:bool = False,
+                bash:bool = False,
+                merge_stderr:bool = False,
+                chunk_size:int = None) -> Dict[str, Any]:
+        """
+        Runs a command to completion in its own process group and returns a structured result
+        with the exit code, stdout and stderr captured separately, their sizes and the duration.
+        The whole group is killed when the timeout expires.
+        """
+        import subprocess
+        import time
+        t = time.time()
+        process = subprocess.Popen(cls.cmd_args(command, sudo=sudo, bash=bash),
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+                                   stdin=subprocess.DEVNULL,
+                                   cwd=cwd,
+                                   env={**os.environ, **(env or {})},
+                                   start_new_session=True)
+        output = {'stdout': [], 'stderr': []}
+        timed_out = False
+        try:
+            for stream, data in cls.read_process(process, timeout=timeout, chunk_size=chunk_size):
+                output[stream].append(data)
+            remaining = None if timeout == None else max(timeout - (time.time() - t), 0)
+            process.wait(timeout=remaining)
+        except (TimeoutError, subprocess.TimeoutExpired):
+            timed_out = True
+        finally:
+            # the group also holds the background children of a shell that timed out
+            if timed_out or process.poll() == None:
+                cls.kill_group(process)
+        stdout, stderr = b''.join(output['stdout']), b''.join(output['stderr'])
+        return {'command': command,
+                'success': process.returncode == 0 and not timed_out,
+                'returncode': process.returncode,
+                'timed_out': timed_out,
+                'duration': time.time() - t,
+                'stdout': stdout.decode(errors='replace'),
+                'stderr': stderr.decode(errors='replace'),
+                'stdout_bytes': len(stdout),
+                'stderr_bytes': len(stderr)}
+
+    @classmethod
+    def run_cmds(cls, commands:List[Union[str, list]], max_workers:int = None, timeout:float = None, **kwargs) -> List[Dict[str, Any]]:
+        """ Runs many commands at once, at most max_workers at a time, results follow the order of commands. """
+        from concurrent.futures import ThreadPoolExecutor
+        if len(commands) == 0:
+            return []
+        max_workers = max_workers or min(len(commands), 4 * (os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda command: cls.run_cmd(command, timeout=timeout, **kwargs), commands))
 
-                    if ch == '\n':
-                        c.print(new_line[:-1], color=color)
-                        new_line = ''
+    @classmethod
+    def cmd_benchmark(cls, mb:int = 5, n:int = 50) -> Dict[str, float]:
+        """ MB/s of c.cmd and run_cmd against subprocess.run, and n commands run serially vs concurrently """
+        import subprocess
+        import time
+        command = f'head -c {mb * 1024**2} /dev/urandom | base64'
+        results = {}
+        for name, fn in [('cmd', lambda: c.cmd(command, bash=True)),
+                         ('run_cmd', lambda: cls.run_cmd(command, bash=True)['stdout']),
+                         ('subprocess.run', lambda: subprocess.run(['bash', '-c', command], capture_output=True).stdout)]:
+            t = time.time()
+            size = len(fn())
+            results[f'{name}_mbps'] = size / 1024**2 / (time.time() - t)
+        commands = ['sleep 0.05'] * n
+        t = time.time()
+        [cls.run_cmd(command) for command in commands]
+        results['serial_s'] = time.time() - t
+        t = time.time()
+        cls.run_cmds(commands)
+        results['concurrent_s'] = time.time() - t
+        return results
 
-        return text
+    @classmethod
+    def test_cmd(cls):
+        import tempfile
+        text = 'héllo\n' * 100000
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+            f.write(text)
+            f.flush()
+            assert c.cmd(f'cat {f.name}') == text, 'multi byte chars split across chunks'
+        assert ''.join(c.cmd('echo hi', generator=True)) == 'hi\n'
+        # list items stay one argument each, nothing in them is parsed again
+        assert cls.run_cmd(['printf', '%s|', 'a b', '"q"', '$HOME'])['stdout'] == 'a b|"q"|$HOME|'
+        assert c.cmd('printf %s|', 'a b', 'c') == 'a b|c|'
+        assert cls.run_cmd(['printf', '%s|', 'a b'], bash=True)['stdout'] == 'a b|'
+        result = cls.run_cmd('echo out; echo err >&2; exit 3', bash=True)
+        assert (result['stdout'], result['stderr'], result['returncode']) == ('out\n', 'err\n', 3), result
+        # a timeout kills the background children of the shell too
+        result = cls.run_cmd('sleep 30 & echo $!; wait', bash=True, timeout=0.5)
+        assert result['timed_out'], result
+        for _ in range(20):
+            if not os.path.exists(f'/proc/{int(result["stdout"])}'):
+                break
+            c.sleep(0.1)
+        assert not os.path.exists(f'/proc/{int(result["stdout"])}'), 'background child survived the timeout'
+        results = cls.run_cmds([f'echo {i}' for i in range(20)], max_workers=4)
+        assert [r['stdout'] for r in results] == [f'{i}\n' for i in range(20)]
+        return {'success': True, 'msg': 'cmd test passed'}
 
 
     @staticmethod
@@ -515,6 +672,8 @@ class OsModule(c.Module):
                  end_line:int = None ) -> str:
         # Get the absolute path of the file
         path = c.resolve_path(path)
+        if tail != None and tail > 0 and start_byte == 0 and end_byte == 0:
+            return c.tail_text(path, tail)
 
         # Read the contents of the file
         with open(path, 'rb') as file:
@@ -3,6 +3,8 @@ import streamlit as st
 from typing import *
 import os
 import json
+import time
+import threading
 
 class Remote(c.Module):
 
@@ -16,6 +18,99 @@ class Remote(c.Module):
         self.host_data_path = path
         return {'status': 'success', 'msg': f'Host data path set to {path}'}
 
+    ssh_clients = {} # (host, port, user) -> connected paramiko client, shared by every command to that host
+    ssh_clients_lock = threading.Lock()
+    max_workers = 64 # hosts in flight at once for fleet commands
+
+    def resolve_host(self, host:str = None, port = None, user = None, password = None) -> dict:
+        hosts = self.hosts()
+        if host in hosts:
+            host = dict(hosts[host])
+        elif port == None or user == None or password == None:
+            assert host == None, f'Host {host} not found'
+            host = dict(list(hosts.values())[0])
+        else:
+            host = {'host': host, 'port': port, 'user': user, 'pwd': password}
+        host['name'] = f'{host["user"]}@{host["host"]}:{host["port"]}'
+        return host
+
+    @classmethod
+    def ssh_client(cls, host:dict, timeout:int = 10, key_policy = 'auto_add_policy', refresh:bool = False):
+        """
+        Returns a connected client for {host}, the handshake and auth happen once and every later 
+        command opens a new channel on the same transport.
+        """
+        import paramiko
+        client_key = (host['host'], int(host['port']), host['user'])
+        with cls.ssh_clients_lock:
+            lock = cls.ssh_clients.setdefault(('lock',) + client_key, threading.Lock())
+        # one handshake per host, the other threads for that host wait for it
+        with lock:
+            client = cls.ssh_clients.get(client_key)
+            transport = client.get_transport() if client != None else None
+            if refresh or transport == None or not transport.is_active():
+                if client != None:
+                    client.close()
+                client = paramiko.SSHClient()
+                # Automatically add the server's host key (this is insecure and used for demonstration; 
+                # in production, you should have the remote server's public key in known_hosts)
+                if key_policy == 'auto_add_policy':
+                    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                else:
+                    client.load_system_host_keys()
+                client.connect(host['host'],
+                               port=host['port'], 
+                               username=host['user'], 
+                               password=host['pwd'],
+                               timeout=timeout,
+                               banner_timeout=timeout,
+                               auth_timeout=timeout)
+                client.get_transport().set_keepalive(30)
+                cls.ssh_clients[client_key] = client
+        return client
+
+    @classmethod
+    def close_clients(cls):
+        with cls.ssh_clients_lock:
+            clients = {k:v for k,v in cls.ssh_clients.items() if k[0] != 'lock'}
+            for k, client in clients.items():
+                client.close()
+                cls.ssh_clients.pop(k)
+        return {'status': 'success', 'msg': f'Closed {len(clients)} ssh connections'}
+
+    @staticmethod
+    def read_channel(channel, timeout:int = 10, chunk_size:int = 32768, poll_interval:float = 0.01, result:dict = None):
+        """
+        Yields the lines of stdout and stderr as they arrive until the command exits,
+        or until it has been silent for {timeout} seconds. The exit code is written into {result}.
+        """
+        result = {} if result == None else result
+        deadline = time.time() + timeout
+        buffers = {'stdout': b'', 'stderr': b''}
+        readers = {'stdout': (channel.recv_ready, channel.recv), 'stderr': (channel.recv_stderr_ready, channel.recv_stderr)}
+        while True:
+            received = False
+            for stream, (ready, recv) in readers.items():
+                while ready():
+                    buffers[stream] += recv(chunk_size)
+                    received = True
+                    deadline = time.time() + timeout
+                *lines, buffers[stream] = buffers[stream].split(b'\n')
+                for line in lines:
+                    yield line.decode('utf-8', errors='replace') + '\n'
+            if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+            if time.time() > deadline:
+                channel.close()
+                result['exit_code'] = None
+                raise TimeoutError(f'Command gave no output for {timeout}s')
+            if not received:
+                time.sleep(poll_interval)
+        for stream in buffers:
+            if len(buffers[stream]) > 0:
+                yield buffers[stream].decode('utf-8', errors='replace')
+        result['exit_code'] = channel.recv_exit_status()
+
     def ssh_cmd(self, *cmd_args, 
                 cmd : str = None,
                 port = None, 
@@ -30,6 +125,8 @@ class Remote(c.Module):
                 timeout=10,  
                 container = None,
                 key_policy = 'auto_add_policy',
+                result:dict = None,
+                color:str = None,
                 **kwargs ):
         """s
         Run a command on a remote server using Remote.
@@ -41,43 +138,7 @@ class Remote(c.Module):
         :param command: Command to be executed on the remote machine.
         :return: Command output.
         """
-
-        import paramiko
-        
-        if host == None:
-            if port == None or user == None or password == None:
-                host = list(self.hosts().values())[0]
-            else:
-                host = {
-                    'host': host,
-                    'port': port,
-                    'user': user,
-                    'pwd': password,
-                }
-        else:
-            host = self.hosts().get(host, None)
-        
-
-        host['name'] = f'{host["user"]}@{host["host"]}:{host["port"]}'
-
-            
-
-
-
-        # Create an Remote client instance.
-        client = paramiko.SSHClient()
-        # Automatically add the server's host key (this is insecure and used for demonstration; 
-        # in production, you should have the remote server's public key in known_hosts)
-        if key_policy == 'auto_add_policy':
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        else:
-            client.load_system_host_keys()
-                
-        # Connect to the remote server
-        client.connect(host['host'],
-                       port=host['port'], 
-                       username=host['user'], 
-                       password=host['pwd'])
+        host = self.resolve_host(host=host, port=port, user=user, password=password)
 
         # THE COMMAND
 
@@ -94,48 +155,30 @@ class Remote(c.Module):
         if container != None:
             command = f'docker exec {container} {command}'
 
-        c.print(f'Running --> (command={command} host={host["name"]} sudo={sudo} cwd={cwd})')
-
-        stdin, stdout, stderr = client.exec_command(command)
+        c.print(f'Running --> (command={command} host={host["name"]} sudo={sudo} cwd={cwd})', verbose=verbose)
 
+        client = self.ssh_client(host, timeout=timeout, key_policy=key_policy)
         try:
-            if sudo:
-                
-                stdin.write(host['pwd'] + "\n") # Send the password for sudo commands
-                stdin.flush() # Send the password
-
-            color = c.random_color()
-            # Print the output of ls command
-
-            def print_output():
-                for line in stdout.readlines():
-                    if verbose:
-                        c.print(f'[bold]{host["name"]}[/bold]', line.strip('\n'), color=color)
-                    yield line 
-
-                # if there is an stderr, print it
-
-                for line in stderr.readlines():
-                    if verbose:
-                        c.print(f'[bold]{host["name"]}[/bold]', line.strip('\n'))
-                    yield line
-
-            if stream:
-                return print_output()
-            else:
-                output = ''
-                for line in print_output():
-                    output += line 
-
-
-            del stdin, stdout, stderr, client
-
-        except Exception as e:
-            c.print(e)
+            channel = client.get_transport().open_session(timeout=timeout)
+        except Exception:
+            # the pooled connection went stale, reconnect once
+            client = self.ssh_client(host, timeout=timeout, key_policy=key_policy, refresh=True)
+            channel = client.get_transport().open_session(timeout=timeout)
+        channel.exec_command(command)
+        if sudo:
+            channel.sendall((host['pwd'] + "\n").encode()) # Send the password for sudo commands
+
+        color = color or c.random_color()
+        def print_output():
+            for line in self.read_channel(channel, timeout=timeout, result=result):
+                if verbose:
+                    c.print(f'[bold]{host["name"]}[/bold]', line.strip('\n'), color=color)
+                yield line 
+
+        if stream:
+            return print_output()
+        return ''.join(print_output())
 
-        return output
-
-    
     def add_host(self, 
                  host:str = '0.0.0.0',
                  port:int = 22,
@@ -252,58 +295,82 @@ class Remote(c.Module):
         # Test Remote
         c.print(self.ssh_cmd('ls'))
 
-    def cmd(self, *commands, 
-            search=None, 
-            hosts:Union[list, dict, str] = None, 
-            cwd=None,
-              host:str=None,  
-              timeout=5 , 
-              verbose:bool = True,**kwargs):
+    def resolve_hosts(self, hosts:Union[list, dict, str] = None, host:str = None, search:str = None) -> dict:
         if hosts == None:
             hosts = self.hosts()
             if host != None:
                 hosts = {host:hosts[host]}
-        if search != None:
-            hosts = {k:v for k,v in hosts.items() if search in k}
         if isinstance(hosts, list):
-            hosts = {h:hosts[h] for h in hosts}
+            all_hosts = self.hosts()
+            hosts = {h:all_hosts[h] for h in hosts}
         elif isinstance(hosts, str):
-            hosts = {hosts:self.hosts(hosts)}
-
+            hosts = self.hosts(hosts)
+        if search != None:
+            hosts = {k:v for k,v in hosts.items() if search in k}
         assert isinstance(hosts, dict), f'Hosts must be a dict, got {type(hosts)}'
+        return hosts
 
-        results = {}
-        errors = {}
-        host2future = {}
-        for host in hosts:
-            host2future[host] = c.submit(self.ssh_cmd, 
-                                            args=commands, 
-                                            kwargs=dict(host=host, cwd=cwd, verbose=verbose,**kwargs),
-                                            return_future=True
-                                            )
-        future2host = {v:k for k,v in host2future.items()}
-
-
-        try:
-            for future in c.as_completed(list(host2future.values()), timeout=timeout):
-                result = future.result()
-                host = future2host[future]
-                if not c.is_error(result):
-                    results[host] = result
-                else:
-                    errors[host]= result
-        except Exception as e:
-            c.print(e)
-
+    def fleet_cmd(self, *commands, 
+                  search=None, 
+                  hosts:Union[list, dict, str] = None, 
+                  host:str = None,
+                  cwd=None,
+                  timeout=5, 
+                  max_workers:int = None,
+                  verbose:bool = True, 
+                  **kwargs) -> dict:
+        """
+        Runs the command on every host over the pooled connections, at most {max_workers} hosts at once.
+        Output is printed per host as it streams in, a host times out after {timeout} seconds without output.
+        Returns {host: {'output', 'exit_code', 'time', 'error'}}.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        hosts = self.resolve_hosts(hosts=hosts, host=host, search=search)
+        if len(hosts) == 0:
+            return {}
+        colors = {h: c.random_color() for h in hosts}
+        def run(h):
+            result = {'output': '', 'exit_code': None, 'time': time.time(), 'error': None}
+            try:
+                output = self.ssh_cmd(*commands, host=h, cwd=cwd, timeout=timeout, verbose=verbose, 
+                                      color=colors[h], result=result, **kwargs)
+                result['output'] = output.strip('\n')
+            except Exception as e:
+                result['error'] = f'{type(e).__name__}: {e}'
+            result['time'] = time.time() - result['time']
+            return result
+        max_workers = min(max_workers or self.max_workers, len(hosts))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(hosts, executor.map(run, hosts)))
+        return results
 
-        if all([v == None for v in results.values()]):
-            raise Exception(f'all results are None')
-        
-        for k,v in results.items():
-            if isinstance(v, str):
-                results[k] = v.strip('\n')
+    def summary(self, results:dict) -> 'pd.DataFrame':
+        import pandas as pd
+        rows = []
+        for h, r in results.items():
+            rows += [{'host': h, 
+                      'status': 'error' if r['error'] else ('ok' if r['exit_code'] == 0 else 'failed'), 
+                      'exit_code': r['exit_code'], 
+                      'time': round(r['time'], 3), 
+                      'lines': len(r['output'].split('\n')) if r['output'] else 0, 
+                      'error': r['error'] or ''}]
+        return pd.DataFrame(rows).sort_values(['status', 'host'])
 
-        return results 
+    def cmd(self, *commands, 
+            search=None, 
+            hosts:Union[list, dict, str] = None, 
+            cwd=None,
+              host:str=None,  
+              timeout=5 , 
+              max_workers:int = None,
+              verbose:bool = True,**kwargs):
+        results = self.fleet_cmd(*commands, search=search, hosts=hosts, host=host, cwd=cwd, 
+                                 timeout=timeout, max_workers=max_workers, verbose=verbose, **kwargs)
+        if verbose and len(results) > 0:
+            c.print(self.summary(results))
+        if len(results) > 0 and all([r['error'] != None for r in results.values()]):
+            raise Exception(f'all hosts failed {[r["error"] for r in results.values()]}')
+        return {h: r['output'] for h, r in results.items() if r['error'] == None}
 
     def add_admin(self, timeout=10):
         root_key_address = c.root_key().ss58_address
@@ -326,31 +393,26 @@ class Remote(c.Module):
             c.print(f'[bold yellow]{name}[/bold yellow]')
             c.print('\n'.join(logs.split('\n')[-10:]))
 
-    def push(self,**kwargs):
-        return [c.push(), self.pull()]
+    def pull(self, stash=True, hosts=None, timeout=120, **kwargs):
+        return self.cmd(f'c pull stash={stash}', hosts=hosts, timeout=timeout, **kwargs)
 
-        
-    def pull(self, stash=True, hosts=None):
-        return c.rcmd(f'c pull stash={stash}', hosts=hosts)
-    
-
-
-    def push(self):
+    def push(self, timeout=120):
         c.push()
-        c.rcmd('c pull', verbose=True)
-        c.rcmd('c serve', verbose=True)
+        self.pull(timeout=timeout, verbose=True)
+        self.cmd('c serve', timeout=timeout, verbose=True)
         c.add_peers()
 
+    def restart(self, module:str = 'module', timeout=120, **kwargs):
+        return self.cmd(f'c restart {module}', timeout=timeout, **kwargs)
 
-    
-
-    def setup(self,**kwargs):
+    def setup(self, timeout=600, **kwargs):
         repo_url = c.repo_url()
-        c.print(self.cmd(f'git clone {repo_url}', **kwargs))
-        c.print(self.cmd(f'apt ', **kwargs))
-        c.print(self.cmd(f'cd commune && pip install -e .', **kwargs))
-        c.print(self.cmd(f'c add_admin {c.root_key().ss58_address} ', **kwargs))
-        c.print(self.cmd(f'c serve', **kwargs))
+        # one round trip per host, each step only runs if the previous one worked
+        steps = [f'(git clone {repo_url} || true)', 
+                 'cd commune && pip install -e .', 
+                 f'c add_admin {c.root_key().ss58_address}', 
+                 'c serve']
+        return self.cmd(' && '.join(steps), timeout=timeout, **kwargs)
 
     def enter(self, host='root10'):
         host2ssh  = self.host2ssh()
@@ -471,7 +533,7 @@ class Remote(c.Module):
             
         for name, address in c.shuffle(list(namespace.items()))[:n]:
             c.print(f'Calling {name} {address}')
-            futures[name] = c.async_call(address, fn, *args)
+            futures[name] = c.async_call(address, fn, *args, timeout=timeout)
         
         if return_future:
             if len(futures) == 1:
@@ -66,7 +66,15 @@ class Access(c.Module):
         self.address2key = c.address2key()
         if time_since_sync > self.config.sync_interval:
             self.subspace = c.module('subspace')(network=self.config.network)
-            state['stakes'] = self.subspace.stakes(fmt='j', netuid='all', update=False, max_age=self.config.max_age)
+            # prefer the stakes published by a local subspace loop over querying the node
+            netuid2stakes = self.subspace.synced('stakes', network=self.config.network, max_age=self.config.max_age)
+            if netuid2stakes != None:
+                state['stakes'] = {}
+                for stakes in netuid2stakes.values():
+                    for k, v in stakes.items():
+                        state['stakes'][k] = state['stakes'].get(k, 0) + v
+            else:
+                state['stakes'] = self.subspace.stakes(fmt='j', netuid='all', update=False, max_age=self.config.max_age)
             self.state = state
             self.put(self.state_path, self.state)
             c.print(f'🔄 Synced {self.state_path} 🔄\033', color='yellow')
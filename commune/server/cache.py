@@ -0,0 +1,182 @@
+import commune as c
+from typing import *
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class Cache(c.Module):
+    """
+    Server side response cache for deterministic module functions.
+    Functions opt in through the module's cache_fns ({fn: ttl}) or the @c.cacheable decorator.
+    Entries are keyed on the canonical hash of (fn, args, kwargs), evicted by LRU under an item
+    and byte bound, and expire after their ttl. Concurrent identical calls are coalesced so
+    the function runs once and every caller gets the same result (single-flight).
+    """
+
+    def __init__(self,
+                 module: Union[c.Module, str] = None,
+                 max_items: int = 4096, # max number of cached responses
+                 max_bytes: int = 256 * 1024**2, # max memory of cached responses
+                 ttl: float = 60, # default ttl for functions marked without one
+                 **kwargs):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.default_ttl = ttl
+        self.store = OrderedDict() # key -> {'fn', 'value', 'expires', 'size'}
+        self.inflight = {} # key -> Future of the leading call
+        self.lock = threading.Lock()
+        self.size = 0
+        self.fn_stats = {}
+        self.set_module(module)
+
+    def set_module(self, module: Union[c.Module, str] = None):
+        module = module or c.module('module')()
+        if isinstance(module, str):
+            module = c.module(module)()
+        self.module = module
+        self.fn2ttl = {}
+        for fn, ttl in dict(getattr(module, 'cache_fns', {}) or {}).items():
+            self.fn2ttl[fn] = self.default_ttl if ttl in [None, True] else ttl
+        for fn in module.functions():
+            fn_obj = getattr(module, fn, None)
+            cache_config = getattr(fn_obj, '__cache__', None)
+            if isinstance(cache_config, dict):
+                self.fn2ttl[fn] = cache_config.get('ttl', self.default_ttl)
+        return {'success': True, 'msg': f'caching {list(self.fn2ttl.keys())}'}
+
+    def cacheable(self, fn: str) -> bool:
+        ttl = self.fn2ttl.get(fn, None)
+        return ttl not in [None, False] and ttl > 0
+
+    @staticmethod
+    def hash_request(fn: str, args: list = None, kwargs: dict = None) -> str:
+        """ Canonical hash of a call, kwargs order and tuple/list do not matter. """
+        request = json.dumps([fn, list(args or []), kwargs or {}], sort_keys=True, default=str, separators=(',', ':'))
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def stats_for(self, fn: str) -> dict:
+        if fn not in self.fn_stats:
+            self.fn_stats[fn] = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'errors': 0}
+        return self.fn_stats[fn]
+
+    def forward(self, fn: str, args: list = None, kwargs: dict = None, fn_obj: Callable = None):
+        """ Calls fn through the cache, fn_obj defaults to the module's attribute. """
+        args = args or []
+        kwargs = kwargs or {}
+        if fn_obj == None:
+            fn_obj = getattr(self.module, fn)
+        call = lambda: fn_obj(*args, **kwargs) if callable(fn_obj) else fn_obj
+        if not self.cacheable(fn):
+            return call()
+
+        key = self.hash_request(fn, args, kwargs)
+        with self.lock:
+            stats = self.stats_for(fn)
+            entry = self.store.get(key, None)
+            if entry != None and entry['expires'] > time.time():
+                self.store.move_to_end(key)
+                stats['hits'] += 1
+                return entry['value']
+            future = self.inflight.get(key, None)
+            leader = future == None
+            if leader:
+                future = self.inflight[key] = Future()
+                stats['misses'] += 1
+            else:
+                stats['coalesced'] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = call()
+        except Exception as e:
+            with self.lock:
+                stats['errors'] += 1
+                self.inflight.pop(key, None)
+            future.set_exception(e)
+            raise e
+
+        with self.lock:
+            self.inflight.pop(key, None)
+            # generators are consumed by the stream and errors should be retried
+            if not c.is_generator(result) and not (isinstance(result, dict) and result.get('success', True) == False):
+                self.put_entry(key, fn, result)
+        future.set_result(result)
+        return result
+
+    def put_entry(self, key: str, fn: str, value: Any):
+        """ Stores a response and evicts the least recently used ones over the bounds (call under the lock). """
+        size = c.sizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self.store:
+            self.size -= self.store.pop(key)['size']
+        self.store[key] = {'fn': fn, 'value': value, 'expires': time.time() + self.fn2ttl[fn], 'size': size}
+        self.size += size
+        now = time.time()
+        while len(self.store) > self.max_items or self.size > self.max_bytes:
+            old_key, old = self.store.popitem(last=False)
+            self.size -= old['size']
+            if old['expires'] > now:
+                self.stats_for(old['fn'])['evictions'] += 1
+
+    def rm_expired(self) -> int:
+        now = time.time()
+        with self.lock:
+            expired = [k for k, v in self.store.items() if v['expires'] <= now]
+            for k in expired:
+                self.size -= self.store.pop(k)['size']
+        return len(expired)
+
+    def clear(self, fn: str = None):
+        with self.lock:
+            keys = [k for k, v in self.store.items() if fn == None or v['fn'] == fn]
+            for k in keys:
+                self.size -= self.store.pop(k)['size']
+        return {'success': True, 'msg': f'cleared {len(keys)} entries'}
+
+    def stats(self) -> dict:
+        with self.lock:
+            fns = {fn: {**s, 'hit_rate': round((s['hits'] + s['coalesced']) / max(s['hits'] + s['coalesced'] + s['misses'], 1), 4)}
+                   for fn, s in self.fn_stats.items()}
+            hits = sum(s['hits'] + s['coalesced'] for s in self.fn_stats.values())
+            total = hits + sum(s['misses'] for s in self.fn_stats.values())
+            return {'items': len(self.store),
+                    'bytes': self.size,
+                    'inflight': len(self.inflight),
+                    'hit_rate': round(hits / max(total, 1), 4),
+                    'fns': fns}
+
+    @classmethod
+    def test(cls, n: int = 8):
+        module = c.module('module')()
+        calls = []
+        def slow_add(a, b=1):
+            calls.append((a, b))
+            time.sleep(0.2)
+            return a + b
+        module.slow_add = slow_add
+        module.cache_fns = {'slow_add': 10}
+        self = cls(module=module, max_items=2)
+
+        # concurrent identical calls compute once
+        futures = [c.submit(self.forward, kwargs={'fn': 'slow_add', 'args': [1], 'kwargs': {'b': 2}}) for _ in range(n)]
+        results = [f.result() for f in futures]
+        assert results == [3] * n and len(calls) == 1, f'{len(calls)} calls for {n} identical requests'
+        assert self.forward('slow_add', [1], {'b': 2}) == 3 and len(calls) == 1
+
+        # lru bound
+        self.forward('slow_add', [2])
+        self.forward('slow_add', [3])
+        assert len(self.store) == 2 and self.stats()['fns']['slow_add']['evictions'] == 1
+
+        # uncached functions pass through
+        assert self.forward('fns') == module.fns()
+        stats = self.stats()
+        assert stats['fns']['slow_add']['misses'] == 3
+        return {'success': True, 'stats': stats}
@@ -1,9 +1,11 @@
+import os
 import commune as c
 import pandas as pd
 from typing import *
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+from commune.utils.metric import Metrics
 
 class Server(c.Module):
     def __init__(
@@ -17,6 +19,7 @@ class Server(c.Module):
         key = None,
         verbose: bool = False,
         access_module: str = 'server.access',
+        cache_module: str = 'server.cache',
         serializer: str = 'serializer',
         free: bool = False,
         access_token_feature : str = 'access_token',
@@ -38,7 +41,7 @@ class Server(c.Module):
         self.access_token_feature = access_token_feature
         self.serializer = c.module(serializer)()
         self.set_history_path(history_path)
-        self.set_module(module, key=key,  name=name,  port=port,  access_module=access_module)
+        self.set_module(module, key=key,  name=name,  port=port,  access_module=access_module, cache_module=cache_module)
 
     def forward(self, fn:str, input:dict):
         """
@@ -59,6 +62,7 @@ class Server(c.Module):
    
         """
         user_info = None
+        start_time = c.time()
 
         try:
             # you can verify the input with the server key class
@@ -99,6 +103,9 @@ class Server(c.Module):
             # here we want to verify the data is signed with the correct key
             request_staleness = c.timestamp() - input['data'].get('timestamp', 0)
             assert request_staleness < self.max_request_staleness, f"Request is too old, {request_staleness} > MAX_STALENESS ({self.max_request_staleness})  seconds old"
+            # the caller's latency budget, there is no point answering after it gave up
+            deadline = input['data'].get('deadline', None)
+            assert deadline == None or c.time() < deadline, f"Deadline exceeded by {c.time() - deadline:.3f} seconds"
             
             # verify the access module
             user_info = self.access_module.verify(fn=fn, address=input['address'])
@@ -109,7 +116,7 @@ class Server(c.Module):
             args = data.get('args',[])
             kwargs = data.get('kwargs', {})
             fn_obj = getattr(self.module, fn)
-            result = fn_obj(*args, **kwargs) if callable(fn_obj) else fn_obj
+            result = self.cache_module.forward(fn=fn, args=args, kwargs=kwargs, fn_obj=fn_obj)
             success = bool(isinstance(result, dict) and 'error' in result) 
 
             # if the result is a future, we need to wait for it to finish
@@ -131,6 +138,9 @@ class Server(c.Module):
         }
         if not success:
             output['error'] = result
+        # unknown fns share one name so callers cannot grow the metrics
+        self.metrics.observe(fn if fn in self.whitelist else 'unknown', c.time() - start_time,
+                             error=isinstance(result, dict) and 'error' in result)
         result = self.process_result(result)
 
         if self.save_history:
@@ -144,7 +154,8 @@ class Server(c.Module):
                    key=None, 
                    name=None, 
                    port=None, 
-                   access_module='server.access'):
+                   access_module='server.access',
+                   cache_module='server.cache'):
 
         module = module or 'module'
         if isinstance(module, str):
@@ -161,9 +172,9 @@ class Server(c.Module):
         self.name = module.server_name
         self.module = module 
         self.ip = c.ip()
-        port = port or c.free_port()
-        while c.port_used(port):
-            port =  c.free_port()
+        # lease the port to this process, the lease lives as long as the server does
+        if port == None or not c.network_module().claim_port(port, pid=os.getpid(), name=self.name):
+            port = c.free_port(pid=os.getpid(), name=self.name)
         self.port = port
         self.address = f"{self.ip}:{self.port}"
         module.address = self.address
@@ -177,6 +188,8 @@ class Server(c.Module):
         self.schema = module.schema() 
         self.key = self.module.key = c.get_key(key or self.name, create_if_not_exists=True)
         self.access_module = c.module(access_module)(module=self.module)  
+        self.cache_module = self.module.server_cache = c.module(cache_module)(module=self.module)
+        self.metrics = self.module.server_metrics = Metrics() # per fn latency, errors and rate
         self.set_api()
         return {'success': True, 'msg': f'Set module {module}', 'key': self.key.ss58_address}
 
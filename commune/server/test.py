@@ -39,7 +39,7 @@ class Test(c.Module):
         c.add_key(key_name)
         module = c.serve(module_name, key=key_name)
         key = c.get_key(key_name)
-        c.sleep(1)
+        c.wait_for_server(module_name)
         module = c.connect(module_name)
         info = module.info()
 
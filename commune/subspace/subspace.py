@@ -3,8 +3,10 @@ from retry import retry
 from typing import *
 import json
 import os
+import queue
 import commune as c
 import requests 
+import numpy as np
 from substrateinterface import SubstrateInterface
 
 U32_MAX = 2**32 - 1
@@ -673,11 +675,11 @@ class Subspace(c.Module):
 
         return x
     
-    def get_stake( self, key_ss58: str, block: Optional[int] = None, netuid:int = None , fmt='j', update=True ) -> Optional['Balance']:
+    def get_stake( self, key_ss58: str, block: Optional[int] = None, netuid:int = None , fmt='j', network:str = None, update=True ) -> Optional['Balance']:
         
         key_ss58 = self.resolve_key_ss58( key_ss58)
         netuid = self.resolve_netuid( netuid )
-        stake = self.query( 'Stake',params=[netuid, key_ss58], block=block , update=update)
+        stake = self.query( 'Stake',params=[netuid, key_ss58], block=block , network=network, update=update)
         return self.format_amount(stake, fmt=fmt)
 
 
@@ -960,45 +962,126 @@ class Subspace(c.Module):
  
 
 
-    def light_sync(self, network=None, remote:bool=True, netuids=None, local:bool=True, save:bool=True, timeout=20, **kwargs):
+    def sync_feature(self, feature:str = 'stakes', netuid:int = 0, network:str = 'main') -> Any:
+        """
+        Fetches the latest state of a synced feature for one subnet.
+        """
+        if feature == 'params':
+            return {**self.global_params(network=network, update=True),
+                    **self.subnet_params(netuid=netuid, network=network, update=True)}
+        feature2fn = {
+            'stakes': self.stakes,
+            'stake_from': self.stake_from,
+            'namespace': self.namespace,
+            'weights': self.weights,
+        }
+        assert feature in feature2fn, f"Invalid feature {feature}, options are {list(feature2fn.keys()) + ['params']}"
+        kwargs = {'fmt': 'j'} if feature in ['stakes', 'stake_from'] else {}
+        return feature2fn[feature](netuid=netuid, network=network, update=True, **kwargs)
+
+    def sync_features(self, 
+                      features:List[str] = None, 
+                      network:str = None, 
+                      netuids:List[int] = None, 
+                      block:int = None, 
+                      timeout:int = 60) -> dict:
+        """
+        Syncs the features for every subnet in parallel and publishes one versioned state per feature.
+        """
+        features = features or list(self.config.sync_schedule.keys())
+        network = self.resolve_network(network)
+        block = block or self.block
         netuids = self.netuids(network=network, update=True) if netuids == None else netuids
         assert len(netuids) > 0, f"No netuids found for network {network}"
-        stake_from_futures = []
-        namespace_futures = []
-        weight_futures = []
-        for netuid in netuids:
-            stake_from_futures += [c.asubmit(self.stake_from, netuid=netuid, network=network, update=True)]
-            namespace_futures += [c.asubmit(self.namespace, netuid=netuid, network=network, update=True)]
-            weight_futures += [c.asubmit(self.weights, netuid=netuid, network=network, update=True)]
+        jobs = [(feature, netuid) for feature in features for netuid in netuids]
+        futures = [c.submit(self.sync_feature, kwargs=dict(feature=feature, netuid=netuid, network=network), timeout=timeout) for feature, netuid in jobs]
+        feature2data = {feature: {} for feature in features}
+        for (feature, netuid), result in zip(jobs, c.wait(futures, timeout=timeout)):
+            feature2data[feature][netuid] = result
+        published = []
+        for feature, data in feature2data.items():
+            # only publish complete states, a failed subnet keeps the previous version
+            if any(v == None or c.is_error(v) for v in data.values()):
+                c.print(f'Failed to sync {feature} at block {block}', color='red')
+                continue
+            self.put_synced(feature, data, block=block, network=network)
+            published.append(feature)
+        return {'success': True, 'block': block, 'features': published}
 
-        c.gather(stake_from_futures + namespace_futures + weight_futures, timeout=timeout)
+    def light_sync(self, network=None, netuids=None, timeout=20, **kwargs):
+        return self.sync_features(features=['stake_from', 'namespace', 'weights'], network=network, netuids=netuids, timeout=timeout)
 
-        # c.print(namespace_list)
-        return {'success': True, 'block': self.block}
+    def synced_path(self, feature:str, network:str = 'main', version:int = None) -> str:
+        return f'synced/{network}/{feature}/' + ('latest' if version == None else str(version))
 
+    def put_synced(self, feature:str, data:dict, block:int, network:str = 'main') -> dict:
+        """
+        Writes an immutable state for the block, then atomically points latest to it.
+        """
+        self.put(self.synced_path(feature, network=network, version=block), data)
+        latest_path = self.resolve_path(self.synced_path(feature, network=network), extension='json')
+        tmp_path = latest_path + '.tmp'
+        c.put_text(tmp_path, json.dumps({'data': {'version': block}, 'timestamp': c.timestamp()}))
+        os.replace(tmp_path, latest_path)
+        versions = sorted(self.synced_versions(feature, network=network))
+        for version in versions[:-self.config.synced_versions]:
+            self.rm(self.synced_path(feature, network=network, version=version))
+        return {'feature': feature, 'version': block}
+
+    def synced_versions(self, feature:str, network:str = 'main') -> List[int]:
+        folder = os.path.dirname(self.resolve_path(self.synced_path(feature, network=network)))
+        if not os.path.isdir(folder):
+            return []
+        names = [f.split('.')[0] for f in os.listdir(folder)]
+        return [int(n) for n in names if n.isdigit()]
+
+    def synced_version(self, feature:str, network:str = 'main', max_age:int = None) -> Optional[int]:
+        latest = self.get(self.synced_path(feature, network=network), None, max_age=max_age)
+        return latest['version'] if isinstance(latest, dict) else None
+
+    def synced(self, feature:str = 'stakes', netuid:int = None, network:str = 'main', max_age:int = None, trials:int = 3) -> Any:
+        """
+        Reads the latest published state of a feature, None if there is none younger than max_age (seconds).
+        """
+        for _ in range(trials):
+            version = self.synced_version(feature, network=network, max_age=max_age)
+            if version == None:
+                return None
+            data = self.get(self.synced_path(feature, network=network, version=version), None)
+            # the version can be pruned between reading latest and the data, so read latest again
+            if data != None:
+                break
+        if data == None:
+            return None
+        data = {int(k): v for k, v in data.items()}
+        return data.get(netuid, None) if netuid != None else data
 
-    def loop(self, intervals = {'light': 5, 'full': 600}, network=None, remote:bool=True):
+    def loop(self, schedule:dict = None, network:str = None, netuids:List[int] = None, remote:bool = True, timeout:int = 60):
+        """
+        Follows the finalized heads and syncs each feature every schedule[feature] blocks.
+        Every sync is published as a versioned state, so processes on this host read
+        the chain state with self.synced instead of each querying the node.
+        """
         if remote:
-            return self.remote_fn('loop', kwargs=dict(intervals=intervals, network=network, remote=False))
-        last_update = {k:0 for k in intervals.keys()}
-        staleness = {k:0 for k in intervals.keys()}
-        c.get_event_loop()
+            return self.remote_fn('loop', kwargs=dict(schedule=schedule, network=network, netuids=netuids, remote=False, timeout=timeout))
+        schedule = schedule or self.config.sync_schedule
+        network = self.resolve_network(network)
+        last_sync = {feature: self.synced_version(feature, network=network) or 0 for feature in schedule}
 
-        while True:
-            block = self.block
-            timestamp = c.timestamp()
-            staleness = {k:timestamp - last_update[k] for k in intervals.keys()}
-            if staleness["full"] > intervals["full"]:
-                request = {
-                            'network': network, 
-                           'block': block
-                           }
-                try:
-                    self.sync(**request)
-                except Exception as e:
-                    c.print(e)
-                    continue
-                last_update['full'] = timestamp
+        def on_head(header, update_nr, subscription_id):
+            block = header['header']['number']
+            features = [f for f, cadence in schedule.items() if block - last_sync[f] >= cadence]
+            if len(features) == 0:
+                return
+            try:
+                response = self.sync_features(features=features, network=network, netuids=netuids, block=block, timeout=timeout)
+                last_sync.update({f: block for f in response['features']})
+                c.print(response)
+            except Exception as e:
+                c.print(c.detailed_error(e), color='red')
+
+        substrate = self.get_substrate(network=network, mode='ws', cache=False)
+        return substrate.subscribe_block_headers(on_head, finalized_only=True)
             
 
     def subnet_exists(self, subnet:str, network=None) -> bool:
@@ -1580,41 +1663,61 @@ class Subspace(c.Module):
         return self.block_time * self.subnet(netuid=netuid)['tempo']
 
     
-    def get_module(self, 
-                    module='vali',
-                    netuid=0,
-                    network='main',
-                    trials = 4,
-                    fmt='j',
-                    mode = 'http',
-                    block = None,
-                    max_age = None,
-                    lite = True, 
-                    **kwargs ) -> 'ModuleInfo':
-
-        url = self.resolve_url(network=network, mode=mode)
-        module_key = module
-        if not c.valid_ss58_address(module):
-            module_key = self.name2key(name=module, network=network, netuid=netuid, **kwargs)
-        netuid = self.resolve_netuid(netuid)
-        json={'id':1, 'jsonrpc':'2.0',  'method': 'subspace_getModuleInfo', 'params': [module_key, netuid]}
-        module = None
+    url2session = {}
+    def get_session(self, url:str, max_workers:int = 16) -> requests.Session:
+        """
+        Returns a pooled http session for the node url, so repeated rpc calls reuse connections.
+        """
+        if url not in self.url2session:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.url2session[url] = session
+        return self.url2session[url]
+
+    def rpc_batch(self, 
+                  method:str = 'subspace_getModuleInfo', 
+                  params_batch:List[list] = None,
+                  url:str = None,
+                  network:str = 'main',
+                  mode:str = 'http',
+                  trials:int = 4,
+                  timeout:int = 20) -> List[dict]:
+        """
+        Calls an rpc method once per params in a single json-rpc batch request.
+        Returns the results in the order of params_batch (None for failed calls).
+        """
+        params_batch = params_batch or []
+        if len(params_batch) == 0:
+            return []
+        url = url or self.resolve_url(network=network, mode=mode)
+        payload = [{'id': i, 'jsonrpc': '2.0', 'method': method, 'params': params} for i, params in enumerate(params_batch)]
+        session = self.get_session(url)
+        responses = None
         for i in range(trials):
             try:
-                module = requests.post(url,  json=json).json()
+                responses = session.post(url, json=payload, timeout=timeout).json()
                 break
             except Exception as e:
                 c.print(e)
                 continue
-        assert module != None, f"Failed to get module {module_key} after {trials} trials"
-        module = {**module['result']['stats'], **module['result']['params']}
+        assert responses != None, f"Failed to call {method} for {len(params_batch)} params after {trials} trials"
+        if isinstance(responses, dict):
+            responses = [responses]
+        # the node is free to answer a batch in any order
+        id2result = {r.get('id'): r.get('result') for r in responses if isinstance(r, dict)}
+        return [id2result.get(i) for i in range(len(params_batch))]
+
+    def format_module_info(self, module:dict, fmt:str='j', block:int=None, lite:bool=True) -> 'ModuleInfo':
+        module = {**module['stats'], **module['params']}
         # convert list of u8 into a string Vector<u8> to a string
         module['name'] = self.vec82str(module['name'])
         module['address'] = self.vec82str(module['address'])
         module['dividends'] = module['dividends'] / (U16_MAX)
         module['incentive'] = module['incentive'] / (U16_MAX)
         module['stake_from'] = {k:self.format_amount(v, fmt=fmt) for k,v in module['stake_from'].items()}
-        module['stake'] = sum([v for k,v in module['stake_from'].items() ])
+        module['stake'] = sum(module['stake_from'].values())
         module['emission'] = self.format_amount(module['emission'], fmt=fmt)
         module['key'] = module.pop('controller', None)
         module['metadata'] = module.pop('metadata', {})
@@ -1623,6 +1726,28 @@ class Subspace(c.Module):
         if lite :
             features = self.module_features + ['stake', 'vote_staleness']
             module = {f: module[f] for f in features}
+        return module
+
+    def get_module(self, 
+                    module='vali',
+                    netuid=0,
+                    network='main',
+                    trials = 4,
+                    fmt='j',
+                    mode = 'http',
+                    block = None,
+                    max_age = None,
+                    lite = True, 
+                    **kwargs ) -> 'ModuleInfo':
+
+        url = self.resolve_url(network=network, mode=mode)
+        module_key = module
+        if not c.valid_ss58_address(module):
+            module_key = self.name2key(name=module, network=network, netuid=netuid, **kwargs)
+        netuid = self.resolve_netuid(netuid)
+        module = self.rpc_batch(method='subspace_getModuleInfo', params_batch=[[module_key, netuid]], url=url, trials=trials)[0]
+        assert module != None, f"Failed to get module {module_key} after {trials} trials"
+        module = self.format_module_info(module, fmt=fmt, block=block, lite=lite)
         assert module['key'] == module_key, f"Key mismatch {module['key']} != {module_key}"
         return module
 
@@ -1631,7 +1756,7 @@ class Subspace(c.Module):
     
     @staticmethod
     def vec82str(l:list):
-        return ''.join([chr(x) for x in l]).strip()
+        return bytes(l).decode('utf-8', errors='ignore').strip()
 
     def get_modules(self, keys:list = None,
                          network='main',
@@ -1640,55 +1765,41 @@ class Subspace(c.Module):
                          fmt='j',
                          block = None,
                          update = False,
-                         batch_size = 8,
+                         batch_size = 256,
+                         mode = 'http',
+                         lite = True,
                            **kwargs) -> List['ModuleInfo']:
+        """
+        Gets the module info of many keys, sending batch_size getModuleInfo calls per json-rpc request.
+        """
         netuid = self.resolve_netuid(netuid)
         block = block or self.block
         if netuid == 'all':
             all_keys = self.keys(update=update, netuid=netuid)
             modules = {}
             for netuid in self.netuids():
-                module = self.get_modules(keys=all_keys[netuid], netuid=netuid,   **kwargs)
-                modules[netuid] = module.get(netuid, []) + [module]
+                modules[netuid] = self.get_modules(keys=all_keys[netuid], netuid=netuid, block=block, network=network, fmt=fmt, batch_size=batch_size, **kwargs)
             return modules
         if keys == None:
             keys = self.keys(update=update, netuid=netuid)
-        c.print(f'Querying {len(keys)} keys for modules')
-        if len(keys) >= batch_size:
-            key_batches = c.chunk(keys, chunk_size=batch_size)
-            futures = []
-            for key_batch in key_batches:
-                c.print(key_batch)
-                f = c.submit(self.get_modules, kwargs=dict(keys=key_batch,
-                                                        block=block, 
-                                                        network=network, 
-                                                        netuid=netuid, 
-                                                        batch_size=len(keys) + 1,
-                                                        timeout=timeout))
-                futures += [f]
-            module_batches = c.wait(futures, timeout=timeout)
-            c.print(module_batches)
-            name2module = {}
-            for module_batch in module_batches:
-                if isinstance(module_batch, list):
-                    for m in module_batch:
-                        if isinstance(m, dict) and 'name' in m:
-                            name2module[m['name']] = m
-                    
-            modules = list(name2module.values())
-            return modules
-        elif len(keys) == 0:
+        if len(keys) == 0:
             c.print('No keys found')
             return []
+        c.print(f'Querying {len(keys)} keys for modules')
+        url = self.resolve_url(network=network, mode=mode)
+        params_batches = [[[k, netuid] for k in keys[i:i+batch_size]] for i in range(0, len(keys), batch_size)]
+        if len(params_batches) == 1:
+            results = self.rpc_batch(params_batch=params_batches[0], url=url, timeout=timeout)
+        else:
+            futures = [c.submit(self.rpc_batch, kwargs=dict(params_batch=p, url=url, timeout=timeout), timeout=timeout) for p in params_batches]
+            results = []
+            for i, batch_results in enumerate(c.wait(futures, timeout=timeout)):
+                results += batch_results if isinstance(batch_results, list) else [None]*len(params_batches[i])
 
-        progress_bar = c.tqdm(total=len(keys), desc=f'Querying {len(keys)} keys for modules')
         modules = []
-        for key in keys:
-            module = self.module_info(module=key, block=block, netuid=netuid, network=network, fmt=fmt, **kwargs)
-            if isinstance(module, dict) and 'name' in module:
-                modules.append(module)
-                progress_bar.update(1)
-        
+        for module in results:
+            if isinstance(module, dict) and 'stats' in module:
+                modules.append(self.format_module_info(module, fmt=fmt, block=block, lite=lite))
         return modules
 
 
@@ -3318,6 +3429,96 @@ class Subspace(c.Module):
             my_keys = [k for k in keys if k in addresses]
         return my_keys
 
+    uid_index_cache = {}
+    def uid_index(self, netuid:int = 0, network:str = None, update:bool = False, max_age:int = 1000) -> dict:
+        """
+        Returns the uids of the subnet with key2uid and name2uid maps, cached in memory until the block changes.
+        """
+        network = self.resolve_network(network)
+        netuid = self.resolve_netuid(netuid)
+        block = self.block
+        index = self.uid_index_cache.get((network, netuid))
+        if update or index == None or index['block'] != block:
+            uid2key = self.uid2key(netuid=netuid, network=network, update=update, max_age=max_age)
+            uid2name = self.uid2name(netuid=netuid, network=network, update=update, max_age=max_age)
+            index = {
+                'block': block,
+                'uids': np.fromiter(uid2key.keys(), dtype=np.int64, count=len(uid2key)),
+                'key2uid': {k: uid for uid, k in uid2key.items()},
+                'name2uid': {name: uid for uid, name in uid2name.items()},
+            }
+            self.uid_index_cache[(network, netuid)] = index
+        return index
+
+    vote_params_cache = {}
+    def vote_params(self, key:'c.Key' = None, netuid:int = 0, network:str = None, update:bool = False) -> dict:
+        """
+        Returns the chain params needed to vote with a key, cached in memory until the block changes.
+        """
+        network = self.resolve_network(network)
+        netuid = self.resolve_netuid(netuid)
+        key = self.resolve_key(key)
+        block = self.block
+        params = self.vote_params_cache.get((network, netuid, key.ss58_address))
+        if update or params == None or params['block'] != block:
+            global_params = self.global_params(network=network, update=update)
+            subnet_params = self.subnet_params(netuid=netuid, network=network, update=update)
+            stake = self.get_stake(key.ss58_address, netuid=netuid, network=network, update=update)
+            min_stake = global_params['min_weight_stake'] * subnet_params['min_allowed_weights']
+            assert stake > min_stake, f"Stake {stake} must be greater than {min_stake} to vote"
+            max_num_votes = stake // global_params['min_weight_stake']
+            params = {
+                'block': block,
+                'stake': stake,
+                'self_uid': self.uid_index(netuid=netuid, network=network)['key2uid'].get(key.ss58_address, None),
+                'min_allowed_weights': subnet_params['min_allowed_weights'],
+                'max_allowed_weights': int(min(max_num_votes, subnet_params['max_allowed_weights'])),
+            }
+            self.vote_params_cache[(network, netuid, key.ss58_address)] = params
+        return params
+
+    @staticmethod
+    def prepare_weights(uids:list,
+                        weights:list = None,
+                        candidate_uids:list = None,
+                        self_uid:int = None,
+                        min_allowed_weights:int = 1,
+                        max_allowed_weights:int = None,
+                        min_value:float = 0,
+                        max_value:float = 1) -> Tuple[List[int], List[int]]:
+        """
+        Turns uids and weights into a vote in one vectorized pass:
+        dedupe, drop the voter's own uid, pad with random candidate uids up to min_allowed_weights,
+        keep the top max_allowed_weights, normalize, clamp and quantize to u16.
+        """
+        assert min_value >= 0 and max_value <= 1, f"min_value and max_value must be between 0 and 1"
+        uids = np.asarray(uids, dtype=np.int64)
+        weights = np.ones(len(uids)) if weights is None else np.asarray(weights, dtype=np.float64)
+        assert len(uids) == len(weights), f"Length of uids {len(uids)} must be equal to length of weights {len(weights)}"
+        # the last weight of a repeated uid wins, like dict(zip(uids, weights))
+        uids, idx = np.unique(uids[::-1], return_index=True)
+        weights = weights[::-1][idx]
+        if self_uid is not None:
+            keep = uids != self_uid
+            uids, weights = uids[keep], weights[keep]
+
+        num_pad = min_allowed_weights - len(uids)
+        if num_pad > 0 and candidate_uids is not None:
+            exclude = uids if self_uid is None else np.append(uids, self_uid)
+            candidates = np.setdiff1d(np.asarray(candidate_uids, dtype=np.int64), exclude, assume_unique=False)
+            pad_uids = np.random.default_rng().choice(candidates, size=min(num_pad, len(candidates)), replace=False)
+            uids = np.concatenate([uids, pad_uids])
+            weights = np.concatenate([weights, np.full(len(pad_uids), float(min_value))])
+
+        order = np.argsort(-weights, kind='stable')[:max_allowed_weights]
+        uids, weights = uids[order], weights[order]
+        total = weights.sum()
+        if total > 0:
+            weights = weights / total
+        weights = np.clip(weights, min_value, max_value)
+        weights = np.minimum(weights * U16_MAX, U16_MAX).astype(np.int64)
+        return uids.tolist(), weights.tolist()
+
     def set_weights(
         self,
         modules: Union['torch.LongTensor', list] = None,
@@ -3332,73 +3533,36 @@ class Subspace(c.Module):
         max_age = 100,
         **kwargs
     ) -> bool:
-        import torch
 
         network = self.resolve_network(network)
         netuid = self.resolve_netuid(netuid)
         key = self.resolve_key(key)
-        global_params = self.global_params( network=network)
-        subnet_params = self.subnet_params( netuid = netuid , max_age=None, update=False)
-        module_info = self.module_info(key.ss58_address, netuid=netuid)
-        min_stake = global_params['min_weight_stake'] * subnet_params['min_allowed_weights']
-        assert module_info['stake'] > min_stake
-        max_num_votes = module_info['stake'] // global_params['min_weight_stake']
-        n = int(min(max_num_votes, subnet_params['max_allowed_weights']))
-        modules = uids or modules
-        if modules == None:
-            modules = c.shuffle(self.uids(netuid=netuid, update=update))
-        # checking if the "uids" are passed as names -> strings
-        key2name, name2uid = None, None
-        for i, module in enumerate(modules):
+        params = self.vote_params(key=key, netuid=netuid, network=network, update=update)
+        index = self.uid_index(netuid=netuid, network=network, update=update)
+        modules = uids if uids is not None else modules
+        if modules is None:
+            modules = np.random.permutation(index['uids'])
+        # checking if the "uids" are passed as names or keys -> strings
+        uids = []
+        for module in modules:
             if isinstance(module, str):
-                if key2name == None or name2uid == None:
-                    key2name = self.key2name(netuid=netuid, update=update)
-                    name2uid = self.name2uid(netuid=netuid, update=update)
-                if module in key2name:
-                    modules[i] = key2name[module]
-                elif module in name2uid:
-                    modules[i] = name2uid[module]
-                    
-        uids = modules
-        
-        if weights is None:
-            weights = [1 for _ in uids]
-        if len(uids) < subnet_params['min_allowed_weights']:
-            n = self.n(netuid=netuid)
-            while len(uids) < subnet_params['min_allowed_weights']:
-                uid = c.choice(list(range(n)))
-                if uid not in uids:
-                    uids.append(uid)
-                    weights.append(min_value)
-
-        uid2weight = dict(sorted(zip(uids, weights), key=lambda item: item[1], reverse=True))
-        
-        self_uid = self.key2uid(netuid=netuid).get(key.ss58_address, None)
-        uid2weight.pop(self_uid, None)
-
-        uids = list(uid2weight.keys())
-        weights = list(uid2weight.values())
-
-
-        if len(uids) > subnet_params['max_allowed_weights']:
-            uids = uids[:subnet_params['max_allowed_weights']]
-            weights = weights[:subnet_params['max_allowed_weights']]
-
+                uid = index['key2uid'].get(module, index['name2uid'].get(module, None))
+                assert uid != None, f"Module {module} not found in subnet {netuid}"
+                module = uid
+            uids.append(module)
+        if hasattr(weights, 'tolist'):
+            weights = weights.tolist()
+
+        uids, weights = self.prepare_weights(uids=uids,
+                                             weights=weights,
+                                             candidate_uids=index['uids'],
+                                             self_uid=params['self_uid'],
+                                             min_allowed_weights=params['min_allowed_weights'],
+                                             max_allowed_weights=params['max_allowed_weights'],
+                                             min_value=min_value,
+                                             max_value=max_value)
 
         c.print(f'Voting for {len(uids)} modules')
-        assert len(uids) == len(weights), f"Length of uids {len(uids)} must be equal to length of weights {len(weights)}"
-        uids = torch.tensor(uids)
-        weights = torch.tensor(weights)
-        weights = weights / weights.sum() # normalize the weights between 0 and 1
-        # STEP 2: CLAMP THE WEIGHTS BETWEEN 0 AND 1 WITH MIN AND MAX VALUES
-        assert min_value >= 0 and max_value <= 1, f"min_value and max_value must be between 0 and 1"
-        weights = torch.clamp(weights, min_value, max_value) # min_value and max_value are between 0 and 1
-
-        weights = weights * (2**16 - 1)
-        weights = list(map(lambda x : int(min(x, U16_MAX)), weights.tolist()))
-        uids = list(map(int, uids.tolist()))
-
-
 
         params = {'uids': uids,
                   'weights': weights, 
@@ -3502,71 +3666,177 @@ class Subspace(c.Module):
                 unregister_servers += [s]
         return unregister_servers
 
+    substrate_pools = {}
+    def substrate_pool(self, network:str = 'main', max_connections:int = 8) -> queue.Queue:
+        """
+        Returns a pool of max_connections substrate connections, each slot connects on first use.
+        """
+        if (network, max_connections) not in self.substrate_pools:
+            pool = queue.Queue()
+            for _ in range(max_connections):
+                pool.put(None)
+            self.substrate_pools[(network, max_connections)] = pool
+        return self.substrate_pools[(network, max_connections)]
+
+    def pooled_call(self, fn:Callable, network:str = 'main', max_connections:int = 8, trials:int = 3):
+        """
+        Calls fn(substrate) with a connection borrowed from the pool, reconnecting on failure.
+        Borrowing blocks while all connections are busy, which bounds the concurrency.
+        """
+        pool = self.substrate_pool(network=network, max_connections=max_connections)
+        substrate = pool.get()
+        try:
+            for trial in range(trials):
+                try:
+                    substrate = substrate or self.get_substrate(network=network, cache=False)
+                    return fn(substrate)
+                except Exception as e:
+                    substrate = None
+                    if trial == trials - 1:
+                        raise e
+        finally:
+            pool.put(substrate)
+
+    @classmethod
+    def find_ss58_addresses(cls, x:Any) -> set:
+        if isinstance(x, str):
+            return {x} if c.valid_ss58_address(x) else set()
+        if isinstance(x, dict):
+            x = list(x.values())
+        if isinstance(x, (list, tuple)):
+            return set().union(*[cls.find_ss58_addresses(v) for v in x])
+        return set()
+
+    def changed_accounts(self, start_block:int, end_block:int, network:str = 'main', max_connections:int = 8, timeout:int = 60) -> set:
+        """
+        Returns the addresses that appear in the events of the blocks from start_block to end_block.
+        """
+        def block_accounts(substrate, block:int):
+            events = substrate.get_events(block_hash=substrate.get_block_hash(block))
+            return self.find_ss58_addresses([e.value.get('event', {}).get('attributes') for e in events])
+        futures = [c.submit(self.pooled_call, 
+                            args=[lambda substrate, block=block: block_accounts(substrate, block)],
+                            kwargs=dict(network=network, max_connections=max_connections), 
+                            timeout=timeout) 
+                   for block in range(start_block, end_block + 1)]
+        accounts = set()
+        for result in c.wait(futures, timeout=timeout):
+            assert isinstance(result, set), f'Failed to get events {result}'
+            accounts |= result
+        return accounts
+
+    scan_storage = {
+        'balance': ('System', 'Account'),
+        'stake_to': ('SubspaceModule', 'StakeTo'),
+        'stake_from': ('SubspaceModule', 'StakeFrom'),
+    }
+
+    def scan(self, 
+             keys:list = None,
+             search:str = None,
+             features:List[str] = ['balance', 'stake_to', 'stake_from'],
+             netuid:int = 0,
+             network:str = 'main',
+             block:int = None,
+             batch_size:int = 128,
+             max_connections:int = 8,
+             timeout:int = 60,
+             incremental:bool = False,
+             max_event_blocks:int = 100,
+             names:bool = True,
+             fmt:str = 'j') -> Dict[str, dict]:
+        """
+        Scans the balance, stake_to and stake_from of many keys at one pinned block,
+        running query_multi batches in parallel over a pool of connections.
+        With incremental=True only the keys whose accounts appear in the events since
+        the last incremental scan are queried again, the rest come from the saved scan.
+        """
+        network = self.resolve_network(network)
+        netuid = self.resolve_netuid(netuid)
+        key2address = c.key2address(search=search)
+        keys = list(key2address.keys()) if keys == None else keys
+        address2key = {key2address.get(k, k): k for k in keys}
+        block = block or self.block
+        block_hash = self.block_hash(block, network=network)
+
+        path = f'scan/{network}/{netuid}'
+        state = self.get(path, {}) if incremental else {}
+        address2state = state.get('address2state', {})
+        changed = None
+        if incremental and state.get('block') != None and 0 <= block - state['block'] <= max_event_blocks:
+            changed = self.changed_accounts(start_block=state['block'] + 1, end_block=block, network=network, max_connections=max_connections, timeout=timeout)
+
+        queries = []
+        for address in address2key:
+            address_state = address2state.get(address, {})
+            for feature in features:
+                if changed != None and feature in address_state and address not in changed:
+                    continue
+                module, storage = self.scan_storage[feature]
+                params = [address] if module == 'System' else [netuid, address]
+                queries.append((feature, address, [module, storage, params]))
+
+        batches = [queries[i:i+batch_size] for i in range(0, len(queries), batch_size)]
+        c.print(f'Scanning {len(queries)} storage items in {len(batches)} batches at block {block}')
+        def query_batch(substrate, batch):
+            storage_keys = [substrate.create_storage_key(*q[-1]) for q in batch]
+            return substrate.query_multi(storage_keys, block_hash=block_hash)
+        futures = [c.submit(self.pooled_call, 
+                            args=[lambda substrate, batch=batch: query_batch(substrate, batch)], 
+                            kwargs=dict(network=network, max_connections=max_connections), 
+                            timeout=timeout) 
+                   for batch in batches]
+        for batch, results in zip(batches, c.wait(futures, timeout=timeout)):
+            if not isinstance(results, list):
+                c.print(f'Failed to scan batch {results}', color='red')
+                continue
+            for (feature, address, _), (storage_key, value) in zip(batch, results):
+                value = value.value
+                if feature == 'balance':
+                    value = value['data']['free'] if value else 0
+                else:
+                    value = {k: v for k, v in (value or [])}
+                address2state.setdefault(address, {})[feature] = value
+
+        if incremental:
+            self.put(path, {'block': block, 'address2state': address2state})
+
+        key2state = {}
+        for address, key in address2key.items():
+            address_state = address2state.get(address, {})
+            key_state = {}
+            for feature in features:
+                value = address_state.get(feature, None)
+                if isinstance(value, dict):
+                    value = {k: self.format_amount(v, fmt=fmt) for k, v in value.items()}
+                elif value != None:
+                    value = self.format_amount(value, fmt=fmt)
+                key_state[feature] = value
+            key2state[key if names else address] = key_state
+        return key2state
+
     def get_balances(self, 
                     keys=None,
                     search=None, 
                     network = 'main',  
                     batch_size = 128,
                     fmt = 'j',
-                    n = 100,
-                    max_trials = 3,
+                    max_connections = 8,
                     names = False,
+                    incremental = False,
+                    timeout = 60,
                     **kwargs):
-
-        key2balance  = {}
-
-        self.resolve_network(network)
-        key2address = c.key2address(search=search)
-        if keys == None:
-            keys = list(key2address.keys())
-        if len(keys) > n:
-            c.print(f'Getting balances for {len(keys)} keys > {n} keys, using batch_size {batch_size}')
-            balances = self.balances(network=network, **kwargs)
-            key2balance = {}
-            for k,a in key2address.items():
-                if a in balances:
-                    key2balance[k] = balances[a]
-        else:
-            keys = keys[:n]
-            batch_size = min(batch_size, len(keys))
-            batched_keys = c.chunk(keys, batch_size)
-            num_batches = len(batched_keys)
-            progress = c.progress(num_batches)
-            c.print(f'Getting balances for {len(keys)} keys')
-
-            def batch_fn(batch_keys):
-                substrate = self.get_substrate(network=network)
-                batch_keys = [key2address.get(k, k) for k in batch_keys]
-                c.print(f'Getting balances for {len(batch_keys)} keys')
-                results = substrate.query_multi([ substrate.create_storage_key("System", "Account", [k]) for k in batch_keys])
-                return  {k.params[0]: v['data']['free'].value for k, v in results}
-            key2balance = {}
-            progress = c.progress(num_batches)
-
-
-            for batch_keys in batched_keys:
-                fails = 0
-                while fails < max_trials:
-                    if fails > max_trials:
-                        raise Exception(f'Error getting balances {fails}/{max_trials}')
-                    try:
-                        result = batch_fn(batch_keys)
-                        progress.update(1)
-                        break # if successful, break
-                    except Exception as e:
-                        fails += 1
-                        c.print(f'Error getting balances {fails}/{max_trials} {e}')
-                if c.is_error(result):
-                    c.print(result, color='red')
-                else:
-                    progress.update(1)
-                    key2balance.update(result)
-        for k,v in key2balance.items():
-            key2balance[k] = self.format_amount(v, fmt=fmt)
-        if names:
-            address2key = c.address2key()
-            key2balance = {address2key[k]: v for k,v in key2balance.items()}
-        return key2balance
+        key2state = self.scan(keys=keys,
+                              search=search,
+                              features=['balance'],
+                              network=network,
+                              batch_size=batch_size,
+                              max_connections=max_connections,
+                              incremental=incremental,
+                              timeout=timeout,
+                              names=names,
+                              fmt=fmt)
+        return {k: v['balance'] for k, v in key2state.items() if v['balance'] != None}
         
     def registered_servers(self, netuid = 0, network = 'main',  **kwargs):
         netuid = self.resolve_netuid(netuid)
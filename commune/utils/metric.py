@@ -1,4 +1,9 @@
 
+import json
+import math
+import time
+import bisect
+import threading
 from typing import Union, Dict, List, Tuple, Optional
 
 
@@ -14,9 +19,51 @@ def round_sig(x, sig=6, small_value=1.0e-9):
     return round(x, sig - int(math.floor(math.log10(max(abs(x), abs(small_value))))) - 1)
 
 
+"""
+Streaming metrics: every update is O(1) and every metric has a fixed memory bound, so they can
+track every request of a busy server. Each metric serializes to a small json dict (to_dict,
+from_dict) and merges with the same metric from another process (merge), for example to combine
+the latency sketches of a module's replicas.
+"""
 
-        
-class RunningMean:
+class Metric:
+
+    def update(self, value, count=1):
+        raise NotImplementedError
+
+    def merge(self, other: 'Metric') -> 'Metric':
+        raise NotImplementedError
+
+    def state(self) -> Dict:
+        raise NotImplementedError
+
+    def to_dict(self) -> Dict:
+        return {'type': self.__class__.__name__, **self.state()}
+
+    @staticmethod
+    def from_dict(d: Dict) -> 'Metric':
+        d = dict(d)
+        cls = metric_types[d.pop('type')]
+        self = cls.__new__(cls)
+        self.__dict__.update(cls.load_state(d))
+        return self
+
+    @classmethod
+    def load_state(cls, d: Dict) -> Dict:
+        return d
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(',', ':'))
+
+    @staticmethod
+    def from_json(json_str: str) -> 'Metric':
+        return Metric.from_dict(json.loads(json_str))
+
+    def __str__(self):
+        return str(self.value)
+
+
+class RunningMean(Metric):
     def __init__(self, value=0, count=0):
         self.total_value = value * count
         self.count = count
@@ -27,94 +74,474 @@ class RunningMean:
 
     @property
     def value(self):
-        if self.count == 0:
+        if self.count > 0:
             return self.total_value / self.count
         else:
-            return float("inf")
+            return float("nan")
+
+    def merge(self, other: 'RunningMean') -> 'RunningMean':
+        self.total_value += other.total_value
+        self.count += other.count
+        return self
+
+    def state(self) -> Dict:
+        return {'total_value': self.total_value, 'count': self.count}
 
-    def __str__(self):
-        return str(self.value)
-    
-    def to_dict(self):
-        return self.__dict__()
 
+class EWMA(Metric):
+    """
+    Exponentially weighted moving average. With halflife (seconds) the decay follows the time between
+    updates instead of their number, so irregular traffic is weighted by recency.
+    """
+    def __init__(self, alpha: float = 0.1, halflife: float = None):
+        self.alpha = alpha
+        self.halflife = halflife
+        self.value = None
+        self.weight = 0.0 # how much of the average is backed by data, for merging
+        self.last_time = None
+
+    def update(self, value, count=1, t: float = None):
+        if self.halflife != None:
+            t = time.time() if t == None else t
+            dt = 0 if self.last_time == None else max(t - self.last_time, 0)
+            alpha = 1 - 2 ** (-dt / self.halflife) if self.last_time != None else 1
+            self.last_time = t
+        else:
+            alpha = 1 - (1 - self.alpha) ** count
+        if self.value == None:
+            self.value, self.weight = float(value), 1.0
+            return
+        self.value += alpha * (value - self.value)
+        self.weight = self.weight * (1 - alpha) + alpha
 
-    def from_dict(  self, 
-                    d: Dict,
-                    ):
-        for key, value in d.items():
-            assert hasattr(self, key), f'key {key} not in {self.__class__.__name__}'
-            setattr(self, key, value)
+    def merge(self, other: 'EWMA') -> 'EWMA':
+        if other.value != None:
+            if self.value == None:
+                self.value, self.weight = other.value, other.weight
+            else:
+                weight = self.weight + other.weight
+                self.value = (self.value * self.weight + other.value * other.weight) / weight
+                self.weight = min(weight, 1.0)
+            self.last_time = max(self.last_time or 0, other.last_time or 0) or None
         return self
 
+    def state(self) -> Dict:
+        return {'alpha': self.alpha, 'halflife': self.halflife, 'value': self.value, 'weight': self.weight, 'last_time': self.last_time}
 
 
-        
-class MovingWindowAverage:
+class MovingWindowAverage(Metric):
+    """ The mean of the last window_size values, kept in a ring buffer with a running sum. """
     def __init__(self,value: Union[int, float] = None, window_size:int=100):
-        self.set_window( value=value, window_size=window_size
-        
+        self.set_window( value=value, window_size=window_size)
 
     def set_window(self,value: Union[int, float] = None, window_size:int=100) -> List[Union[int, float]]:
-        assert type(value) in [int, float], f'default_value must be int or float, got {type(default_value)}'
+        assert value == None or type(value) in [int, float], f'default_value must be int or float, got {type(value)}'
         self.window_size = window_size
-        self.update(value)
+        self.ring = [0.0] * window_size
+        self.index = 0 # the slot of the next value
+        self.count = 0 # values in the window
+        self.total = 0.0
+        self.writes = 0
+        if value != None:
+            self.update(value)
         return self.window_values
 
     def update(self, *values):
         '''
         Update the moving window average with a new value.
         '''
-        if hasattr(self, 'window_values') == False:
-            self.window_values = []
-            
         for value in values:
-            self.window_values +=  [value]
-            if len(self.window_values) > self.window_size:
-                self.window_values = self.window_values[-self.window_size:]
-                
-        self.value = sum(self.window_values) / len(self.window_values)
+            self.total += value - self.ring[self.index]
+            self.ring[self.index] = value
+            self.index = (self.index + 1) % self.window_size
+            self.count = min(self.count + 1, self.window_size)
+            self.writes += 1
+            # the running sum drifts with float error, resum it once per window (O(1) amortized)
+            if self.writes % self.window_size == 0:
+                self.total = math.fsum(self.ring)
 
-    def __str__(self):
-        return str(self.value)
-    
-    def to_dict(self):
-        return self.__dict__()
-    
-    def from_dict(self, d: Dict):
-        for key, value in d.items():
-            assert hasattr(self, key), f'key {key} not in {self.__class__.__name__}'
-            setattr(self, key, value)
+    @property
+    def value(self):
+        return self.total / self.count if self.count > 0 else float('nan')
+
+    @property
+    def window_values(self) -> List[Union[int, float]]:
+        """ the values in the window, oldest first """
+        if self.count < self.window_size:
+            return self.ring[:self.count]
+        return self.ring[self.index:] + self.ring[:self.index]
+
+    def merge(self, other: 'MovingWindowAverage') -> 'MovingWindowAverage':
+        self.update(*other.window_values)
         return self
-    
-    def to_json(self):
-        return json.dumps(self.to_dict())
-    
-    def from_json(self, json_str:str):
-        state_dict = json.loads(json_str)
-        self.__dict__.update(state_dict)
-        return state_dict
+
+    def state(self) -> Dict:
+        return {'window_size': self.window_size, 'values': self.window_values}
+
+    @classmethod
+    def load_state(cls, d: Dict) -> Dict:
+        self = cls(window_size=d['window_size'])
+        self.update(*d['values'])
+        return self.__dict__
 
     def state_dict(self):
         return self.to_dict()
 
     @classmethod
     def test(cls):
-        
+
         # testing constant value
         constant = 10
         self = cls(value=constant)
-        
+
         for i in range(10):
             self.update(10)
             assert constant == self.value
-            
+
         variable_value = 100
         window_size = 10
         self = cls(value=variable_value, window_size=window_size+1)
         for i in range(variable_value+1):
             self.update(i)
-        print(self.value)
         assert self.value == (variable_value - window_size/2)
-        print(self.window_values)
-            
\ No newline at end of file
+        assert self.window_values == list(range(variable_value - window_size, variable_value + 1))
+        assert Metric.from_json(self.to_json()).value == self.value
+        return {'success': True}
+
+
+class QuantileSketch(Metric):
+    """
+    A mergeable quantile sketch with relative error (DDSketch): values fall in logarithmic buckets
+    gamma^(i-1) < |x| <= gamma^i, so any quantile is within relative_accuracy of the true value.
+    Memory is bounded by max_buckets, past it the lowest buckets are folded together (the high quantiles stay exact).
+    """
+    min_value = 1e-9 # values closer to zero are counted as zero
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.positive = {} # bucket index -> count
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.init_gamma()
+
+    def init_gamma(self):
+        self.gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+    def key(self, x: float) -> int:
+        return math.ceil(math.log(x) / self.log_gamma)
+
+    def bucket_value(self, key: int) -> float:
+        # the point of the bucket that is within relative_accuracy of both of its ends
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def update(self, value, count=1):
+        if value > self.min_value:
+            store = self.positive
+        elif value < -self.min_value:
+            store = self.negative
+        else:
+            store = None
+            self.zero += count
+        if store != None:
+            key = self.key(abs(value))
+            store[key] = store.get(key, 0) + count
+            if len(store) > self.max_buckets:
+                self.collapse(store)
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @staticmethod
+    def collapse(store: Dict[int, int]):
+        lowest = min(store)
+        count = store.pop(lowest)
+        second = min(store)
+        store[second] += count
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # from the most negative to the largest value
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return max(-self.bucket_value(key), self.min)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return min(self.bucket_value(key), self.max)
+        return self.max
+
+    def quantiles(self, qs: List[float] = [0.5, 0.95, 0.99]) -> Dict[float, Optional[float]]:
+        return {q: self.quantile(q) for q in qs}
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count > 0 else float('nan')
+
+    @property
+    def value(self):
+        return self.quantile(0.5)
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        assert other.relative_accuracy == self.relative_accuracy, 'sketches must have the same relative accuracy'
+        for store, other_store in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+            while len(store) > self.max_buckets:
+                self.collapse(store)
+        self.zero += other.zero
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @staticmethod
+    def dense(store: Dict[int, int]) -> list:
+        """ [first key, counts...], buckets are contiguous for most distributions """
+        if not store:
+            return [0, []]
+        lowest = min(store)
+        return [lowest, [store.get(k, 0) for k in range(lowest, max(store) + 1)]]
+
+    def state(self) -> Dict:
+        return {'relative_accuracy': self.relative_accuracy, 'max_buckets': self.max_buckets,
+                'positive': self.dense(self.positive), 'negative': self.dense(self.negative), 'zero': self.zero,
+                'count': self.count, 'sum': self.sum, 'min': self.min if self.count else None, 'max': self.max if self.count else None}
+
+    @classmethod
+    def load_state(cls, d: Dict) -> Dict:
+        self = cls(relative_accuracy=d['relative_accuracy'], max_buckets=d['max_buckets'])
+        for store, (lowest, counts) in [(self.positive, d['positive']), (self.negative, d['negative'])]:
+            store.update({lowest + i: n for i, n in enumerate(counts) if n})
+        self.zero, self.count, self.sum = d['zero'], d['count'], d['sum']
+        if self.count:
+            self.min, self.max = d['min'], d['max']
+        return self.__dict__
+
+    @classmethod
+    def test(cls, n: int = 100000):
+        import random
+        values = [random.lognormvariate(-3, 1) for _ in range(n)]
+        a, b = cls(), cls()
+        for i, value in enumerate(values):
+            (a if i % 2 else b).update(value)
+        sketch = Metric.from_json(a.to_json()).merge(b)
+        values.sort()
+        for q in [0.5, 0.95, 0.99]:
+            exact = values[int(q * (n - 1))]
+            assert abs(sketch.quantile(q) - exact) <= 0.011 * exact, (q, sketch.quantile(q), exact)
+        assert sketch.count == n and len(sketch.positive) < 1000
+        return {'success': True, 'buckets': len(sketch.positive), 'json_bytes': len(sketch.to_json())}
+
+
+class Histogram(Metric):
+    """ Counts per fixed bucket (upper bounds), mergeable when the bounds match. """
+    def __init__(self, bounds: List[float] = None, start: float = 1e-4, factor: float = 2, buckets: int = 24):
+        self.bounds = sorted(bounds) if bounds != None else [start * factor ** i for i in range(buckets)]
+        self.counts = [0] * (len(self.bounds) + 1) # the last bucket is everything above the last bound
+        self.count = 0
+        self.sum = 0.0
+
+    def update(self, value, count=1):
+        self.counts[bisect.bisect_left(self.bounds, value)] += count
+        self.count += count
+        self.sum += value * count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """ interpolated within the bucket of the rank """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i > 0 else 0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    @property
+    def value(self):
+        return self.quantile(0.5)
+
+    def merge(self, other: 'Histogram') -> 'Histogram':
+        assert other.bounds == self.bounds, 'histograms must have the same bounds'
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        return self
+
+    def state(self) -> Dict:
+        return {'bounds': self.bounds, 'counts': self.counts, 'count': self.count, 'sum': self.sum}
+
+
+class RateCounter(Metric):
+    """ Events per second over the last window seconds, counted in a ring of resolution second buckets. """
+    def __init__(self, window: float = 60, resolution: float = 1):
+        self.window = window
+        self.resolution = resolution
+        self.slots = max(int(window / resolution), 1)
+        self.epochs = [-1] * self.slots # the bucket number each slot currently counts
+        self.counts = [0] * self.slots
+        self.total = 0
+
+    def update(self, value=1, count=1, t: float = None):
+        """ counts value events at time t (now) """
+        epoch = int((time.time() if t == None else t) / self.resolution)
+        slot = epoch % self.slots
+        if self.epochs[slot] != epoch:
+            if self.epochs[slot] > epoch:
+                return # older than the window
+            self.epochs[slot], self.counts[slot] = epoch, 0
+        self.counts[slot] += value * count
+        self.total += value * count
+
+    def rate(self, t: float = None) -> float:
+        epoch = int((time.time() if t == None else t) / self.resolution)
+        return sum(n for e, n in zip(self.epochs, self.counts) if epoch - self.slots < e <= epoch) / self.window
+
+    @property
+    def value(self):
+        return self.rate()
+
+    def merge(self, other: 'RateCounter') -> 'RateCounter':
+        assert (other.window, other.resolution) == (self.window, self.resolution), 'rate counters must have the same window'
+        for slot, (epoch, count) in enumerate(zip(other.epochs, other.counts)):
+            if epoch == self.epochs[slot]:
+                self.counts[slot] += count
+            elif epoch > self.epochs[slot]:
+                self.epochs[slot], self.counts[slot] = epoch, count
+        self.total += other.total
+        return self
+
+    def state(self) -> Dict:
+        return {'window': self.window, 'resolution': self.resolution, 'total': self.total,
+                'buckets': [[e, n] for e, n in zip(self.epochs, self.counts) if e >= 0]}
+
+    @classmethod
+    def load_state(cls, d: Dict) -> Dict:
+        self = cls(window=d['window'], resolution=d['resolution'])
+        self.total = d['total']
+        for epoch, count in d['buckets']:
+            self.epochs[epoch % self.slots], self.counts[epoch % self.slots] = epoch, count
+        return self.__dict__
+
+
+metric_types = {cls.__name__: cls for cls in [RunningMean, EWMA, MovingWindowAverage, QuantileSketch, Histogram, RateCounter]}
+
+
+class Metrics:
+    """
+    Latency tracking per name (a module fn, an endpoint): count, errors, mean, ewma,
+    p50/p95/p99 from a quantile sketch and the recent call rate, all in bounded memory per name.
+    """
+    def __init__(self, relative_accuracy: float = 0.01, rate_window: float = 60, ewma_alpha: float = 0.1):
+        self.relative_accuracy = relative_accuracy
+        self.rate_window = rate_window
+        self.ewma_alpha = ewma_alpha
+        self.names = {}
+        self.lock = threading.Lock()
+
+    def metric(self, name: str) -> Dict:
+        if name not in self.names:
+            self.names[name] = {'latency': QuantileSketch(self.relative_accuracy),
+                                'ewma': EWMA(self.ewma_alpha),
+                                'rate': RateCounter(self.rate_window),
+                                'errors': 0}
+        return self.names[name]
+
+    def observe(self, name: str, value: float, error: bool = False, t: float = None):
+        with self.lock:
+            metric = self.metric(name)
+            metric['latency'].update(value)
+            metric['ewma'].update(value)
+            metric['rate'].update(t=t)
+            metric['errors'] += int(error)
+
+    def stats(self, name: str = None) -> Dict:
+        with self.lock:
+            if name != None:
+                metric = self.metric(name)
+                latency = metric['latency']
+                return {'count': latency.count,
+                        'errors': metric['errors'],
+                        'mean': latency.mean if latency.count else None,
+                        'ewma': metric['ewma'].value,
+                        **{f'p{int(q * 100)}': v for q, v in latency.quantiles().items()},
+                        'max': latency.max if latency.count else None,
+                        'rate': metric['rate'].rate()}
+            names = list(self.names)
+        return {name: self.stats(name) for name in names}
+
+    def merge(self, other: 'Metrics') -> 'Metrics':
+        with self.lock:
+            for name, metric in other.names.items():
+                mine = self.metric(name)
+                for k in ['latency', 'ewma', 'rate']:
+                    mine[k].merge(metric[k])
+                mine['errors'] += metric['errors']
+        return self
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {'relative_accuracy': self.relative_accuracy, 'rate_window': self.rate_window, 'ewma_alpha': self.ewma_alpha,
+                    'names': {name: {k: v.to_dict() if isinstance(v, Metric) else v for k, v in metric.items()}
+                              for name, metric in self.names.items()}}
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> 'Metrics':
+        self = cls(relative_accuracy=d['relative_accuracy'], rate_window=d['rate_window'], ewma_alpha=d['ewma_alpha'])
+        for name, metric in d['names'].items():
+            self.names[name] = {k: Metric.from_dict(v) if isinstance(v, dict) else v for k, v in metric.items()}
+        return self
+
+    @classmethod
+    def benchmark(cls, n: int = 200000) -> Dict:
+        """ observations per second, against appending to a list and sorting it for the quantiles """
+        import random
+        values = [random.expovariate(100) for _ in range(n)]
+        self = cls()
+        t = time.time()
+        for value in values:
+            self.observe('fn', value)
+        observe_time = time.time() - t
+        t = time.time()
+        stats = self.stats('fn')
+        stats_time = time.time() - t
+        t = time.time()
+        samples = []
+        for value in values:
+            samples.append(value)
+        samples.sort()
+        exact = {f'p{int(q * 100)}': samples[int(q * (n - 1))] for q in [0.5, 0.95, 0.99]}
+        list_time = time.time() - t
+        return {'observe_per_s': n / observe_time, 'stats_s': stats_time, 'json_bytes': len(json.dumps(self.to_dict())),
+                'list_and_sort_s': list_time, 'list_bytes': 8 * n, 'stats': stats, 'exact': exact}
+
+    @classmethod
+    def test(cls):
+        a, b = cls(), cls()
+        for i in range(1, 1001):
+            (a if i % 2 else b).observe('forward', i / 1000, error=i % 100 == 0)
+        merged = cls.from_dict(json.loads(json.dumps(a.to_dict()))).merge(b)
+        stats = merged.stats('forward')
+        assert stats['count'] == 1000 and stats['errors'] == 10
+        assert abs(stats['p50'] - 0.5) < 0.01 and abs(stats['p99'] - 0.99) < 0.02, stats
+        assert stats['rate'] == 1000 / merged.rate_window
+        return {'success': True, 'stats': stats}
@@ -17,12 +17,16 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import os
+import time
+import hashlib
 import torch
 
 from typing import List, Dict, Tuple, Any, Union
 from transformers import PreTrainedTokenizerBase
 
 EPSILON = 1e-40
+TRANSLATION_MAP_CACHE_DIR = '~/.commune/tokenizer/translation_map'
 
 
 def get_tokenizer_alignment_splits(offset_mapping: List[tuple], offset_mapping_std: List[tuple]) -> Dict[int, tuple]:
@@ -402,8 +406,73 @@ def align_tokenizer_sequences(probs: torch.FloatTensor, offset_mapping: List[tup
     return aligned_probs, aligned_offset_mapping, aligned_tokens
 
 
+def flatten_phrases(phrases: List[List[int]]) -> Tuple[torch.LongTensor, ...]:
+    r"""
+    Flattens token phrases into CSR-style index arrays (indptr, indices, rows, positions, phrase_lens),
+    where entry j of indices is token positions[j] of phrase rows[j].
+    """
+    phrase_lens = torch.tensor([len(p) for p in phrases], dtype=torch.long)  # [phrases]
+    indptr = torch.zeros(len(phrases) + 1, dtype=torch.long)
+    indptr[1:] = phrase_lens.cumsum(0)
+    indices = torch.tensor([t for p in phrases for t in p], dtype=torch.long)  # [nnz]
+    rows = torch.repeat_interleave(torch.arange(len(phrases)), phrase_lens)  # [nnz] phrase of each entry
+    positions = torch.arange(len(indices)) - indptr[rows]  # [nnz] position within the phrase
+    return indptr, indices, rows, positions, phrase_lens
+
+
+def build_translation_map(to_tokens: List[List[int]], to_vocab_len: int) -> Dict[str, Any]:
+    r"""
+    Precompiles the token sequences of each source token into fixed-width index tables, so the translation
+    kernels are a single gather / scatter over all unrolling steps instead of a loop over mapping lengths.
+        Args:
+            to_tokens (:obj:`List[List[int]]`, `required`):
+                Target token sequence of every source token, indexed by source token.
+            to_vocab_len (:obj:`int`, `required`):
+                Target tokenizer vocabulary length.
+
+        Returns:
+            translation_map (:obj:`Dict[str, Any]`, `required`):
+                'phrase_table' [max_len, from_vocab_len] target token at each position of each source token,
+                'phrase_mask' [max_len, from_vocab_len] where the table holds a token, 'phrase_lens' [from_vocab_len],
+                'counts' [max_len, to_vocab_len] and the per-length 'lengths' maps.
+    """
+    _, indices, rows, positions, phrase_lens = flatten_phrases(to_tokens)
+    max_len = max(int(phrase_lens.max()), 1)
+
+    phrase_table = torch.zeros((max_len, len(to_tokens)), dtype=torch.long)  # padding points at token 0, masked out
+    phrase_table[positions, rows] = indices
+    phrase_mask = torch.zeros((max_len, len(to_tokens)), dtype=torch.bool)
+    phrase_mask[positions, rows] = True
+
+    # accumulate counts on tokens, to be used to divide probability mass over its channeled sequences
+    counts = torch.zeros((max_len, to_vocab_len), dtype=torch.long)
+    counts.index_put_((positions, indices), torch.ones_like(indices), accumulate=True)
+
+    translation_map = {'phrase_table': phrase_table, 'phrase_mask': phrase_mask, 'phrase_lens': phrase_lens,
+                       'counts': counts, 'lengths': {}}
+    for l in phrase_lens.unique().tolist():  # each unique one-to-many mapping length
+        from_idx = torch.where(phrase_lens == l)[0]  # [subset_size]
+        to_idx = phrase_table[:l, from_idx].T.contiguous()  # [subset_size, l]
+        translation_map['lengths'][l] = {'from': from_idx, 'to': to_idx}
+
+    return translation_map
+
+
+def translation_map_path(from_tokenizer: PreTrainedTokenizerBase, to_tokenizer: PreTrainedTokenizerBase,
+                         cache_dir: str) -> Union[str, None]:
+    r"""
+    Returns the cache file of a tokenizer pair, None if a tokenizer has no name to key it by.
+    """
+    names = [getattr(t, 'name_or_path', None) for t in [from_tokenizer, to_tokenizer]]
+    if cache_dir is None or not all(names):
+        return None
+    key = '->'.join([f'{type(t).__name__}:{n}:{t.vocab_len}' for t, n in zip([from_tokenizer, to_tokenizer], names)])
+    return os.path.join(os.path.expanduser(cache_dir), hashlib.sha256(key.encode()).hexdigest() + '.pt')
+
+
 def get_translation_map(from_tokenizer: PreTrainedTokenizerBase,
-                        to_tokenizer: PreTrainedTokenizerBase) -> Dict[str, Any]:
+                        to_tokenizer: PreTrainedTokenizerBase,
+                        cache_dir: str = TRANSLATION_MAP_CACHE_DIR) -> Dict[str, Any]:
     r"""
     Map individual token phrases from a tokenizer to another tokenizer.
         Args:
@@ -411,36 +480,31 @@ def get_translation_map(from_tokenizer: PreTrainedTokenizerBase,
                 From tokenizer.
             to_tokenizer (:obj:`PreTrainedTokenizerBase`, `required`):
                 To tokenizer.
+            cache_dir (:obj:`str`, `optional`):
+                Directory the compiled maps are cached in per tokenizer pair, None to always rebuild.
 
         Returns:
             translation_map (:obj:`Dict[str, Any]`, `required`):
                 Maps for each observed length, a source token to a token sequence of that length,
-                with source index to target indices.
+                with source index to target indices, and the compiled tables of build_translation_map.
     """
     set_vocab_len(from_tokenizer)
     set_vocab_len(to_tokenizer)
 
-    translation_map = {'lengths': {}}
+    path = translation_map_path(from_tokenizer, to_tokenizer, cache_dir)
+    if path is not None and os.path.exists(path):
+        return torch.load(path)
 
     phrases = from_tokenizer.batch_decode(range(from_tokenizer.vocab_len))  # tokens to strings
-
     to_tokens = to_tokenizer(phrases)['input_ids']  # convert single token from-phrases to to-tokenization
-    to_tokens_lens = [len(p) for p in to_tokens]
-    unique_lens = set(to_tokens_lens)
-    max_len = max(unique_lens)
-    counts = torch.zeros((max_len, to_tokenizer.vocab_len), dtype=torch.long)
-
-    for l in unique_lens:  # each unique one-to-many mapping length
-        from_idx = [i for i, k in enumerate(to_tokens_lens) if k == l]  # find len l to-tokenizations
-        subset = [to_tokens[i] for i in from_idx]  # find len l to-tokenizations
-        from_idx = torch.tensor(from_idx, dtype=torch.long)  # [subset_size]
-        to_idx = torch.tensor(subset, dtype=torch.long)  # [subset_size, l]
-        translation_map['lengths'][l] = {'from': from_idx,
-                                         'to': to_idx}
-        # accumulate counts on tokens, to be used to divide probability mass over its channeled sequences
-        counts[:l, :].scatter_add_(1, to_idx.T, torch.ones((l, len(subset)), dtype=torch.long))
-
-    translation_map['counts'] = counts
+    translation_map = build_translation_map(to_tokens, to_tokenizer.vocab_len)
+
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        torch.save(translation_map, tmp_path)
+        os.replace(tmp_path, path)
+
     return translation_map
 
 
@@ -461,16 +525,13 @@ def translate_one_to_many(probs_from: torch.FloatTensor, probs_to: torch.FloatTe
         Returns:
 
     """
-    many_len = probs_to.shape[0]
+    many_len = min(probs_to.shape[0], translation_map['phrase_table'].shape[0])  # unrolling steps available
+    to_idx = translation_map['phrase_table'][:many_len]  # [many_len, from_vocab_size]
+    mask = translation_map['phrase_mask'][:many_len]  # [many_len, from_vocab_size]
+
+    # === Unroll single distribution into std sequence, all steps in one scatter ===
+    probs_to[:many_len].scatter_add_(1, to_idx, probs_from[None, :to_idx.shape[1]] * mask)  # add probs in-place
 
-    # === Unroll single distribution into std sequence ===
-    for i in range(many_len):  # each unrolling step
-        for map_len in translation_map['lengths'].keys():  # each one-to-many mapping length available
-            if map_len < i + 1:
-                continue  # skip unrolling steps not available in a shorter mapping length
-            from_idx = translation_map['lengths'][map_len]['from']
-            to_idx = translation_map['lengths'][map_len]['to'].T  # [map_len, subset_size_std]
-            probs_to[i, :].scatter_add_(0, to_idx[i, :], probs_from[from_idx])  # add probs in-place
 
 def translate_many_to_one(probs_from: torch.FloatTensor, probs_to: torch.FloatTensor,
                           translation_map: Dict[str, Any]) -> None:
@@ -511,6 +572,19 @@ def translate_many_to_one(probs_from: torch.FloatTensor, probs_to: torch.FloatTe
         probs_to[from_idx] = server_seq_tokens.sum(dim=0) / map_len  # [subset_size_std] in-place average approx.
 
 
+# Loop implementations the tensor kernels replaced, kept as the reference for benchmark_translation.
+
+def translate_one_to_many_loop(probs_from: torch.FloatTensor, probs_to: torch.FloatTensor,
+                               translation_map: Dict[str, Any]) -> None:
+    many_len = probs_to.shape[0]
+    for i in range(many_len):  # each unrolling step
+        for map_len in translation_map['lengths'].keys():  # each one-to-many mapping length available
+            if map_len < i + 1:
+                continue  # skip unrolling steps not available in a shorter mapping length
+            from_idx = translation_map['lengths'][map_len]['from']
+            to_idx = translation_map['lengths'][map_len]['to'].T  # [map_len, subset_size_std]
+            probs_to[i, :].scatter_add_(0, to_idx[i, :], probs_from[from_idx])  # add probs in-place
+
 
 def translate_tokenizer_probs(probs: torch.FloatTensor, probs_std: torch.FloatTensor,
                               offset_mapping: List[tuple], offset_mapping_std: List[tuple],
@@ -759,37 +833,19 @@ def topk_token_phrases(logits: torch.Tensor, tokenizer: PreTrainedTokenizerBase,
     remainder_pmass = torch.clamp(1 - topk_pmass, 1e-40, 1)  # [batch_size] remainder probability mass
     floor_probs = remainder_pmass / (vocab_size - topk)  # [batch_size]divide remainder
 
-    # convert to list for faster iteration in list comprehension
-    topk_probs_list = topk_probs.tolist()
-    topk_indices_list = topk_indices.tolist()
-    floor_probs_list = floor_probs.tolist()
-
-    # === Construct topk phrases list ===
-    probs = []  # collect probability tensors with gradients attached (to be grafted into topk_tensor)
-    phrases = []  # form topk token phrases with prob prepend [prob, tok_0, tok_1, ... tok_n]
-
-    for b in range(batch_size):
-        # collect probability tensors with gradients attached (to be grafted into topk_tensor)
-        probs += [topk_probs[b], floor_probs[b]]  # [tensor(prob_k=0_b, prob_k=1_b, ...), tensor(prob_floor_b)]
-
-        # form topk token phrases with prob prepend [prob, tok_0, tok_1, ... tok_n]
-        phrases += [[prob] + tokenizer.std_token_phrases[i]
-                    for prob, i in zip(topk_probs_list[b], topk_indices_list[b])]  # [prob_k, tok_0_k, tok_1_k, ...]
-
-        # also add prob_floor for batch item
-        phrases += [[floor_probs_list[b]]]  # [prob_floor_b]
-
+    # === Pack phrases straight from the padded std_token_phrases table ===
+    phrase_table, phrase_lens = get_std_token_phrases_tensor(tokenizer, ignore_index)  # [vocab_size, max_phrase_len]
+    topk_indices = topk_indices.cpu()
     # determine width of topk_tensor as max len of all phrase lists (with prob in front)
-    max_len = max([len(p) for p in phrases])  # max_{b,k}(len([prob_k, tok_0_k, tok_1_k, ...]))
+    max_len = 1 + int(phrase_lens[topk_indices].max())  # max_{b,k}(len([prob_k, tok_0_k, tok_1_k, ...]))
 
-    # form single 2D tensor with all phrase and probs (typically to send to axon wire encoding)
-    topk_tensor = torch.tensor([p + [ignore_index] * (max_len - len(p))
-                                for p in phrases]).to(logits.device)  # [batch_size * (topk + 1), max_len]
+    topk_tensor = torch.full((batch_size, topk + 1, max_len), ignore_index, 
+                             dtype=topk_probs.dtype, device=logits.device)  # [batch_size, (topk + 1), max_len]
+    topk_tensor[:, :topk, 1:] = phrase_table[topk_indices][..., :max_len - 1].to(topk_tensor)  # [tok_0_k, tok_1_k, ...]
 
     # grafting probability tensors into first column to attach gradients
-    topk_tensor[:, 0] = torch.hstack(probs)  # tensor([prob_k=0_b, prob_k=1_b, ..., prob_floor_b])
-
-    topk_tensor = topk_tensor.reshape(batch_size, topk + 1, max_len)  # [batch_size, (topk + 1), max_len] reshaped
+    topk_tensor[:, :topk, 0] = topk_probs  # tensor([prob_k=0_b, prob_k=1_b, ...])
+    topk_tensor[:, topk, 0] = floor_probs  # tensor([prob_floor_b])
 
     return topk_tensor  # [batch_size, (topk + 1), max_len] (probability gradients attached in first column)
 
@@ -879,30 +935,18 @@ def unravel_topk_token_phrases(compact_topk: torch.Tensor, topk: int, ignore_ind
     probs_sum = probs.reshape(batch_size, topk + 1).sum(dim=1)  # [batch_size]
     assert torch.all((-atol < probs_sum) & (probs_sum < 1 + atol)), f'unravel_topk_token_phrases(): probs_sum not in [0, 1]'
 
-    # Obtain phrase lengths and maximum phrase length
-    phrase_len = prob_idx[1:] - prob_idx[:-1]  # [batch_size * (topk + 1) - 1] length of each phrase
-    phrase_len = torch.cat((phrase_len, torch.tensor([1])))  # [batch_size * (topk + 1)] prob_floor is always len=1
-    max_len = phrase_len.max()  # determine width of topk_tensor as max len of all phrase lists (with prob in front)
+    # Assign every compact entry its phrase (row) and its position in the phrase (column)
+    is_prob = torch.zeros(len(compact_topk), dtype=torch.long, device=compact_topk.device)
+    is_prob[prob_idx] = 1
+    phrase_idx = is_prob.cumsum(0) - 1  # [compact_len] phrase each entry belongs to
+    position = torch.arange(len(compact_topk), device=compact_topk.device) - prob_idx[phrase_idx]  # [compact_len]
+    max_len = int(position.max()) + 1  # determine width of topk_tensor as max len of all phrase lists (with prob in front)
 
     # Initialize topk_tensor with ignore_index + 2, since decrement with 2 follows to remove token offset later
     topk_tensor = torch.ones((batch_size * (topk + 1), max_len), device=compact_topk.device)
     topk_tensor *= ignore_index + 2  # [batch_size * (topk + 1), max_len]
 
-    # Insert phrases of each unique length as block into topk_tensor
-    for unique_len in phrase_len.unique():
-        if unique_len <= 1:
-            continue  # skip probability column, will be added afterward
-
-        phrase_idx = torch.where(phrase_len == unique_len)[0]  # phrase indices where phrase_len is unique_len
-        compact_idx = prob_idx[phrase_idx]  # indices in compact_topk
-
-        # Create indexing block, add index for each phrase position, skip first (prob) position
-        block_idx = [compact_idx + position for position in range(1, unique_len)]  # incrementally add each position of phrase
-        # transpose .t() ensures correct interleaving of consecutive positions:
-        # [[phrase_a_1, phrase_a_2, ..., phrase_a_n], [phrase_b_1, phrase_b_2, ..., phrase_b_n], ...]
-        block_idx = torch.vstack(block_idx).t().reshape(-1, unique_len - 1)  # [-1, unique_len - 1] for all phrases with unique_len
-
-        topk_tensor[phrase_idx, 1:unique_len] = compact_topk[block_idx]  # slice selected phrases and copy into topk_tensor
+    topk_tensor[phrase_idx, position] = compact_topk.to(topk_tensor)  # scatter all phrases in one pass
 
     topk_tensor -= 2  # remove token offset, overwrites probability column, replace probabilities below
 
@@ -1381,6 +1425,30 @@ def set_std_token_phrases(tokenizer, std_tokenizer):
         tokenizer.std_token_phrases = std_tokenizer(tokenizer.phrases)['input_ids']  # [topk, max_len] convert phrases to tokens sequences
 
 
+def get_std_token_phrases_tensor(tokenizer, ignore_index: int = -100) -> Tuple[torch.LongTensor, torch.LongTensor]:
+    r"""
+    Returns tokenizer.std_token_phrases as a padded table, built once per tokenizer.
+        Args:
+            tokenizer(:obj:`PreTrainedTokenizerBase`, `required`):
+                Tokenizer with std_token_phrases set, see set_std_token_phrases.
+            ignore_index (:obj:`int`, `optional`):
+                Padding value for the positions past the end of a shorter phrase.
+
+        Returns:
+            phrase_table (:obj:`torch.LongTensor`, `required`):
+                [vocab_len, max_phrase_len] std tokens of each token phrase, ignore_index padded.
+            phrase_lens (:obj:`torch.LongTensor`, `required`):
+                [vocab_len] Length of each token phrase.
+    """
+    cached = getattr(tokenizer, 'std_token_phrases_tensor', None)
+    if cached is None or cached[0] != ignore_index:
+        _, indices, rows, positions, phrase_lens = flatten_phrases(tokenizer.std_token_phrases)
+        phrase_table = torch.full((len(phrase_lens), max(int(phrase_lens.max()), 1)), ignore_index, dtype=torch.long)
+        phrase_table[rows, positions] = indices
+        tokenizer.std_token_phrases_tensor = cached = (ignore_index, phrase_table, phrase_lens)
+    return cached[1], cached[2]
+
+
 def prep_tokenizer(tokenizer, std_tokenizer=None):
     tokenizer.padding_side = "left"  # Generative default expects most recent token on right-hand side with padding on left. https://github.com/huggingface/transformers/pull/10552
     # tokenizer.add_prefix_space = False
@@ -1464,3 +1532,104 @@ def decode_topk(  forward_response_tensor: torch.Tensor, vocab_size:int=50400) -
 
     return logits  # [batch_size, sequence_len, vocab_size]
 
+
+
+def topk_token_phrases_loop(logits: torch.Tensor, tokenizer: PreTrainedTokenizerBase,
+                            topk: int, ignore_index: int = -100) -> torch.Tensor:
+    # reference for topk_token_phrases, builds and pads python phrase lists per batch item
+    batch_size, vocab_size = logits.shape
+    probs = torch.softmax(logits.float(), dim=1)
+    topk_probs, topk_indices = torch.topk(probs, topk)
+    remainder_pmass = torch.clamp(1 - topk_probs.sum(dim=-1), 1e-40, 1)
+    floor_probs = remainder_pmass / (vocab_size - topk)
+    topk_probs_list, topk_indices_list, floor_probs_list = topk_probs.tolist(), topk_indices.tolist(), floor_probs.tolist()
+    probs, phrases = [], []
+    for b in range(batch_size):
+        probs += [topk_probs[b], floor_probs[b]]
+        phrases += [[prob] + tokenizer.std_token_phrases[i] for prob, i in zip(topk_probs_list[b], topk_indices_list[b])]
+        phrases += [[floor_probs_list[b]]]
+    max_len = max([len(p) for p in phrases])
+    topk_tensor = torch.tensor([p + [ignore_index] * (max_len - len(p)) for p in phrases]).to(logits.device)
+    topk_tensor[:, 0] = torch.hstack(probs)
+    return topk_tensor.reshape(batch_size, topk + 1, max_len)
+
+
+def unravel_topk_token_phrases_loop(compact_topk: torch.Tensor, topk: int, ignore_index: int = -100) -> torch.Tensor:
+    # reference for unravel_topk_token_phrases, copies one block per unique phrase length
+    atol = 1e-6
+    prob_idx = torch.where((-atol < compact_topk) & (compact_topk < 1 + atol))[0]
+    batch_size = len(prob_idx) // (topk + 1)
+    probs = torch.clamp(compact_topk[prob_idx], 0, 1)
+    phrase_len = prob_idx[1:] - prob_idx[:-1]
+    phrase_len = torch.cat((phrase_len, torch.tensor([1])))
+    max_len = phrase_len.max()
+    topk_tensor = torch.ones((batch_size * (topk + 1), max_len), device=compact_topk.device)
+    topk_tensor *= ignore_index + 2
+    for unique_len in phrase_len.unique():
+        if unique_len <= 1:
+            continue
+        phrase_idx = torch.where(phrase_len == unique_len)[0]
+        compact_idx = prob_idx[phrase_idx]
+        block_idx = [compact_idx + position for position in range(1, unique_len)]
+        block_idx = torch.vstack(block_idx).t().reshape(-1, unique_len - 1)
+        topk_tensor[phrase_idx, 1:unique_len] = compact_topk[block_idx]
+    topk_tensor -= 2
+    topk_tensor[:, 0] = probs
+    return topk_tensor.reshape(batch_size, topk + 1, max_len)
+
+
+def benchmark_translation(vocab_size: int = 50257, vocab_size_std: int = 50400, max_phrase_len: int = 4,
+                          segments: int = 64, batch_size: int = 8, topk: int = 4096, trials: int = 3,
+                          seed: int = 0) -> Dict[str, Dict[str, float]]:
+    r"""
+    Times the translation and topk-phrase tensor kernels against the loop implementations they replaced,
+    on a synthetic tokenizer pair, and checks that both produce the same output.
+        Returns:
+            results (:obj:`Dict[str, Dict[str, float]]`, `required`):
+                Per kernel, the loop and tensor kernel seconds, the speedup and the max absolute difference.
+    """
+    import types
+    generator = torch.Generator().manual_seed(seed)
+
+    def random_phrases(n, vocab, max_len):
+        lens = torch.randint(1, max_len + 1, (n,), generator=generator).tolist()
+        return [torch.randint(0, vocab, (l,), generator=generator).tolist() for l in lens]
+
+    to_map = build_translation_map(random_phrases(vocab_size, vocab_size_std, max_phrase_len), vocab_size_std)
+    probs = torch.softmax(torch.randn(segments, vocab_size, generator=generator), dim=-1)
+    many_lens = torch.randint(1, max_phrase_len + 1, (segments,), generator=generator)
+    starts = torch.cat([torch.zeros(1, dtype=torch.long), many_lens.cumsum(0)[:-1]])
+    sequence_len = int(many_lens.sum())
+
+    def one_to_many(fn):
+        def run():
+            probs_std = torch.zeros(sequence_len, vocab_size_std)
+            for s in range(segments):
+                fn(probs[s], probs_std[starts[s]:starts[s] + many_lens[s]], to_map)
+            return probs_std
+        return run
+
+    tokenizer = types.SimpleNamespace(std_token_phrases=random_phrases(vocab_size, vocab_size_std, max_phrase_len))
+    logits = torch.randn(batch_size, vocab_size, generator=generator)
+    compact_topk = compact_topk_token_phrases(topk_token_phrases_loop(logits, tokenizer, topk))
+
+    kernels = {
+        'one_to_many': (one_to_many(translate_one_to_many_loop), one_to_many(translate_one_to_many)),
+        'topk_token_phrases': (lambda: topk_token_phrases_loop(logits, tokenizer, topk),
+                               lambda: topk_token_phrases(logits, tokenizer, topk)),
+        'unravel_topk_token_phrases': (lambda: unravel_topk_token_phrases_loop(compact_topk, topk),
+                                       lambda: unravel_topk_token_phrases(compact_topk, topk)),
+    }
+
+    results = {}
+    for name, (loop_fn, kernel_fn) in kernels.items():
+        seconds = []
+        for fn in [loop_fn, kernel_fn]:
+            fn()  # warmup
+            t = time.time()
+            for _ in range(trials):
+                fn()
+            seconds += [(time.time() - t) / trials]
+        diff = (loop_fn().nan_to_num() - kernel_fn().nan_to_num()).abs().max().item()
+        results[name] = {'loop': seconds[0], 'kernel': seconds[1], 'speedup': seconds[0] / seconds[1], 'max_diff': diff}
+    return results
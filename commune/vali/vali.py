@@ -271,7 +271,9 @@ class Vali(c.Module):
             if isinstance(config.netuid, str):
                 config.netuid = self.subspace.subnet2netuid(config.netuid)
             self.subspace = c.module('subspace')(network=config.network)
-            namespace = self.subspace.namespace(netuid=config.netuid, max_age=config.sync_interval)  
+            namespace = self.subspace.synced('namespace', netuid=config.netuid, network=config.network, max_age=config.sync_interval)
+            if namespace == None:
+                namespace = self.subspace.namespace(netuid=config.netuid, max_age=config.sync_interval)  
         else:
             raise Exception(f'Invalid network {config.network}')
         self.namespace = namespace
@@ -1,4 +1,7 @@
 import commune as c
+import queue
+import threading
+import numpy as np
 import datasets
 from datasets import load_dataset
 from typing import Dict, List
@@ -21,9 +24,12 @@ class DataHF(c.Module):
                 name: str =  None,
                 streaming: bool= False,
                 split: str = None, 
+                prefetch: int = 0,
                 **kwargs):
         config = self.set_config(locals())
         self.set_dataset(path=config.path, name=config.name, split=config.split, streaming=config.streaming)
+        if prefetch > 0:
+            self.start_prefetch(buffer_size=prefetch)
     
 
         
@@ -67,15 +73,71 @@ class DataHF(c.Module):
         return len(self)
     
 
-    def random_idx(self):
-        return c.random_int(len(self))
+    def random_idx(self, n:int = None):
+        if n == None:
+            return int(np.random.randint(len(self)))
+        return np.random.randint(len(self), size=n)
     
         
     def sample(self, idx:int=None, batch_size:int = 1):
         if batch_size > 1:
-            return [self.sample() for i in range(batch_size)]
+            return self.samples(n=batch_size)
+        if idx == None:
+            samples = self.buffered_samples(1)
+            if len(samples) > 0:
+                return samples[0]
         idx = self.random_idx() if idx == None else idx
         return self.dataset[idx]
+
+    def select(self, idxs:List[int]) -> List[dict]:
+        """
+        Gathers the rows in one arrow take instead of one lookup per row.
+        """
+        batch = self.dataset[list(map(int, idxs))] # {column: [values]}
+        return [dict(zip(batch.keys(), values)) for values in zip(*batch.values())]
+
+    def samples(self, n:int = 32, idxs:List[int] = None) -> List[dict]:
+        """
+        Returns {n} random rows in one call, so remote validators need one rpc per batch instead of per sample.
+        """
+        if idxs != None:
+            return self.select(idxs)
+        samples = self.buffered_samples(n)
+        if len(samples) < n:
+            samples += self.select(self.random_idx(n - len(samples)))
+        return samples
+
+    # PREFETCH BUFFER
+
+    def start_prefetch(self, buffer_size:int = 1024, batch_size:int = 128):
+        """
+        Keeps {buffer_size} random rows ready, drawn {batch_size} at a time in a background thread.
+        """
+        self.sample_buffer = queue.Queue(maxsize=buffer_size)
+        self.prefetch_batch_size = batch_size
+        self.prefetch_thread = threading.Thread(target=self.prefetch_loop, daemon=True)
+        self.prefetch_thread.start()
+        return {'buffer_size': buffer_size, 'batch_size': batch_size}
+
+    def prefetch_loop(self):
+        while True:
+            try:
+                for sample in self.select(self.random_idx(self.prefetch_batch_size)):
+                    self.sample_buffer.put(sample)
+            except Exception as e:
+                c.print(f'Prefetch error: {e}', color='red')
+                c.sleep(1)
+
+    def buffered_samples(self, n:int = 1) -> List[dict]:
+        samples = []
+        if not hasattr(self, 'sample_buffer'):
+            return samples
+        while len(samples) < n:
+            try:
+                samples += [self.sample_buffer.get_nowait()]
+            except queue.Empty:
+                break
+        return samples
     
 
 
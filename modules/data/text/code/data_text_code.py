@@ -1,29 +1,27 @@
 import commune as c
 
-class DataTextCode(c.Module):
-    def __init__(self, **kwargs):
-        config = self.set_config(kwargs=kwargs)
-        self.folder_path = self.resolve_path(config.folder_path)
-        self.filepaths = sorted([f for f in self.walk(self.folder_path) if f.endswith('.py')])
-
-    def random_idx(self):
-        return self.random_int(0, len(self.filepaths)-1)
-
-    
+class DataTextCode(c.module('data.text.folder')):
     def sample(self, idx=None, 
                input_chars:int = 500,
                output_chars: int = 500,
                random_start_line: int = None,
                 real_prob:float=0.5):
-        
-        while True:
-            idx = self.random_idx() if idx == None else idx
-            filepath =  self.filepaths[idx]
-            file_text = c.get_text(filepath)
-            if len(file_text) > input_chars + output_chars:
-                break
-            else:
-                idx = None
+        kwargs = dict(input_chars=input_chars, output_chars=output_chars, real_prob=real_prob)
+        if idx == None:
+            sample = self.buffered_sample(**kwargs)
+            if sample != None:
+                return sample
+        return self.draw_sample(idx=idx, **kwargs)
+
+    def draw_sample(self, idx=None, 
+                    input_chars:int = 500,
+                    output_chars: int = 500,
+                    real_prob:float=0.5):
+        if idx == None:
+            idx, file_text = self.random_text(input_chars + output_chars + 1)
+        else:
+            file_text = self.read_file(idx)
+        filepath =  self.filepaths[idx]
 
         start_index = c.random_int(0, len(file_text) - output_chars)
 
@@ -44,8 +42,9 @@ class DataTextCode(c.Module):
 
         #  then we need to sample a different file
         if sample['real'] == 0 :
-            other_sample = self.sample( input_chars=input_chars, real_prob = 0, output_chars=output_chars)
-            sample['output_text'] = other_sample['output_text']
+            _, other_text = self.random_text(input_chars + output_chars + 1)
+            other_start = c.random_int(0, len(other_text) - output_chars)
+            sample['output_text'] = other_text[other_start + input_chars:other_start + input_chars + output_chars]
     
         return sample
 
@@ -1,32 +1,92 @@
+import os
+import queue
+import threading
+import numpy as np
+from collections import OrderedDict
 import commune as c
 
 class DataFolder(c.Module):
-    def __init__(self, folder_path: str = './', suffix: str = '.py'):
+    def __init__(self, folder_path: str = './', suffix: str = '.py', cache_size: int = 1024, prefetch: int = 0):
         config = self.set_config(kwargs=locals())
         self.folder_path = self.resolve_path(config.folder_path)
-        self.filepaths = sorted([f for f in self.walk(self.folder_path) if f.endswith('.py')])
+        self.set_index(suffix=config.suffix)
+        self.cache_size = config.cache_size
+        self.text_cache = OrderedDict() # idx -> file text, least recently used first
+        self.text_cache_lock = threading.Lock()
+        if config.prefetch > 0:
+            self.start_prefetch(buffer_size=config.prefetch)
+
+    def set_index(self, suffix:str = '.py'):
+        """
+        Indexes the files once, so samples are only drawn from files that are long enough.
+        The index holds byte sizes, an upper bound of the char length that is tightened when a file is read.
+        """
+        self.filepaths = sorted([f for f in self.walk(self.folder_path) if f.endswith(suffix)])
+        self.lengths = np.array([os.path.getsize(f) for f in self.filepaths], dtype=np.int64)
+        self.eligible_cache = {}
+        return {'files': len(self.filepaths), 'chars': int(self.lengths.sum())}
+
+    def eligible_idxs(self, min_chars:int = 0) -> np.ndarray:
+        if min_chars not in self.eligible_cache:
+            self.eligible_cache[min_chars] = np.flatnonzero(self.lengths >= min_chars)
+        return self.eligible_cache[min_chars]
+
+    def random_idx(self, min_chars:int = 0):
+        idxs = self.eligible_idxs(min_chars)
+        assert len(idxs) > 0, f'No files in {self.folder_path} with at least {min_chars} chars'
+        return int(idxs[np.random.randint(len(idxs))])
+
+    def read_file(self, idx:int) -> str:
+        """ the text of the file at idx, through the lru cache """
+        with self.text_cache_lock:
+            if idx in self.text_cache:
+                self.text_cache.move_to_end(idx)
+                return self.text_cache[idx]
+        with open(self.filepaths[idx], 'r', errors='replace') as f:
+            text = f.read()
+        with self.text_cache_lock:
+            self.text_cache[idx] = text
+            if len(self.text_cache) > self.cache_size:
+                self.text_cache.popitem(last=False)
+            if len(text) < self.lengths[idx]:
+                # multibyte chars, store the real length so the file is not drawn again for too long samples
+                self.lengths[idx] = len(text)
+                self.eligible_cache = {}
+        return text
+
+    def random_text(self, min_chars:int = 0, max_trials:int = 10) -> tuple:
+        """
+        Returns (idx, text) of a random file with at least {min_chars} chars.
+        """
+        for _ in range(max_trials):
+            idx = self.random_idx(min_chars)
+            text = self.read_file(idx)
+            if len(text) >= min_chars:
+                return idx, text
+        raise Exception(f'No files in {self.folder_path} with at least {min_chars} chars')
 
-    def random_idx(self):
-        return self.random_int(0, len(self.filepaths)-1)
-    
     def sample(self, idx=None, 
                input_chars:int = 1000,
                output_chars: int = 500,
                start_index: int = None,
                 real_prob:float=0.5):
-        
+        kwargs = dict(input_chars=input_chars, output_chars=output_chars, real_prob=real_prob)
+        if idx == None and start_index == None:
+            sample = self.buffered_sample(**kwargs)
+            if sample != None:
+                return sample
+        return self.draw_sample(idx=idx, start_index=start_index, **kwargs)
+
+    def draw_sample(self, idx=None, 
+                    input_chars:int = 1000,
+                    output_chars: int = 500,
+                    start_index: int = None,
+                    real_prob:float=0.5):
         if idx == None:
-            while True:
-                idx = self.random_idx()
-                filepath =  self.filepaths[idx]
-                file_text = c.get_text(filepath)
-                if len(file_text) >= input_chars + output_chars:
-                    break
-                else:
-                    idx = None
+            idx, file_text = self.random_text(input_chars + output_chars)
         else:
-            filepath =  self.filepaths[idx]
-            file_text = c.get_text(filepath)
+            file_text = self.read_file(idx)
+        filepath =  self.filepaths[idx]
 
         if start_index == None:
             start_index = c.random_int(0, len(file_text) - input_chars - output_chars )
@@ -53,16 +113,58 @@ class DataFolder(c.Module):
 
         #  then we need to sample a different file
         if sample['real'] == 0 :
-            other_sample = self.sample( input_chars=input_chars, real_prob = 1, output_chars=output_chars)
-            sample['output_text'] = other_sample['output_text']
+            _, other_text = self.random_text(output_chars)
+            other_start = c.random_int(0, len(other_text) - output_chars)
+            sample['output_text'] = other_text[other_start:other_start + output_chars]
     
         return sample
 
+    def samples(self, n:int = 32, **kwargs) -> list:
+        """
+        Returns {n} samples in one call, so remote validators need one rpc per batch instead of per sample.
+        """
+        return [self.sample(**kwargs) for _ in range(n)]
+
+    # PREFETCH BUFFER
+
+    def start_prefetch(self, buffer_size:int = 256, **sample_kwargs):
+        """
+        Keeps {buffer_size} samples ready in a background thread for calls with the default sample kwargs.
+        """
+        self.prefetch_kwargs = {k:v for k,v in c.fn_defaults(self.draw_sample).items() if k not in ['idx', 'start_index']}
+        self.prefetch_kwargs.update(sample_kwargs)
+        self.sample_buffer = queue.Queue(maxsize=buffer_size)
+        self.prefetch_thread = threading.Thread(target=self.prefetch_loop, daemon=True)
+        self.prefetch_thread.start()
+        return {'buffer_size': buffer_size, 'kwargs': self.prefetch_kwargs}
+
+    def prefetch_loop(self):
+        while True:
+            try:
+                self.sample_buffer.put(self.draw_sample(**self.prefetch_kwargs))
+            except Exception as e:
+                c.print(f'Prefetch error: {e}', color='red')
+                c.sleep(1)
+
+    def buffered_sample(self, **kwargs):
+        if not hasattr(self, 'sample_buffer'):
+            return None
+        if any(self.prefetch_kwargs.get(k) != v for k,v in kwargs.items()):
+            return None
+        try:
+            return self.sample_buffer.get_nowait()
+        except queue.Empty:
+            return None
 
     def test(self, n=100):
-        sample = self.sample()
-        msg = {'samples_per_second': i / (c.time() - t)}
+        t = c.time()
+        samples = self.samples(n)
+        assert len(samples) == n
+        for sample in samples:
+            assert len(sample['input_text']) == sample['input_chars']
+        msg = {'samples_per_second': n / (c.time() - t)}
         c.print(msg)
+        return msg
 
     @classmethod
     def validate(cls, *objs):
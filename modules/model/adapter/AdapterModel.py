@@ -14,7 +14,6 @@ from munch import Munch
 import argparse
 import torch
 from commune.utils.torch import tensor_dict_info
-from commune.utils.tokenizer import decode_topk
 import streamlit as st
 # logger = logger.opt(colors=True)
 import commune
@@ -99,7 +98,8 @@ class AdapterModel(Model):
 
         model_output = self.model.forward(**sample)
 
-        model_output['logits'] = decode_topk(model_output['topk'], vocab_size=int(self.vocab_size), topk= topk).to(self.device)
+        # model.hf packs the topk into bytes, its decode_topk unpacks them (and still reads the legacy tensor layout)
+        model_output['logits'] = commune.module('model.hf').decode_topk(model_output['topk'], vocab_size=int(self.vocab_size), topk= topk).to(self.device)
         model_output['hidden_states'] = model_output['hidden_states'][..., :self.hidden_dim]
         model_output['adapter_logits'] = self.adapter(model_output['hidden_states'].to(self.device))
 
@@ -3,6 +3,9 @@ import asyncio
 from copy import deepcopy
 from typing import Union, Optional, List
 import os, sys
+import time
+import struct
+import numpy as np
 from typing import *
 from loguru import logger
 import torch
@@ -60,7 +63,7 @@ class ModelTransformer(Model):
         if output_hidden_states:
             response['hidden_states'] = output['hidden_states'][hidden_layer].detach()
         if topk:
-            response['topk']=self.encode_topk(output['logits'].detach(), topk=topk).detach()
+            response['topk']=self.encode_topk(output['logits'].detach(), topk=topk)
         else:
             response['logits']= output['logits'].detach()
         
@@ -192,56 +195,172 @@ class ModelTransformer(Model):
                 
         return self.tokenizer
 
-    @staticmethod
-    def encode_topk( forward_response_tensor: torch.Tensor , topk:int=4096) -> torch.Tensor:
-        '''
-        ## Documentation
-        
-        ### Function: encode_topk
-        
-        #### Description:
-        The `encode_topk` function takes a tensor of unnormalized logit scores and returns the top-k tokens and their corresponding probabilities. The input tensor is expected to represent a batch of sequences, with each sequence containing a distribution over a vocabulary of possible tokens.
-        
-        #### Parameters:
-        - `forward_response_tensor` (torch.Tensor): A tensor containing unnormalized logit scores of shape `[batch_size, sequence_len, vocab_size]`.
-          
-        
-        '''
-        """ Returns topk tokens/probabilities given unnormalized logits as input. """
+    # packed topk layout: header | indices (uint16 or int32) | probs (float16 or uint8 -log p) | remainder (float32)
+    topk_header = struct.Struct('<4sBBHIIII')
+    topk_magic = b'TOPK'
+    topk_prob_dtypes = ['float16', 'uint8']
+    topk_index_dtypes = ['uint16', 'int32']
+    topk_logp_max = 32.0 # uint8 probs quantize -log p over [0, topk_logp_max] nats
 
-        #import ipdb; ipdb.set_trace()
-
-        logits = forward_response_tensor  # unnormalized logit scores: [batch_size, sequence_len, vocab_size]
-        probs = torch.softmax(logits, dim=-1).to(torch.float32)  # normalized probabilities: [batch_size, sequence_len, vocab_size]
-
-        topk_indices = torch.argsort(logits, dim=-1, descending=True)[...,:topk]
-        # topk_values, topk_indices = torch.topk(probs, topk) # topk probs and indices: [batch_size, sequence_len, topk]
+    @classmethod
+    def encode_topk(cls, forward_response_tensor: torch.Tensor, topk:int=4096, prob_dtype:str='float16') -> bytes:
+        """
+        Packs the topk tokens/probabilities of unnormalized logits [batch_size, sequence_len, vocab_size]
+        into bytes. Indices are uint16 when the vocab fits (int32 otherwise) and probabilities are
+        float16, or uint8 when quantizing -log p (~0.13 nats resolution).
+        """
+        logits = forward_response_tensor.detach().float()
+        batch_size, sequence_len, vocab_size = logits.shape
+        topk = min(topk, vocab_size)
+        topk_logits, topk_indices = torch.topk(logits, topk, dim=-1) # [batch_size, sequence_len, topk]
+        topk_logprobs = topk_logits - torch.logsumexp(logits, dim=-1, keepdim=True)
+
+        assert prob_dtype in cls.topk_prob_dtypes, f'prob_dtype must be one of {cls.topk_prob_dtypes}'
+        if prob_dtype == 'float16':
+            probs = topk_logprobs.exp().cpu().numpy().astype('<f2')
+        else:
+            probs = torch.round(-topk_logprobs / cls.topk_logp_max * 255).clamp(0, 255).cpu().numpy().astype(np.uint8)
+        index_dtype = 'uint16' if vocab_size <= 2**16 else 'int32'
+        indices = topk_indices.cpu().numpy().astype('<u2' if index_dtype == 'uint16' else '<i4')
+        # the exact mass outside the topk, so quantized probs do not skew the tail
+        remainder = (1 - topk_logprobs.exp().sum(dim=-1)).clamp(min=0).cpu().numpy().astype('<f4')
+
+        header = cls.topk_header.pack(cls.topk_magic,
+                                      cls.topk_prob_dtypes.index(prob_dtype),
+                                      cls.topk_index_dtypes.index(index_dtype),
+                                      0, batch_size, sequence_len, topk, vocab_size)
+        return header + indices.tobytes() + probs.tobytes() + remainder.tobytes()
 
-        topk_values = probs.gather( index=topk_indices, dim=-1)
-        encoded_probs = torch.cat([topk_values, topk_indices], dim=-1)  # [batch_size, sequence_len, topk + topk]
-        return encoded_probs  # [batch_size, sequence_len, topk + topk]
+    @classmethod
+    def unpack_topk(cls, encoded: bytes, device:str=None) -> Dict[str, torch.Tensor]:
+        """ Unpacks encode_topk bytes into indices [batch_size, sequence_len, topk], probs and the remainder mass. """
+        if isinstance(encoded, str):
+            encoded = bytes.fromhex(encoded)
+        magic, prob_code, index_code, _, batch_size, sequence_len, topk, vocab_size = cls.topk_header.unpack_from(encoded)
+        assert magic == cls.topk_magic, 'not a packed topk encoding'
+        shape = (batch_size, sequence_len, topk)
+        n = batch_size * sequence_len * topk
+        offset = cls.topk_header.size
+        index_dtype = np.dtype('<u2' if cls.topk_index_dtypes[index_code] == 'uint16' else '<i4')
+        indices = np.frombuffer(encoded, dtype=index_dtype, count=n, offset=offset)
+        offset += n * index_dtype.itemsize
+        if cls.topk_prob_dtypes[prob_code] == 'float16':
+            probs = torch.from_numpy(np.frombuffer(encoded, dtype='<f2', count=n, offset=offset).astype(np.float32))
+            offset += n * 2
+        else:
+            q = torch.from_numpy(np.frombuffer(encoded, dtype=np.uint8, count=n, offset=offset).astype(np.float32))
+            probs = torch.exp(-q * (cls.topk_logp_max / 255))
+            offset += n
+        remainder = torch.from_numpy(np.frombuffer(encoded, dtype='<f4', count=batch_size * sequence_len, offset=offset).copy())
+
+        indices = torch.from_numpy(indices.astype(np.int64)).view(shape)
+        probs = probs.view(shape)
+        remainder = remainder.view(batch_size, sequence_len).clamp(1e-40, 1) # mass outside the topk: [batch_size, sequence_len]
+        if device != None:
+            indices, probs, remainder = indices.to(device), probs.to(device), remainder.to(device)
+        return {'indices': indices, 'probs': probs, 'remainder': remainder, 'vocab_size': vocab_size}
 
+    @classmethod
+    def score_topk(cls, encoded: Union[bytes, Dict], target_ids: torch.Tensor) -> torch.Tensor:
+        """
+        Sparse scoring: log-probabilities [batch_size, sequence_len] of target_ids under the topk
+        encoding. Targets outside the topk share the remainder mass, the full vocab is never expanded.
+        """
+        topk = encoded if isinstance(encoded, dict) else cls.unpack_topk(encoded)
+        indices, probs = topk['indices'], topk['probs']
+        target_ids = target_ids.to(indices.device).long()
+        hit = indices == target_ids[..., None] # [batch_size, sequence_len, topk]
+        in_topk = hit.any(dim=-1)
+        topk_prob = (probs * hit).sum(dim=-1)
+        floor = topk['remainder'] / max(topk['vocab_size'] - indices.shape[-1], 1)
+        return torch.log(torch.where(in_topk, topk_prob, floor) + 1e-40)
 
-    @staticmethod
-    def decode_topk(  forward_response_tensor: torch.Tensor, topk=4096, vocab_size:int=50257) -> torch.Tensor:
-        """ Returns full logits by decoding topk-encoding input. """
-        batch_size, sequence_len, _ = forward_response_tensor.shape
-        
-        encoded_probs = forward_response_tensor  # encoded probabilities: [batch_size, sequence_len, topk + topk]
-        topk_values = encoded_probs[..., :topk]  # topk probs: [batch_size, sequence_len, topk]
-        topk_indices = encoded_probs[..., topk:].long()  # topk probs indices: [batch_size, sequence_len, topk]
+    @classmethod
+    def topk_loss(cls, encoded: Union[bytes, Dict], input_ids: torch.Tensor) -> torch.Tensor:
+        """ Next token cross entropy of input_ids under a topk encoding (the sparse calculate_loss). """
+        topk = encoded if isinstance(encoded, dict) else cls.unpack_topk(encoded)
+        sequence_len = topk['indices'].shape[1]
+        topk = {**topk, 'indices': topk['indices'][:, :-1], 'probs': topk['probs'][:, :-1], 'remainder': topk['remainder'][:, :-1]}
+        target_ids = input_ids[:, -(sequence_len - 1):]
+        return -cls.score_topk(topk, target_ids).mean()
 
-        topk_pmass = topk_values.sum(dim=-1)  # topk probability mass: [batch_size, sequence_len]
-        remainder_pmass = torch.clamp(1 - topk_pmass, 1e-40, 1)  # remainder probability mass: [batch_size, sequence_len]
-        remainder_floor = remainder_pmass / (vocab_size - topk)  # divide remainder: [batch_size, sequence_len]
+    @classmethod
+    def decode_topk(cls, forward_response_tensor: Union[bytes, torch.Tensor], topk=4096, vocab_size:int=50257) -> torch.Tensor:
+        """
+        Returns full logits by decoding the topk encoding. Prefer score_topk/topk_loss,
+        which never materialize [batch_size, sequence_len, vocab_size].
+        """
+        if isinstance(forward_response_tensor, (bytes, str)):
+            decoded = cls.unpack_topk(forward_response_tensor)
+            topk_values, topk_indices, remainder_pmass = decoded['probs'], decoded['indices'], decoded['remainder']
+            vocab_size, topk = decoded['vocab_size'], topk_indices.shape[-1]
+        else:
+            # legacy float layout: [batch_size, sequence_len, topk + topk]
+            topk_values = forward_response_tensor[..., :topk]
+            topk_indices = forward_response_tensor[..., topk:].long()
+            topk_pmass = topk_values.sum(dim=-1)  # topk probability mass: [batch_size, sequence_len]
+            remainder_pmass = torch.clamp(1 - topk_pmass, 1e-40, 1)  # remainder probability mass: [batch_size, sequence_len]
+        batch_size, sequence_len, _ = topk_values.shape
 
-        logits = torch.ones((batch_size, sequence_len, vocab_size), dtype=topk_values.dtype).to(topk_values.device)
-        logits *= torch.log(remainder_floor)[:, :, None]  # set probability floor: [batch_size, sequence_len, vocab_size]
+        remainder_floor = remainder_pmass / max(vocab_size - topk, 1)  # divide remainder: [batch_size, sequence_len]
 
+        logits = torch.log(remainder_floor)[:, :, None].expand(batch_size, sequence_len, vocab_size).contiguous()
         logits.scatter_(-1, topk_indices, torch.log(topk_values + 1e-40))  # insert topk probs: [batch_size, sequence_len, vocab_size]
 
         return logits  # [batch_size, sequence_len, vocab_size]
 
+    @classmethod
+    def benchmark_topk(cls, batch_size:int=4, sequence_len:int=64, vocab_size:int=50257, topk:int=4096, n:int=3):
+        """ Compares the packed topk encoding with the float32 argsort layout over the serializer. """
+        serializer = c.module('serializer')()
+        logits = torch.randn(batch_size, sequence_len, vocab_size) * 4
+        # targets drawn from the distribution itself, like real next tokens
+        target_ids = torch.multinomial(torch.softmax(logits, dim=-1).view(-1, vocab_size), 1).view(batch_size, sequence_len)
+        exact = torch.log_softmax(logits, dim=-1).gather(-1, target_ids[..., None])[..., 0]
+
+        def timeit(fn):
+            t = time.time()
+            for _ in range(n):
+                out = fn()
+            return out, (time.time() - t) / n * 1000
+
+        def legacy_encode():
+            probs = torch.softmax(logits, dim=-1)
+            topk_indices = torch.argsort(logits, dim=-1, descending=True)[..., :topk]
+            return torch.cat([probs.gather(index=topk_indices, dim=-1), topk_indices], dim=-1)
+
+        results = {}
+        encoded, t_encode = timeit(lambda: serializer.serialize({'topk': legacy_encode()}))
+        decoded, t_decode = timeit(lambda: cls.decode_topk(serializer.deserialize(encoded)['topk'], topk=topk, vocab_size=vocab_size))
+        score = decoded.gather(-1, target_ids[..., None])[..., 0]
+        results['float32_argsort'] = {'encode_ms': t_encode, 'decode_ms': t_decode, 'bytes': len(encoded), 'mean_err': (score - exact).abs().mean().item()}
+
+        for prob_dtype in cls.topk_prob_dtypes:
+            encoded, t_encode = timeit(lambda: serializer.serialize({'topk': cls.encode_topk(logits, topk=topk, prob_dtype=prob_dtype)}))
+            score, t_decode = timeit(lambda: cls.score_topk(serializer.deserialize(encoded)['topk'], target_ids))
+            results[f'packed_{prob_dtype}'] = {'encode_ms': t_encode, 'decode_ms': t_decode, 'bytes': len(encoded), 'mean_err': (score - exact).abs().mean().item()}
+
+        df = c.df([{'encoding': k, **v} for k, v in results.items()])
+        c.print(df)
+        return results
+
+    @classmethod
+    def test_topk(cls, batch_size:int=2, sequence_len:int=8, vocab_size:int=1000, topk:int=50):
+        logits = torch.randn(batch_size, sequence_len, vocab_size)
+        input_ids = torch.randint(0, vocab_size, (batch_size, sequence_len))
+        topk_logits, topk_indices = torch.topk(logits, topk, dim=-1)
+        dense = cls.decode_topk(cls.encode_topk(logits, topk=topk, prob_dtype='float16'))
+        assert dense.shape == logits.shape
+        assert torch.equal(torch.topk(dense, topk, dim=-1).indices.sort(-1).values, topk_indices.sort(-1).values)
+        for prob_dtype in cls.topk_prob_dtypes:
+            encoded = cls.encode_topk(logits, topk=topk, prob_dtype=prob_dtype)
+            sparse = cls.score_topk(encoded, input_ids)
+            expected = dense.gather(-1, input_ids[..., None])[..., 0]
+            tol = 1e-2 if prob_dtype == 'float16' else 0.1
+            assert torch.allclose(sparse, expected, atol=tol), f'{prob_dtype} sparse scores diverge from the dense decode'
+        loss = cls.topk_loss(cls.encode_topk(logits, topk=topk), input_ids)
+        assert abs(loss.item() - cls.calculate_loss(dense, input_ids).item()) < 1e-2
+        return {'success': True, 'msg': 'topk encoding works'}
 
     def tokenizer_name(self):
         '''
@@ -473,31 +592,124 @@ class ModelTransformer(Model):
     
 
 
-    def generate_stream(self, text: str, 
-                max_length: int = 20, 
+    @staticmethod
+    def sample_token(logits: torch.Tensor,
+                     do_sample: bool = False,
+                     temperature: float = 1.0,
+                     top_k: int = 0,
+                     top_p: float = 1.0) -> torch.Tensor:
+        """ Picks the next token from the last position logits [batch_size, vocab_size]. """
+        if not do_sample:
+            return logits.argmax(dim=-1)
+        logits = logits.float() / max(temperature, 1e-5)
+        if top_k and top_k < logits.shape[-1]:
+            kth = torch.topk(logits, top_k, dim=-1).values[..., -1:]
+            logits = logits.masked_fill(logits < kth, float('-inf'))
+        if top_p < 1.0:
+            sorted_logits, sorted_idx = torch.sort(logits, dim=-1, descending=True)
+            cum_probs = torch.softmax(sorted_logits, dim=-1).cumsum(dim=-1)
+            # drop tokens once the mass before them exceeds top_p (always keeps the first)
+            drop = (cum_probs - torch.softmax(sorted_logits, dim=-1)) > top_p
+            logits = logits.scatter(-1, sorted_idx, sorted_logits.masked_fill(drop, float('-inf')))
+        probs = torch.softmax(logits, dim=-1)
+        return torch.multinomial(probs, num_samples=1).squeeze(-1)
+
+    def decode_token(self, ids: List[int], prefix_offset: int = 0, read_offset: int = 0):
+        """
+        Incremental detokenization: only decodes the window since the last emitted text,
+        and holds back partial characters (multi-token utf-8) until they are complete.
+        Returns (new_text, prefix_offset, read_offset).
+        """
+        prefix_text = self.tokenizer.decode(ids[prefix_offset:read_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(ids[prefix_offset:], skip_special_tokens=True)
+        if len(new_text) > len(prefix_text) and not new_text.endswith('\ufffd'):
+            return new_text[len(prefix_text):], read_offset, len(ids)
+        return '', prefix_offset, read_offset
+
+    def generate_stream(self, text: Union[str, List[str]],
                 max_new_tokens: int = None,
-                min_length: int = 0, 
-                min_new_tokens: int = None,
-                early_stopping: bool = True,
+                max_length: int = None,
                 max_time: float = None,
-                chunk_size: int = 10,
-                **kwargs) -> List[str]:
-        if isinstance(text, str):
+                chunk_size: int = 1,
+                do_sample: bool = False,
+                temperature: float = 1.0,
+                top_k: int = 0,
+                top_p: float = 1.0,
+                eos_token_id: Union[int, List[int]] = None,
+                **kwargs) -> Iterator[Union[str, List[str]]]:
+        """
+        Decodes one token per step, feeding only the newest token and reusing the kv cache
+        (past_key_values), so the cost per token stays flat instead of growing with the output.
+        Yields the new text every `chunk_size` tokens (a list of texts for batched prompts)
+        and stops on eos, max_new_tokens or max_time.
+        """
+        is_string = isinstance(text, str)
+        if is_string:
             text = [text]
 
-         
-        input_ids = self.tokenize(text)['input_ids']
-        for i in range(max_new_tokens):
-            output_ids = self.model.generate(input_ids, 
-                                            max_length=max_length, 
-                                            max_new_tokens=chunk_size,
-                                            min_length=min_length, 
-                                            min_new_tokens=min_new_tokens,
-                                            early_stopping=early_stopping,
-                                            max_time=max_time, **kwargs)
-            output_text = self.decode(output_ids)
-            yield output_text
-            text = output_text
+        max_length = min(max_length or self.config.max_length, self.config.max_length)
+        max_new_tokens = min(max_new_tokens or self.config.max_new_tokens, self.config.max_new_tokens)
+        if eos_token_id == None:
+            eos_token_id = self.tokenizer.eos_token_id
+        eos_token_ids = eos_token_id if isinstance(eos_token_id, list) else [eos_token_id]
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id != None else eos_token_ids[0]
+
+        sample = self.tokenize(text, max_length=max_length)
+        input_ids, attention_mask = sample['input_ids'], sample['attention_mask']
+        device = input_ids.device
+        eos_token_ids = torch.tensor(eos_token_ids, device=device)
+
+        # left padded prompts need explicit positions, the cache only knows its own length
+        if 'position_ids' in c.fn_signature(self.model.forward):
+            kwargs['position_ids'] = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+
+        batch_size = input_ids.shape[0]
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        tokens = [[] for _ in range(batch_size)]
+        offsets = [(0, 0) for _ in range(batch_size)]
+        chunks = ['' for _ in range(batch_size)]
+        past_key_values = None
+        t0 = time.time()
+
+        with torch.inference_mode():
+            for step in range(max_new_tokens):
+                output = self.model(input_ids=input_ids,
+                                    attention_mask=attention_mask,
+                                    past_key_values=past_key_values,
+                                    use_cache=True,
+                                    **kwargs)
+                past_key_values = output.past_key_values
+                next_ids = self.sample_token(output.logits[:, -1, :],
+                                             do_sample=do_sample,
+                                             temperature=temperature,
+                                             top_k=top_k,
+                                             top_p=top_p)
+                next_ids = next_ids.masked_fill(finished, pad_token_id)
+                is_eos = torch.isin(next_ids, eos_token_ids)
+
+                for i, (token_id, done) in enumerate(zip(next_ids.tolist(), (finished | is_eos).tolist())):
+                    if done:
+                        continue
+                    tokens[i].append(token_id)
+                    new_text, *offsets[i] = self.decode_token(tokens[i], *offsets[i])
+                    chunks[i] += new_text
+
+                finished |= is_eos
+                stop = bool(finished.all()) or step + 1 == max_new_tokens
+                if max_time != None and time.time() - t0 > max_time:
+                    stop = True
+
+                if (stop or (step + 1) % chunk_size == 0) and any(chunks):
+                    yield chunks[0] if is_string else chunks
+                    chunks = ['' for _ in range(batch_size)]
+                if stop:
+                    break
+
+                # feed only the new token, the prompt lives in the cache
+                input_ids = next_ids[:, None]
+                attention_mask = torch.cat([attention_mask, (~finished).to(attention_mask.dtype)[:, None]], dim=-1)
+                if 'position_ids' in kwargs:
+                    kwargs['position_ids'] = kwargs['position_ids'][:, -1:] + 1
 
     hf = c.module('hf')()
     def generate(self, text: str, 
@@ -510,7 +722,7 @@ class ModelTransformer(Model):
         if stream:
             return self.generate_stream(text, 
                                         max_new_tokens=max_new_tokens, 
-                                        early_stopping=early_stopping, **kwargs)
+                                        max_length=max_length, **kwargs)
 
         is_string = isinstance(text, str)
         if is_string:
@@ -0,0 +1,234 @@
+import os
+import time
+import shutil
+import bisect
+from typing import *
+import commune as c
+
+class Logs(c.Module):
+    """
+    Access to the log files of supervised processes without reading them whole.
+    Tails seek backwards from the end, follow polls for appended bytes, and time windows are
+    answered from a sparse index of (time, byte offset) samples kept next to each log (<log>.idx).
+    Logs above max_bytes are rotated by copy and truncate, because the processes hold them open
+    in append mode; log.1 is the newest of the kept backups. The tail written during the copy is copied
+    again right before the truncate, only a write landing between that last read and the truncate is lost.
+    """
+    max_bytes = 64 * 1024**2 # rotate a log above this size
+    backups = 2 # rotated copies kept per log
+    index_interval = 5 # seconds between index samples, the resolution of time windows
+    follow_interval = 0.05 # first poll delay when idle, doubles up to max_follow_interval
+    max_follow_interval = 0.5
+
+    @classmethod
+    def tail(cls, path: str, lines: int = 100) -> str:
+        """ the last lines of a file, a trailing newline does not count as a line """
+        if not os.path.exists(path):
+            return ''
+        with open(path, 'rb') as f:
+            size = f.seek(0, 2)
+            if size == 0:
+                return ''
+            f.seek(size - 1)
+            trailing = f.read(1) == b'\n'
+            f.seek(c.tail_offset(path, lines + trailing))
+            return f.read().decode(errors='replace')
+
+    @classmethod
+    def follow(cls, paths: Dict[str, str], tail: int = 0, timeout: float = None) -> Iterator[Tuple[str, str]]:
+        """
+        Yields (name, line) for every line appended to any of the paths after this call, starting with their
+        last tail lines. A path that shrinks or is replaced was rotated, it is read again from the start.
+        """
+        state = {}
+        for name, path in paths.items():
+            stat = os.stat(path) if os.path.exists(path) else None
+            state[name] = {'inode': stat.st_ino if stat else None, 'offset': stat.st_size if stat else 0, 'partial': b''}
+        tails = {name: cls.tail(path, tail) if tail > 0 else '' for name, path in paths.items()}
+        deadline = None if timeout == None else time.time() + timeout
+
+        def lines():
+            for name, text in tails.items():
+                for line in text.splitlines():
+                    yield name, line
+            interval = cls.follow_interval
+            while deadline == None or time.time() < deadline:
+                idle = True
+                for name, path in paths.items():
+                    s = state[name]
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if stat.st_ino != s['inode'] or stat.st_size < s['offset']:
+                        s.update(inode=stat.st_ino, offset=0, partial=b'')
+                    if stat.st_size == s['offset']:
+                        continue
+                    with open(path, 'rb') as f:
+                        f.seek(s['offset'])
+                        data = f.read(stat.st_size - s['offset'])
+                    s['offset'] += len(data)
+                    chunks = (s['partial'] + data).split(b'\n')
+                    s['partial'] = chunks.pop()
+                    for line in chunks:
+                        yield name, line.decode(errors='replace')
+                    idle = False
+                if idle:
+                    time.sleep(interval)
+                    interval = min(interval * 2, cls.max_follow_interval)
+                else:
+                    interval = cls.follow_interval
+        return lines()
+
+    # TIME INDEX
+
+    @classmethod
+    def index_path(cls, path: str) -> str:
+        return f'{path}.idx'
+
+    @classmethod
+    def load_index(cls, path: str) -> List[Tuple[float, int]]:
+        index_path = cls.index_path(path)
+        if not os.path.exists(index_path):
+            return []
+        with open(index_path) as f:
+            return [(float(t), int(offset)) for t, offset in (line.split() for line in f if line.strip())]
+
+    @classmethod
+    def record_index(cls, path: str, now: float = None) -> Optional[Tuple[float, int]]:
+        """ appends (now, size) when the log grew since the last sample: bytes before size were written by now """
+        if not os.path.exists(path):
+            return None
+        size = os.path.getsize(path)
+        index_path = cls.index_path(path)
+        if os.path.exists(index_path) and os.path.getsize(index_path) > 0:
+            last = c.tail_text(index_path, 2).split()
+            if len(last) == 2 and int(last[1]) == size:
+                return None
+        now = now or time.time()
+        with open(index_path, 'a') as f:
+            f.write(f'{now:.3f} {size}\n')
+        return now, size
+
+    @classmethod
+    def window(cls, path: str, since: float = None, until: float = None) -> str:
+        """
+        The lines written between since and until (unix times), found by bisecting the index.
+        Times are resolved to index_interval, so the window may include a few lines more on each side.
+        """
+        text = ''
+        for p in cls.rotated_paths(path):
+            text += cls.window_file(p, since=since, until=until)
+        return text
+
+    @classmethod
+    def window_file(cls, path: str, since: float = None, until: float = None) -> str:
+        if not os.path.exists(path):
+            return ''
+        index = cls.load_index(path)
+        times = [t for t, _ in index]
+        size = os.path.getsize(path)
+        start, end = 0, size
+        if since != None:
+            # the last sample before since, everything up to its offset was written earlier
+            i = bisect.bisect_left(times, since) - 1
+            start = index[i][1] if i >= 0 else 0
+        if until != None:
+            # the first sample at or after until, everything after its offset is later
+            i = bisect.bisect_left(times, until)
+            end = index[i][1] if i < len(index) else size
+        if start >= end:
+            return ''
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        if start > 0 and data.find(b'\n') >= 0:
+            # drop the partial first line unless the window starts on a line boundary
+            with open(path, 'rb') as f:
+                f.seek(start - 1)
+                if f.read(1) != b'\n':
+                    data = data[data.find(b'\n') + 1:]
+        return data.decode(errors='replace')
+
+    # ROTATION
+
+    @classmethod
+    def rotated_paths(cls, path: str) -> List[str]:
+        """ the backups from oldest to newest, then the live log """
+        return [f'{path}.{i}' for i in range(cls.backups, 0, -1) if os.path.exists(f'{path}.{i}')] + [path]
+
+    @classmethod
+    def rotate(cls, path: str, max_bytes: int = None) -> bool:
+        """ copies a log above max_bytes to log.1 (shifting older backups) and truncates it in place """
+        max_bytes = max_bytes or cls.max_bytes
+        if not os.path.exists(path) or os.path.getsize(path) <= max_bytes:
+            return False
+        for suffix in ['', '.idx']:
+            for i in range(cls.backups, 0, -1):
+                src = f'{path}.{i - 1}{suffix}' if i > 1 else None
+                dst = f'{path}.{i}{suffix}'
+                if src != None and os.path.exists(src):
+                    os.replace(src, dst)
+        if os.path.exists(cls.index_path(path)):
+            os.replace(cls.index_path(path), f'{path}.1.idx')
+        with open(path, 'rb') as src, open(f'{path}.1', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+            # the process keeps writing during the copy, catch up until the log stops growing, then truncate
+            while os.fstat(src.fileno()).st_size > src.tell():
+                shutil.copyfileobj(src, dst)
+            os.truncate(path, 0)
+        return True
+
+    @classmethod
+    def maintain(cls, paths: List[str]) -> dict:
+        """ rotates the oversized logs and samples the index of every log, the supervisor calls this periodically """
+        rotated = [path for path in paths if cls.rotate(path)]
+        now = time.time()
+        for path in paths:
+            cls.record_index(path, now=now)
+        return {'rotated': rotated}
+
+    @classmethod
+    def rm(cls, path: str):
+        for p in cls.rotated_paths(path):
+            for f in [p, cls.index_path(p)]:
+                if os.path.exists(f):
+                    os.remove(f)
+
+    @classmethod
+    def test(cls, n: int = 200000):
+        import tempfile
+        path = tempfile.mkdtemp() + '/test-out.log'
+        with open(path, 'w') as f:
+            f.writelines(f'line {i}\n' for i in range(n))
+        t = time.time()
+        assert cls.tail(path, 3) == f'line {n - 3}\nline {n - 2}\nline {n - 1}\n'
+        tail_time = time.time() - t
+
+        # time windows from the index
+        cls.record_index(path, now=100)
+        with open(path, 'a') as f:
+            f.write('late 1\nlate 2\n')
+        cls.record_index(path, now=200)
+        with open(path, 'a') as f:
+            f.write('later\n')
+        cls.record_index(path, now=300)
+        assert cls.window(path, since=150, until=200) == 'late 1\nlate 2\n'
+        assert cls.window(path, since=250) == 'later\n'
+
+        # follow picks up appends and survives rotation
+        lines = cls.follow({'test': path})
+        with open(path, 'a') as f:
+            f.write('new 1\nnew ')
+        assert next(lines) == ('test', 'new 1')
+        with open(path, 'a') as f:
+            f.write('2\n')
+        assert next(lines) == ('test', 'new 2')
+        assert cls.rotate(path, max_bytes=1024)
+        assert os.path.getsize(path) == 0 and os.path.exists(path + '.1')
+        with open(path, 'a') as f:
+            f.write('after rotation\n')
+        assert next(lines) == ('test', 'after rotation')
+        assert cls.window(path, since=150).startswith('late 1\n') and cls.window(path).endswith('after rotation\n')
+        shutil.rmtree(os.path.dirname(path))
+        return {'success': True, 'tail_time': tail_time}
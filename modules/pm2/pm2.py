@@ -1,219 +1,232 @@
 import os
+import sys
+import json
+import time
+import fcntl
+import signal
+import subprocess
 from typing import *
+from contextlib import contextmanager
 import commune as c
-import json
 
 class PM2(c.Module):
-    dir = os.path.expanduser('~/.pm2')
-   
-    @classmethod
-    def restart(cls, name:str, verbose:bool = False, prefix_match:bool = True):
-        list = cls.servers()
-        if name in list:
-            rm_list = [name]
-        else:
-            if prefix_match:
-                rm_list = [ p for p in list if p.startswith(name)]
-            else:
-                raise Exception(f'pm2 process {name} not found')
+    """
+    A python native process supervisor with the pm2 interface.
+    The process table lives in a small locked json file, so launch, kill, servers, exists and logs
+    answer without shelling out. A detached supervisor loop restarts crashed processes with
+    exponential backoff. Launched module functions are forked from a pre-warmed zygote when one
+    is running (see pm2.zygote), and fall back to a fresh interpreter otherwise.
+    """
+    dir = os.path.expanduser('~/.commune/pm2')
+    logs_dir = f'{dir}/logs'
+    table_path = f'{dir}/processes.json'
+    supervisor_path = f'{dir}/supervisor.json'
+    kill_timeout = 5 # seconds between SIGTERM and SIGKILL
+    min_backoff = 1 # first restart delay, doubles for every crash in a row
+    max_backoff = 60
+    stable_time = 30 # uptime after which a process counts as healthy again
+    supervise_interval = 0.5
+    use_zygote = True
+    _zygote = None
+    _log_store = None
+    supervisor_code = 'import commune as c; c.module("pm2").supervise()'
+    process_keys = ['name', 'cmd', 'cwd', 'env', 'autorestart', 'spec'] # what a restart needs
 
-        if len(rm_list) == 0:
-            return []
-        for n in rm_list:
-            c.print(f'Restarting {n}', color='cyan')
-            c.cmd(f"pm2 restart {n}", verbose=False)
-            cls.rm_logs(n)  
-        return {'success':True, 'message':f'Restarted {name}'}
-       
-    @classmethod
-    def restart_prefix(cls, name:str = None, verbose:bool=False):
-        list = cls.servers()
-            
-        restarted_modules = []
-        
-        for module in list:
-            if module.startswith(name) or name in ['all']:
-                if verbose:
-                    c.print(f'Restarting {module}', color='cyan')
-                c.cmd(f"pm2 restart {module}", verbose=verbose)
-                restarted_modules.append(module)
-        
-        return restarted_modules
-       
+    # PROCESS TABLE
 
     @classmethod
-    def kill(cls, name:str, verbose:bool = False, **kwargs):
-        if name == 'all':
-            return cls.kill_all(verbose=verbose)
-        c.cmd(f"pm2 delete {name}", verbose=False)
-        # remove the logs from the pm2 logs directory
-        cls.rm_logs(name)
-        return {'success':True, 'message':f'Killed {name}'}
-    
+    @contextmanager
+    def file_lock(cls, path: str):
+        os.makedirs(cls.dir, exist_ok=True)
+        with open(path, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
     @classmethod
-    def status(cls, verbose=True):
-        stdout = cls.run_command(f"pm2 status")
-        if verbose:
-            c.print(stdout,color='green')
-        return stdout
+    def table_lock(cls):
+        return cls.file_lock(f'{cls.table_path}.lock')
 
-    dir = os.path.expanduser('~/.pm2')
     @classmethod
-    def logs_path_map(cls, name=None):
-        logs_path_map = {}
-        for l in c.ls(f'{cls.dir}/logs/'):
-            key = '-'.join(l.split('/')[-1].split('-')[:-1]).replace('-',':')
-            logs_path_map[key] = logs_path_map.get(key, []) + [l]
+    def load_table(cls) -> Dict[str, dict]:
+        try:
+            with open(cls.table_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
 
-    
-        for k in logs_path_map.keys():
-            logs_path_map[k] = {l.split('-')[-1].split('.')[0]: l for l in list(logs_path_map[k])}
+    @classmethod
+    def save_table(cls, table: Dict[str, dict]):
+        os.makedirs(cls.dir, exist_ok=True)
+        tmp_path = f'{cls.table_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(table, f)
+        os.replace(tmp_path, cls.table_path)
 
-        if name != None:
-            return logs_path_map.get(name, {})
+    @staticmethod
+    def proc_start_time(pid: int) -> Optional[int]:
+        """ start time of the pid in clock ticks, None if it is gone or a zombie """
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                stat = f.read()
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return None
+        fields = stat[stat.rfind(')') + 2:].split()
+        if fields[0] in ['Z', 'X']:
+            try:
+                os.waitpid(pid, os.WNOHANG) # reap it if it is our child
+            except ChildProcessError:
+                pass
+            return None
+        return int(fields[19])
 
-        return logs_path_map
+    @classmethod
+    def alive(cls, process: dict) -> bool:
+        pid = process.get('pid', None)
+        if pid == None:
+            return False
+        start_time = cls.proc_start_time(pid)
+        # the start time guards against the pid being reused by another process
+        return start_time != None and start_time == process.get('start_time', start_time)
 
-   
-   
-   
     @classmethod
-    def rm_logs( cls, name):
-        logs_map = cls.logs_path_map(name)
+    def processes(cls, search: str = None) -> Dict[str, dict]:
+        table = cls.load_table()
+        for name, process in table.items():
+            if process['status'] == 'online' and not cls.alive(process):
+                process['status'] = 'errored' if process.get('autorestart', True) else 'stopped'
+        if search != None:
+            table = {k: v for k, v in table.items() if search in k}
+        return table
 
-        for k in logs_map.keys():
-            c.rm(logs_map[k])
+    # LIFECYCLE
 
     @classmethod
-    def logs(cls, 
-                module:str, 
-                tail: int =100, 
-                verbose: bool=True ,
-                mode: str ='cmd',
-                **kwargs):
-        
-        if mode == 'local':
-            text = ''
-            for m in ['out','error']:
-
-                # I know, this is fucked 
-                path = f'{cls.dir}/logs/{module.replace("/", "-")}-{m}.log'.replace(':', '-').replace('_', '-')
-                try:
-                    text +=  c.get_text(path, tail=tail)
-                except Exception as e:
-                    c.print(e)
-                    continue
-            
-            return text
-        elif mode == 'cmd':
-            return cls.run_command(f"pm2 logs {module}", verbose=verbose)
-        else:
-            raise NotImplementedError(f'mode {mode} not implemented')
-    
-    
+    def logs_paths(cls, name: str) -> Dict[str, str]:
+        name = name.replace('/', '-').replace(':', '-')
+        return {m: f'{cls.logs_dir}/{name}-{m}.log' for m in ['out', 'error']}
 
+    @classmethod
+    def zygote(cls):
+        if cls._zygote == None:
+            cls._zygote = c.module('pm2.zygote') # resolving costs more than a fork
+        return cls._zygote
 
-   
     @classmethod
-    def kill_many(cls, search=None, verbose:bool = True, timeout=10):
-        futures = []
-        for name in cls.servers(search=search):
-            c.print(f'[bold cyan]Killing[/bold cyan] [bold yellow]{name}[/bold yellow]', color='green', verbose=verbose)
-            f = c.submit(cls.kill, kwargs=dict(name=name, verbose=verbose), return_future=True, timeout=timeout)
-            futures.append(f)
-        return c.wait(futures)
-    
+    def spawn(cls, process: dict) -> dict:
+        """ starts the process of a table entry in its own session and fills in its pid """
+        os.makedirs(cls.logs_dir, exist_ok=True)
+        paths = cls.logs_paths(process['name'])
+        spec = process.get('spec', None)
+        if spec != None:
+            pid = cls.zygote().spawn(name=process['name'], fn=spec['fn'], kwargs=spec['kwargs'],
+                                     env=process.get('env', {}), cwd=process.get('cwd', None), **paths)
+            if pid != None:
+                process.update(pid=pid, start_time=cls.proc_start_time(pid), status='online',
+                               started=time.time(), mode='zygote')
+                return process
+        env = {**os.environ, **process.get('env', {})}
+        with open(paths['out'], 'ab') as out, open(paths['error'], 'ab') as err:
+            proc = subprocess.Popen(process['cmd'], cwd=process.get('cwd', None), env=env,
+                                    stdout=out, stderr=err, stdin=subprocess.DEVNULL,
+                                    start_new_session=True)
+        process.update(pid=proc.pid, start_time=cls.proc_start_time(proc.pid),
+                       status='online', started=time.time(), mode='cold')
+        return process
+
     @classmethod
-    def kill_all(cls, verbose:bool = True, timeout=10):
-        return cls.kill_many(search=None, verbose=verbose, timeout=timeout)
-                
-    @classmethod
-    def servers(cls, search=None,  verbose:bool = False) -> List[str]:
-        output_string = c.cmd('pm2 status', verbose=False)
-        module_list = []
-        for line in output_string.split('\n'):
-            if '  default  ' in line:
-                server_name = line.split('default')[0].strip()
-                server_name = server_name.split(' ')[-1].strip()
-                if 'errored' in line:
-                    cls.kill(server_name, verbose=True)
-                    continue
-
-                module_list += [server_name]
-            
-        if search != None:
-            search_true = lambda x: any([s in x for s in search])
-            module_list = [m for m in module_list if search_true(m)]
-                
-        return module_list
-    
+    def start_many(cls, processes: List[dict], rm_logs: bool = False) -> Dict[str, dict]:
+        """
+        starts many processes in one call: {name, cmd, cwd, env, autorestart}
+        a running process with the same name is stopped first, the table holds one pid per name
+        """
+        names = [p['name'] for p in processes]
+        cls.stop_many(names, rm_logs=rm_logs)
+        forks = [p for p in processes if p.get('spec', None) != None]
+        if len(forks) > 0:
+            # a single launch does not wait for a cold zygote, a batch amortizes its boot
+            cls.zygote().ensure(wait=len(forks) > 1)
+        with cls.table_lock():
+            table = cls.load_table()
+            for process in processes:
+                process = {'autorestart': True, 'restarts': 0, 'crashes': 0, 'env': {}, **process}
+                table[process['name']] = cls.spawn(process)
+            cls.save_table(table)
+        if any(p.get('autorestart', True) for p in processes):
+            cls.ensure_supervisor()
+        return {name: table[name] for name in names}
 
-    # commune.run_command('pm2 status').stdout.split('\n')[5].split('    │')[0].split('  │ ')[-1]commune.run_command('pm2 status').stdout.split('\n')[5].split('    │')[0].split('  │ ')[-1] 
-    
     @classmethod
-    def exists(cls, name:str) -> bool:
-        return bool(name in cls.servers())
-    
+    def stop_many(cls, names: List[str], timeout: float = None, rm_logs: bool = True) -> List[str]:
+        """ SIGTERM every process group at once, SIGKILL the ones still alive after the timeout """
+        timeout = cls.kill_timeout if timeout == None else timeout
+        with cls.table_lock():
+            table = cls.load_table()
+            processes = [table.pop(name) for name in names if name in table]
+            cls.save_table(table)
+        alive = [p for p in processes if cls.alive(p)]
+        for sig in [signal.SIGTERM, signal.SIGKILL]:
+            for p in alive:
+                try:
+                    os.killpg(p['pid'], sig)
+                except (ProcessLookupError, PermissionError):
+                    pass
+            deadline = time.time() + timeout
+            while len(alive) > 0 and time.time() < deadline:
+                time.sleep(0.02)
+                alive = [p for p in alive if cls.alive(p)]
+            if len(alive) == 0:
+                break
+        if rm_logs:
+            for p in processes:
+                cls.rm_logs(p['name'])
+        return [p['name'] for p in processes]
+
     @classmethod
-    def start(cls, 
-                path:str , 
+    def start(cls,
+                path:str ,
                   name:str,
-                  cmd_kwargs:str = None, 
+                  cmd_kwargs:str = None,
                   refresh: bool = True,
                   verbose:bool = True,
                   force : bool = True,
                   current_dir: str = True,
                   interpreter : str = None,
+                  autorestart: bool = True,
                   **kwargs):
-        
-        if cls.exists(name) and refresh:
-            cls.kill(name, verbose=verbose)
-            
-        cmd = f'pm2 start {path} --name {name}'
-
-        if force:
-            cmd += ' -f'
-            
-        if interpreter != None:
-            cmd += f' --interpreter {interpreter}'
-            
+        cmd = [interpreter, path] if interpreter != None else [path]
         if cmd_kwargs != None:
-            cmd += f' -- '
-
             if isinstance(cmd_kwargs, dict):
                 for k, v in cmd_kwargs.items():
-                    cmd += f'--{k} {v}'
+                    cmd += [f'--{k}', str(v)]
             elif isinstance(cmd_kwargs, str):
-                cmd += f'{cmd_kwargs}'
-                
-        c.print(f'[bold cyan]Starting (PM2)[/bold cyan] [bold yellow]{name}[/bold yellow]', color='green')
+                cmd += cmd_kwargs.split()
+        c.print(f'[bold cyan]Starting[/bold cyan] [bold yellow]{name}[/bold yellow]', color='green', verbose=verbose)
+        cwd = kwargs.get('cwd', c.dirpath(path) if current_dir else None)
+        process = {'name': name, 'cmd': cmd, 'cwd': cwd, 'env': kwargs.get('env', {}), 'autorestart': autorestart}
+        return cls.start_many([process], rm_logs=refresh)[name]
 
-        if current_dir:
-            kwargs['cwd'] = c.dirpath(path)
-
-        return c.cmd(cmd, verbose=verbose, **kwargs)
-        
     @classmethod
-    def launch(cls, 
-                   module:str = None,  
+    def launch_process(cls,
+                   module:str = None,
                    fn: str = 'serve',
-                   name:Optional[str]=None, 
+                   name:Optional[str]=None,
                    tag : str = None,
                    args : list = None,
                    kwargs: dict = None,
-                   device:str=None, 
-                   interpreter:str='python3', 
+                   device:str=None,
+                   interpreter:str='python3',
                    autorestart: bool = True,
-                   verbose: bool = False , 
-                   force:bool = True,
                    meta_fn: str = 'module_fn',
                    tag_seperator:str = '::',
                    cwd = None,
-                   refresh:bool=True ):
-
+                   zygote: bool = None) -> dict:
+        """ the process table entry of a module function, it forks from the zygote when the interpreter matches """
         if hasattr(module, 'module_path'):
             module = module.module_path()
-            
+
         # avoid these references fucking shit up
         args = args if args else []
         kwargs = kwargs if kwargs else {}
@@ -223,53 +236,294 @@ class PM2(c.Module):
             'module': module,
             'fn': fn,
             'args': args,
-            'kwargs': kwargs 
+            'kwargs': kwargs
         }
 
-
         kwargs_str = json.dumps(kwargs).replace('"', "'")
-
-        name = cls.resolve_server_name(module=module, name=name, tag=tag, tag_seperator=tag_seperator) 
-
-        if refresh:
-            cls.kill(name)
-        
-        module = c.module()
-        # build command to run pm2
-        filepath = c.filepath()
-        cwd = cwd or module.dirpath()
-        command = f"pm2 start {filepath} --name {name} --interpreter {interpreter}"
-
-        if not autorestart:
-            command += ' --no-autorestart'
-        if force:
-            command += ' -f '
-        command = command +  f' -- --fn {meta_fn} --kwargs "{kwargs_str}"'
+        name = cls.resolve_server_name(module=module, name=name, tag=tag, tag_seperator=tag_seperator)
         env = {}
         if device != None:
             if isinstance(device, int):
                 env['CUDA_VISIBLE_DEVICES']=str(device)
             if isinstance(device, list):
                 env['CUDA_VISIBLE_DEVICES']=','.join(list(map(str, device)))
-        if refresh:
-            cls.kill(name)  
-        
-        cwd = cwd or module.dirpath()
-        
-        stdout = c.cmd(command, env=env, verbose=verbose, cwd=cwd)
-        return {'success':True, 'message':f'Launched {module}', 'command': command, 'stdout':stdout}
 
+        cwd = cwd or c.module().dirpath()
+        cmd = [interpreter, c.filepath(), '--fn', meta_fn, '--kwargs', kwargs_str]
+        process = {'name': name, 'cmd': cmd, 'cwd': cwd, 'env': env, 'autorestart': autorestart}
+        zygote = cls.use_zygote if zygote == None else zygote
+        # the zygote runs this interpreter, python/python3 are taken to be the same one
+        if zygote and interpreter in ['python', 'python3', sys.executable]:
+            process['spec'] = {'fn': meta_fn, 'kwargs': kwargs}
+        return process
+
+    @classmethod
+    def launch(cls,
+                   module:str = None,
+                   fn: str = 'serve',
+                   name:Optional[str]=None,
+                   tag : str = None,
+                   args : list = None,
+                   kwargs: dict = None,
+                   device:str=None,
+                   interpreter:str='python3',
+                   autorestart: bool = True,
+                   verbose: bool = False ,
+                   force:bool = True,
+                   meta_fn: str = 'module_fn',
+                   tag_seperator:str = '::',
+                   cwd = None,
+                   refresh:bool=True,
+                   zygote: bool = None):
+
+        process = cls.launch_process(module=module, fn=fn, name=name, tag=tag, args=args, kwargs=kwargs, device=device,
+                                     interpreter=interpreter, autorestart=autorestart, meta_fn=meta_fn,
+                                     tag_seperator=tag_seperator, cwd=cwd, zygote=zygote)
+        name = process['name']
+        process = cls.start_many([process], rm_logs=refresh)[name]
+        c.print(f'[bold cyan]Launched[/bold cyan] [bold yellow]{name}[/bold yellow] (pid {process["pid"]}, {process["mode"]})', color='green', verbose=verbose)
+        return {'success':True, 'message':f'Launched {name}', 'command': ' '.join(process['cmd']), 'pid': process['pid'], 'mode': process['mode']}
+
+    @classmethod
+    def launch_many(cls, launches: List[dict], refresh: bool = True, verbose: bool = False, **kwargs) -> List[dict]:
+        """ launches many module functions in one batch, each dict takes the launch kwargs, kwargs are shared """
+        processes = [cls.launch_process(**{**kwargs, **launch}) for launch in launches]
+        processes = cls.start_many(processes, rm_logs=refresh)
+        modes = [p['mode'] for p in processes.values()]
+        c.print(f'[bold cyan]Launched[/bold cyan] [bold yellow]{len(processes)} processes[/bold yellow] ({modes.count("zygote")} forked)', color='green', verbose=verbose)
+        return [{'success': True, 'name': name, 'pid': p['pid'], 'mode': p['mode']} for name, p in processes.items()]
+
+    @classmethod
+    def kill(cls, name:str, verbose:bool = False, **kwargs):
+        if name == 'all':
+            return cls.kill_all(verbose=verbose)
+        killed = cls.stop_many([name])
+        if len(killed) == 0:
+            return {'success':False, 'message':f'{name} not found'}
+        return {'success':True, 'message':f'Killed {name}'}
+
+    @classmethod
+    def kill_many(cls, search=None, verbose:bool = True, timeout=10):
+        names = cls.servers(search=search, status=None)
+        c.print(f'[bold cyan]Killing[/bold cyan] [bold yellow]{len(names)} processes[/bold yellow]', color='green', verbose=verbose)
+        killed = cls.stop_many(names, timeout=min(timeout, cls.kill_timeout))
+        return [{'success':True, 'message':f'Killed {name}'} for name in killed]
 
+    @classmethod
+    def kill_all(cls, verbose:bool = True, timeout=10):
+        return cls.kill_many(search=None, verbose=verbose, timeout=timeout)
 
+    @classmethod
+    def restart(cls, name:str, verbose:bool = False, prefix_match:bool = True):
+        table = cls.load_table()
+        if name in table:
+            names = [name]
+        elif prefix_match:
+            names = [p for p in table if p.startswith(name)]
+        else:
+            raise Exception(f'process {name} not found')
+        if len(names) == 0:
+            return []
+        c.print(f'Restarting {names}', color='cyan', verbose=verbose)
+        processes = [{k: v for k, v in table[n].items() if k in cls.process_keys} for n in names]
+        cls.start_many(processes, rm_logs=True)
+        return {'success':True, 'message':f'Restarted {name}'}
+
+    @classmethod
+    def restart_prefix(cls, name:str = None, verbose:bool=False):
+        names = [m for m in cls.servers() if name in ['all', None] or m.startswith(name)]
+        if len(names) > 0:
+            table = cls.load_table()
+            processes = [{k: v for k, v in table[n].items() if k in cls.process_keys} for n in names]
+            cls.start_many(processes)
+        return names
 
     @classmethod
     def restart_many(cls, search:str = None, network = None, **kwargs):
-        t1 = c.time()
-        servers = cls.servers(search)
-        futures = [c.submit(c.restart, kwargs={"name": m, **kwargs}) for m in servers]
-        results = []
-        for f in c.as_completed(futures):
-            result = f.result()
-            c.print(result)
-            results.append(result)
-        return results
+        return cls.restart_prefix(name=search, **kwargs)
+
+    # QUERIES
+
+    @classmethod
+    def servers(cls, search=None,  verbose:bool = False, status:str = 'online') -> List[str]:
+        processes = cls.processes()
+        module_list = [k for k, v in processes.items() if status == None or v['status'] == status]
+        if search != None:
+            search = [search] if isinstance(search, str) else search
+            module_list = [m for m in module_list if any([s in m for s in search])]
+        return module_list
+
+    @classmethod
+    def exists(cls, name:str) -> bool:
+        process = cls.load_table().get(name, None)
+        return process != None and cls.alive(process)
+
+    @classmethod
+    def status(cls, verbose=True):
+        now = time.time()
+        rows = [{'name': k, 'pid': v['pid'], 'status': v['status'], 'restarts': v.get('restarts', 0),
+                 'uptime': round(now - v['started']) if v['status'] == 'online' else 0}
+                for k, v in cls.processes().items()]
+        df = c.df(rows)
+        if verbose:
+            c.print(df, color='green')
+        return df
+
+    @classmethod
+    def logs_path_map(cls, name=None):
+        if name != None:
+            return cls.logs_paths(name)
+        return {k: cls.logs_paths(k) for k in cls.load_table()}
+
+    @classmethod
+    def rm_logs( cls, name):
+        for path in cls.logs_paths(name).values():
+            cls.log_store().rm(path)
+
+    @classmethod
+    def log_store(cls):
+        if cls._log_store == None:
+            cls._log_store = c.module('pm2.logs')
+        return cls._log_store
+
+    @classmethod
+    def logs(cls,
+                module:str,
+                tail: int =100,
+                verbose: bool=True ,
+                mode: str ='local',
+                follow: bool = False,
+                since: float = None,
+                until: float = None,
+                **kwargs):
+        """
+        the last tail lines of the out and error logs, or the lines written between since and until (unix times)
+        follow=True returns a generator of the lines appended from now on
+        """
+        paths = cls.logs_paths(module)
+        if follow:
+            return (line for _, line in cls.log_store().follow(paths, tail=tail))
+        text = ''
+        for m, path in paths.items():
+            if since != None or until != None:
+                text += cls.log_store().window(path, since=since, until=until)
+            else:
+                text += cls.log_store().tail(path, tail)
+        return text
+
+    @classmethod
+    def logs_many(cls,
+                  search: str = None,
+                  tail: int = 20,
+                  follow: bool = False,
+                  since: float = None,
+                  until: float = None,
+                  **kwargs) -> Union[str, Iterator[str]]:
+        """ the logs of every process matching search, each line tagged with its process name """
+        names = cls.servers(search=search, status=None)
+        if follow:
+            paths = {f'{name}/{m}': path for name in names for m, path in cls.logs_paths(name).items()}
+            return (f'[{name.rsplit("/", 1)[0]}] {line}' for name, line in cls.log_store().follow(paths, tail=tail))
+        lines = []
+        for name in names:
+            text = cls.logs(name, tail=tail, since=since, until=until)
+            lines += [f'[{name}] {line}' for line in text.splitlines()]
+        return '\n'.join(lines)
+
+    # SUPERVISOR
+
+    @classmethod
+    def supervisor_alive(cls) -> bool:
+        try:
+            with open(cls.supervisor_path) as f:
+                supervisor = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return cls.alive(supervisor)
+
+    @classmethod
+    def ensure_supervisor(cls):
+        # check and start under one lock, so concurrent launches start a single supervisor
+        with cls.file_lock(f'{cls.supervisor_path}.lock'):
+            if cls.supervisor_alive():
+                return {'success': True, 'msg': 'supervisor running'}
+            cmd = [sys.executable, '-c', cls.supervisor_code]
+            with open(f'{cls.logs_dir}/supervisor.log', 'ab') as log:
+                proc = subprocess.Popen(cmd, stdout=log, stderr=log, stdin=subprocess.DEVNULL, start_new_session=True)
+            with open(cls.supervisor_path, 'w') as f:
+                json.dump({'pid': proc.pid, 'start_time': cls.proc_start_time(proc.pid)}, f)
+        return {'success': True, 'msg': f'started supervisor {proc.pid}'}
+
+    @classmethod
+    def backoff(cls, crashes: int) -> float:
+        return min(cls.min_backoff * 2 ** max(crashes - 1, 0), cls.max_backoff)
+
+    @classmethod
+    def supervise_step(cls) -> List[str]:
+        """ restarts the crashed autorestart processes whose backoff has passed """
+        restarted = []
+        now = time.time()
+        with cls.table_lock():
+            table = cls.load_table()
+            for name, process in table.items():
+                if process['status'] == 'online' and not cls.alive(process):
+                    uptime = now - process['started']
+                    process['crashes'] = 1 if uptime > cls.stable_time else process.get('crashes', 0) + 1
+                    if process.get('autorestart', True):
+                        process.update(status='waiting', restart_at=now + cls.backoff(process['crashes']))
+                    else:
+                        process['status'] = 'stopped'
+                if process['status'] == 'waiting' and now >= process['restart_at']:
+                    cls.spawn(process)
+                    process['restarts'] = process.get('restarts', 0) + 1
+                    restarted.append(name)
+            cls.save_table(table)
+        return restarted
+
+    @classmethod
+    def supervise(cls, interval: float = None):
+        interval = interval or cls.supervise_interval
+        files = cls.zygote().fingerprint()
+        last_maintain = 0
+        while True:
+            if cls.zygote().changed(files):
+                # same pid, so the supervisor file stays valid
+                c.print('Source changed, reloading the supervisor', color='yellow')
+                sys.stdout.flush()
+                os.execv(sys.executable, [sys.executable, '-c', cls.supervisor_code])
+            try:
+                for name in cls.supervise_step():
+                    c.print(f'Restarted {name}', color='yellow')
+                if time.time() - last_maintain > cls.log_store().index_interval:
+                    # rotate the oversized logs and sample the time index of every log
+                    last_maintain = time.time()
+                    paths = [p for name in cls.load_table() for p in cls.logs_paths(name).values()]
+                    for path in cls.log_store().maintain(paths)['rotated']:
+                        c.print(f'Rotated {path}', color='yellow')
+            except Exception as e:
+                c.print(c.detailed_error(e), color='red')
+            time.sleep(interval)
+
+    @classmethod
+    def test(cls, n: int = 20):
+        names = [f'pm2_test::{i}' for i in range(n)]
+        processes = [{'name': name, 'cmd': [sys.executable, '-c', 'import time; print("hi", flush=True); time.sleep(60)'], 'autorestart': True} for name in names]
+        t = time.time()
+        cls.start_many(processes)
+        start_time = time.time() - t
+        assert all(cls.exists(name) for name in names)
+        assert set(names) <= set(cls.servers('pm2_test'))
+
+        # a crash gets restarted by the supervisor
+        os.killpg(cls.load_table()[names[0]]['pid'], signal.SIGKILL)
+        for _ in range(100):
+            time.sleep(0.1)
+            if cls.load_table()[names[0]].get('restarts', 0) > 0 and cls.exists(names[0]):
+                break
+        assert cls.load_table()[names[0]]['restarts'] == 1, 'crashed process not restarted'
+
+        t = time.time()
+        cls.kill_many('pm2_test', verbose=False)
+        kill_time = time.time() - t
+        assert len(cls.servers('pm2_test')) == 0
+        return {'success': True, 'start_time': start_time, 'kill_time': kill_time}
@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import time
+import random
+import fcntl
+import signal
+import socket
+import threading
+import importlib
+from typing import *
+import commune as c
+
+class Zygote(c.Module):
+    """
+    A pre-warmed fork server for module processes.
+    It imports commune and the common server dependencies once, then forks a child per launch,
+    so a new module server skips interpreter startup and imports. Each child gets its own session,
+    environment, working directory and log files, and records how long every startup phase took.
+    The zygote exits when one of its preloaded source files changes, the next launch starts a fresh one.
+    A zygote holds lock_path while it boots and serves, a second one started meanwhile exits without touching the socket.
+    """
+    dir = os.path.expanduser('~/.commune/pm2')
+    socket_path = f'{dir}/zygote.sock'
+    info_path = f'{dir}/zygote.json'
+    lock_path = f'{dir}/zygote.lock'
+    timings_dir = f'{dir}/timings'
+    log_path = f'{dir}/logs/zygote.log'
+    preload_modules = ['server', 'client', 'namespace', 'key', 'pm2']
+    preload_packages = ['fastapi', 'uvicorn', 'aiohttp', 'numpy', 'torch']
+    boot_timeout = 60 # seconds to wait for a new zygote to listen
+    ready_timeout = 120 # seconds a child waits for its server to register
+    ready_interval = 0.2 # the namespace read is not free, a fleet of children polls it at once
+
+    # ZYGOTE SIDE
+
+    def preload(self) -> dict:
+        timings = {}
+        for name in self.preload_modules:
+            t = time.time()
+            c.module(name)
+            timings[name] = time.time() - t
+        for name in self.preload_packages:
+            t = time.time()
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                continue
+            timings[name] = time.time() - t
+        return timings
+
+    @staticmethod
+    def fingerprint() -> Dict[str, float]:
+        """ mtimes of every loaded source file of the library, children would inherit them """
+        files = {}
+        for module in list(sys.modules.values()):
+            path = getattr(module, '__file__', None)
+            if path and path.startswith(c.libpath) and path.endswith('.py'):
+                try:
+                    files[path] = os.stat(path).st_mtime
+                except OSError:
+                    continue
+        return files
+
+    @staticmethod
+    def changed(files: Dict[str, float]) -> bool:
+        for path, mtime in files.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    @staticmethod
+    def reap(*args):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+    def listen(self):
+        """ Preloads, then forks a child for every request on the unix socket until it goes stale. """
+        t = time.time()
+        os.makedirs(self.dir, exist_ok=True)
+        self.lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            c.print('Another zygote is running, exiting', color='yellow')
+            return
+        preload = self.preload()
+        self.files = self.fingerprint()
+        os.makedirs(self.dir, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen(128)
+        signal.signal(signal.SIGCHLD, self.reap)
+        with open(self.info_path, 'w') as f:
+            json.dump({'pid': os.getpid(), 'executable': sys.executable, 'boot_time': time.time() - t, 'preload': preload}, f)
+        c.print(f'Zygote {os.getpid()} listening after {time.time() - t:.2f}s {preload}', color='green')
+        try:
+            while True:
+                conn, _ = self.server.accept()
+                with conn:
+                    # a bad request or a failed fork is answered, and the zygote keeps serving
+                    try:
+                        request = json.loads(conn.makefile('rb').readline())
+                    except Exception as e:
+                        self.reply(conn, {'success': False, 'error': f'bad request: {e}'})
+                        continue
+                    if self.changed(self.files):
+                        self.reply(conn, {'success': False, 'error': 'stale'})
+                        c.print('Source changed, exiting', color='yellow')
+                        break
+                    try:
+                        response = {'success': True, 'pid': self.fork(request, conn)}
+                    except Exception as e:
+                        c.print(f'Fork failed: {e}', color='red')
+                        response = {'success': False, 'error': str(e)}
+                    self.reply(conn, response)
+        finally:
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def reply(self, conn: socket.socket, response: dict):
+        try:
+            conn.sendall(json.dumps(response).encode() + b'\n')
+        except OSError:
+            pass # the client hung up
+
+    def fork(self, request: dict, conn: socket.socket) -> int:
+        assert threading.active_count() == 1, 'the zygote must be single threaded to fork'
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid != 0:
+            return pid
+        code = 1
+        try:
+            conn.close()
+            self.server.close()
+            # the child must not keep the zygote lock once the zygote is gone
+            self.lock_file.close()
+            code = self.child(request)
+        except BaseException as e:
+            c.print(c.detailed_error(e), color='red')
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def child(self, request: dict) -> int:
+        t = time.time()
+        timings = {'fork': t - request['sent']}
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.setsid()
+        os.environ.update(request.get('env', {}))
+        if request.get('cwd', None) != None:
+            os.chdir(request['cwd'])
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        out = os.open(request['out'], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        err = os.open(request['error'], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        for fd, target in [(devnull, 0), (out, 1), (err, 2)]:
+            os.dup2(fd, target)
+            os.close(fd)
+        # the forked rngs would repeat the zygote's sequence in every child
+        random.seed()
+        if 'numpy' in sys.modules:
+            sys.modules['numpy'].random.seed()
+        timings['setup'] = time.time() - t
+
+        t = time.time()
+        kwargs = request['kwargs']
+        fn_kwargs = kwargs.get('kwargs', None) or {}
+        module = kwargs.get('module', None) or fn_kwargs.get('module', None)
+        if isinstance(module, str):
+            c.module(module)
+        timings['resolve'] = time.time() - t
+        self.put_timings(request['name'], timings)
+        c.print(f'Forked {request["name"]} from the zygote {timings}', color='green')
+
+        if kwargs.get('fn', None) == 'serve':
+            network = fn_kwargs.get('server_network', 'local')
+            c.thread(self.wait_ready, kwargs={'name': request['name'], 'network': network, 'timings': timings, 'start': time.time()})
+
+        fn = getattr(c.Module, request['fn'])
+        obj = c.Module() if c.classify_fn(fn) == 'self' else c.Module
+        getattr(obj, request['fn'])(**kwargs)
+        return 0
+
+    @classmethod
+    def wait_ready(cls, name: str, network: str, timings: dict, start: float):
+        """ records the time from calling the serve fn to the server being registered """
+        while time.time() - start < cls.ready_timeout:
+            if c.server_exists(name, network=network):
+                timings['serve'] = time.time() - start
+                timings['total'] = sum(v for k, v in timings.items() if k != 'total')
+                cls.put_timings(name, timings)
+                return timings
+            time.sleep(cls.ready_interval)
+
+    @classmethod
+    def put_timings(cls, name: str, timings: dict):
+        os.makedirs(cls.timings_dir, exist_ok=True)
+        path = f'{cls.timings_dir}/{name.replace("/", "-")}.json'
+        with open(path + '.tmp', 'w') as f:
+            json.dump({k: round(v, 4) for k, v in timings.items()}, f)
+        os.replace(path + '.tmp', path)
+
+    # LAUNCHER SIDE
+
+    @classmethod
+    def timings(cls, name: str) -> Optional[dict]:
+        try:
+            with open(f'{cls.timings_dir}/{name.replace("/", "-")}.json') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    @classmethod
+    def info(cls) -> Optional[dict]:
+        try:
+            with open(cls.info_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    @classmethod
+    def alive(cls) -> bool:
+        info = cls.info()
+        if info == None or not os.path.exists(cls.socket_path):
+            return False
+        try:
+            os.kill(info['pid'], 0)
+        except (ProcessLookupError, PermissionError):
+            return False
+        # the info of a dead zygote whose pid was reused has no lock behind it
+        return cls.running()
+
+    @classmethod
+    def running(cls) -> bool:
+        """ whether a zygote holds the lock, it does from before it preloads until it exits """
+        os.makedirs(cls.dir, exist_ok=True)
+        with open(cls.lock_path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+    @classmethod
+    def start(cls) -> 'subprocess.Popen':
+        import subprocess
+        os.makedirs(os.path.dirname(cls.log_path), exist_ok=True)
+        cmd = [sys.executable, '-c', 'import commune as c; c.module("pm2.zygote")().listen()']
+        with open(cls.log_path, 'ab') as log:
+            return subprocess.Popen(cmd, cwd=c.libpath, stdout=log, stderr=log, stdin=subprocess.DEVNULL, start_new_session=True)
+
+    @classmethod
+    def ensure(cls, wait: bool = False, timeout: float = None) -> bool:
+        """
+        Starts the zygote detached unless one is running or booting, optionally waiting for it to listen.
+        Concurrent calls may both start one, the one that loses the lock exits.
+        """
+        proc = None
+        if not cls.alive() and not cls.running():
+            proc = cls.start()
+        if wait:
+            deadline = time.time() + (timeout or cls.boot_timeout)
+            while not cls.alive() and time.time() < deadline:
+                # a zygote that was still exiting held the lock, try again once it is gone
+                if (proc == None or proc.poll() != None) and not cls.running():
+                    proc = cls.start()
+                time.sleep(0.05)
+        return cls.alive()
+
+    @classmethod
+    def request(cls, request: dict, timeout: float = 10) -> Optional[dict]:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(cls.socket_path)
+                sock.sendall(json.dumps(request).encode() + b'\n')
+                return json.loads(sock.makefile('rb').readline())
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def spawn(cls, name: str, fn: str, kwargs: dict, out: str, error: str, env: dict = None, cwd: str = None) -> Optional[int]:
+        """ forks a process from the zygote and returns its pid, None when there is no usable zygote """
+        request = {'name': name, 'fn': fn, 'kwargs': kwargs, 'out': out, 'error': error, 'env': env or {}, 'cwd': cwd}
+        for _ in range(2):
+            response = cls.request({**request, 'sent': time.time()})
+            if response != None and response['success']:
+                return response['pid']
+            if response == None or response['error'] != 'stale':
+                return None
+            # the stale zygote is exiting, replace it
+            cls.kill()
+            if not cls.ensure(wait=True):
+                return None
+
+    @classmethod
+    def kill(cls) -> dict:
+        info = cls.info()
+        if info != None:
+            try:
+                os.kill(info['pid'], signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for path in [cls.info_path, cls.socket_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        return {'success': True, 'msg': 'killed the zygote'}
+
+    @classmethod
+    def benchmark(cls, n: int = 10, module: str = 'storage', timeout: float = 600) -> dict:
+        """ time until n servers are registered, cold interpreters vs forks of the zygote """
+        pm2 = c.module('pm2')
+        results = {}
+        for zygote in [False, True]:
+            names = [f'{module}::zygote_bench_{i}' for i in range(n)]
+            for name in names:
+                c.deregister_server(name)
+            if zygote:
+                cls.ensure(wait=True)
+            t = time.time()
+            pm2.launch_many([{'fn': 'serve', 'name': name, 'kwargs': {'module': module, 'name': name, 'remote': False}} for name in names], zygote=zygote)
+            while time.time() - t < timeout and not set(names) <= set(c.servers()):
+                time.sleep(0.1)
+            results['zygote' if zygote else 'cold'] = {'ready': time.time() - t,
+                                                      'timings': cls.timings(names[0]) if zygote else None}
+            pm2.kill_many(f'{module}::zygote_bench', verbose=False)
+            for name in names:
+                c.deregister_server(name)
+        return results
+
+    @classmethod
+    def test(cls):
+        cls.ensure(wait=True)
+        assert cls.alive(), 'zygote did not start'
+        pm2 = c.module('pm2')
+        name = 'storage::zygote_test'
+        c.deregister_server(name)
+        response = pm2.launch(fn='serve', name=name, kwargs={'module': 'storage', 'name': name, 'remote': False}, zygote=True)
+        assert pm2.load_table()[name]['mode'] == 'zygote', response
+        c.wait_for_server(name)
+        assert 'key' in c.connect(name).info()
+        for _ in range(50):
+            timings = cls.timings(name)
+            if timings != None and 'serve' in timings:
+                break
+            time.sleep(0.1)
+        assert timings != None and timings['fork'] < 1, timings
+        pm2.kill(name)
+        c.deregister_server(name)
+        return {'success': True, 'timings': timings}
@@ -1,84 +1,297 @@
-
-import asyncio
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import *
 import commune as c
 
 class QueueServer(c.Module):
-    def __init__(self, max_size=1000, mode = 'asyncio', **kwargs):
+    """
+    Named multi producer, multi consumer queues served as a module, so validators can feed miners
+    through a queue instead of fanning out synchronous calls. Producers put in batches, consumers
+    long poll get_batch with wait seconds instead of spinning, and a queue that holds more than
+    memory_size items spills the rest to disk (in order) when spill is on.
+    The server runs every call in its threadpool, so a waiting get holds one thread for at most max_wait.
+    """
+    max_wait = 30 # longest a get or put blocks, keep it under the client timeout
+    rate_window = 10 # seconds the throughput is measured over
+    max_samples = 1000 # lag samples kept per queue
+
+    def __init__(self,
+                 max_size: int = 1000, # items per queue, puts wait for room past it
+                 memory_size: int = None, # items kept in memory per queue, defaults to max_size
+                 spill: bool = False, # write the items past memory_size to disk instead of waiting
+                 **kwargs):
         self.queues = {}
         self.max_size = max_size
-        self.mode = mode
+        self.memory_size = memory_size or max_size
+        self.spill = spill
+        self.lock = threading.Lock()
 
     def queue_exists(self, key:str):
         return bool(key in self.queues)
-        
-    def add_queue(self, key:str, 
-                  refresh:bool=False, 
-                  max_size:int=None, 
-                  mode:str=None, **kwargs):
-        if mode == None:
-            mode = self.mode
-        if max_size == None:
-            max_size = self.max_size
-        
-        max_size = self.max_size if max_size is None else max_size
-
-        if mode == 'asyncio':
-            self.queues[key] = asyncio.Queue(max_size,**kwargs)
-        else:
-            raise NotImplemented
-            
-        return self.queues[key]
-
-
-    def get(self, key:str, sync=False, **kwargs):
-        q = self.queues[key]
-        job = q.get(**kwargs)
-        return c.gather(job)
-    
-    def put(self, key, value, sync=False, **kwargs):
-        q = self.queues[key]
-        job = q.put(value, **kwargs)
-        if future:
-            return job
-        return  c.gather(job)
-
-
-    def get_batch(self, key, batch_size=10, sync=False, **kwargs):
-        q = self.queues[key]
-        batch_size = min(batch_size, q.qsize())
-        jobs = [self.get(key, sync=False) for i in range(batch_size)]
-        job = asyncio.gather(*jobs)
-        if sync:
-            return self.async_run(job)
-        return job
+
+    def add_queue(self, key:str,
+                  refresh:bool=False,
+                  max_size:int=None,
+                  memory_size:int=None,
+                  spill:bool=None, **kwargs) -> dict:
+        with self.lock:
+            if key in self.queues and not refresh:
+                return self.queue_info(key)
+            if key in self.queues:
+                self.close_spill(self.queues[key])
+            lock = threading.Lock()
+            spill = self.spill if spill == None else spill
+            max_size = self.max_size if max_size == None else max_size
+            memory_size = memory_size or (self.memory_size if spill else max_size)
+            self.queues[key] = {
+                'key': key,
+                'items': deque(), # (enqueued, item) in memory, always older than the spilled ones
+                'max_size': max_size,
+                'memory_size': min(memory_size, max_size),
+                'spill': spill,
+                'spill_path': self.resolve_path(f'spill/{key}.jsonl'),
+                'spilled': 0, # items on disk
+                'reader': None,
+                'not_empty': threading.Condition(lock),
+                'not_full': threading.Condition(lock),
+                'puts': deque(), # (time, n) within the rate window
+                'gets': deque(),
+                'lag': deque(maxlen=self.max_samples), # seconds between put and get
+                'counts': {'put': 0, 'got': 0, 'spilled': 0},
+                'created': time.time(),
+            }
+            if os.path.exists(self.queues[key]['spill_path']):
+                os.remove(self.queues[key]['spill_path'])
+        return self.queue_info(key)
+
+    def rm_queue(self, key:str) -> dict:
+        with self.lock:
+            q = self.queues.pop(key, None)
+        if q != None:
+            self.close_spill(q)
+        return {'success': q != None, 'msg': f'removed queue {key}'}
+
+    def get_queue(self, key:str) -> dict:
+        # a producer or consumer may be the first to use a queue
+        q = self.queues.get(key, None)
+        if q == None:
+            self.add_queue(key)
+            q = self.queues[key]
+        return q
+
+    # SPILL
+
+    def close_spill(self, q:dict):
+        if q['reader'] != None:
+            q['reader'].close()
+            q['reader'] = None
+        if os.path.exists(q['spill_path']):
+            os.remove(q['spill_path'])
+        q['spilled'] = 0
+
+    def write_spill(self, q:dict, entries:list):
+        os.makedirs(os.path.dirname(q['spill_path']), exist_ok=True)
+        with open(q['spill_path'], 'ab') as f:
+            f.write(b''.join(json.dumps(entry).encode() + b'\n' for entry in entries))
+        q['spilled'] += len(entries)
+        q['counts']['spilled'] += len(entries)
+
+    def refill(self, q:dict):
+        """ moves spilled items back to memory in order, the file is dropped once it is read through """
+        if q['spilled'] == 0:
+            return
+        if q['reader'] == None:
+            q['reader'] = open(q['spill_path'], 'rb')
+        n = min(q['spilled'], q['memory_size'] - len(q['items']))
+        for _ in range(n):
+            q['items'].append(tuple(json.loads(q['reader'].readline())))
+        q['spilled'] -= n
+        if q['spilled'] == 0:
+            self.close_spill(q)
+
+    # PUT AND GET
+
+    def size_of(self, q:dict) -> int:
+        return len(q['items']) + q['spilled']
+
+    def put(self, key:str, value:Any, wait:float=0) -> int:
+        """ puts one item, waiting up to wait seconds for room, and returns the queue size """
+        put = self.put_batch(key, [value], wait=wait)
+        assert put['put'] == 1, f'queue {key} is full ({put["size"]} items)'
+        return put['size']
+
+    def put_batch(self, key:str, values:list, wait:float=0) -> dict:
+        """ puts as many of values as there is room for within wait seconds, in order """
+        q = self.get_queue(key)
+        deadline = time.time() + min(wait or 0, self.max_wait)
+        values = list(values)
+        n = 0
+        with q['not_full']:
+            while n < len(values):
+                room = q['max_size'] - self.size_of(q)
+                if room <= 0:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    q['not_full'].wait(remaining)
+                    continue
+                now = time.time()
+                entries = [(now, value) for value in values[n:n + room]]
+                # once anything is on disk every newer item goes behind it
+                memory_room = q['memory_size'] - len(q['items']) if q['spilled'] == 0 else 0
+                q['items'].extend(entries[:memory_room])
+                if len(entries) > memory_room:
+                    self.write_spill(q, entries[memory_room:])
+                n += len(entries)
+                q['puts'].append((now, len(entries)))
+                q['counts']['put'] += len(entries)
+                q['not_empty'].notify(len(entries))
+            return {'put': n, 'size': self.size_of(q)}
+
+    def get(self, key:str, wait:float=0) -> Any:
+        """ the oldest item, waiting up to wait seconds for one, None when the queue stays empty """
+        batch = self.get_batch(key, batch_size=1, wait=wait)
+        return batch[0] if batch else None
+
+    def get_batch(self, key:str, batch_size:int=10, wait:float=0) -> list:
+        """ up to batch_size of the oldest items, waiting up to wait seconds for the first one """
+        q = self.get_queue(key)
+        deadline = time.time() + min(wait or 0, self.max_wait)
+        with q['not_empty']:
+            while self.size_of(q) == 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                q['not_empty'].wait(remaining)
+            now = time.time()
+            batch = []
+            while len(batch) < batch_size and self.size_of(q) > 0:
+                if not q['items']:
+                    self.refill(q)
+                enqueued, value = q['items'].popleft()
+                q['lag'].append(now - enqueued)
+                batch.append(value)
+            self.refill(q)
+            q['gets'].append((now, len(batch)))
+            q['counts']['got'] += len(batch)
+            q['not_full'].notify(len(batch))
+            return batch
 
     def size(self, key):
         # The size of the queue
-        return self.queues[key].qsize()
+        return self.size_of(self.get_queue(key))
 
     def empty(self, key):
         # Whether the queue is empty.
-        return self.queues[key].empty()
+        return self.size(key) == 0
 
     def full(self, key):
         # Whether the queue is full.
-        return self.queues[key].full()
+        return self.size(key) >= self.get_queue(key)['max_size']
 
     def size_map(self):
-        return {k: self.size(k) for k in self.queues}
+        return {k: self.size(k) for k in list(self.queues)}
+
+    # METRICS
+
+    def rate(self, events:deque, now:float) -> float:
+        while events and events[0][0] < now - self.rate_window:
+            events.popleft()
+        return sum(n for _, n in events) / self.rate_window
+
+    def queue_info(self, key:str) -> dict:
+        """ size, throughput over the rate window, and lag: the age of the oldest item and of the items got """
+        q = self.get_queue(key)
+        with q['not_empty']:
+            now = time.time()
+            lag = sorted(q['lag'])
+            return {'key': key,
+                    'size': self.size_of(q),
+                    'memory': len(q['items']),
+                    'spilled': q['spilled'],
+                    'max_size': q['max_size'],
+                    'put_per_s': self.rate(q['puts'], now),
+                    'get_per_s': self.rate(q['gets'], now),
+                    'oldest_age': now - q['items'][0][0] if q['items'] else 0,
+                    'lag': {p: round(lag[min(int(p * len(lag)), len(lag) - 1)], 6) for p in [0.5, 0.95, 0.99]} if lag else None,
+                    'counts': dict(q['counts'])}
 
+    def metrics(self) -> dict:
+        return {k: self.queue_info(k) for k in list(self.queues)}
+
+    # CONSUMERS
+
+    @classmethod
+    def consume(cls, key:str, fn:Callable, server:str='queue', batch_size:int=32, wait:float=10, network:str='local', max_items:int=None) -> int:
+        """
+        Runs fn on the items of a served queue as they arrive, how a miner drains the work a validator queued.
+        Returns the number of items consumed once max_items were consumed (None runs forever).
+        """
+        queue = c.connect(server, network=network)
+        n = 0
+        while max_items == None or n < max_items:
+            size = batch_size if max_items == None else min(batch_size, max_items - n)
+            batch = queue.get_batch(key, batch_size=size, wait=wait, timeout=wait + 10)
+            assert isinstance(batch, list), batch
+            for item in batch:
+                fn(item)
+            n += len(batch)
+        return n
+
+    @classmethod
+    def benchmark(cls, n:int=100000, batch_size:int=100) -> dict:
+        self = cls(max_size=n, memory_size=n // 10, spill=True)
+        results = {}
+        for name, size in [('single', 1), ('batch', batch_size)]:
+            key = f'bench_{name}'
+            self.add_queue(key, refresh=True)
+            t = time.time()
+            for i in range(0, n, size):
+                self.put_batch(key, list(range(i, min(i + size, n))))
+            put_time = time.time() - t
+            spilled = self.queue_info(key)['spilled']
+            t = time.time()
+            got = 0
+            while got < n:
+                got += len(self.get_batch(key, batch_size=size))
+            results[name] = {'put_per_s': n / put_time, 'get_per_s': n / (time.time() - t), 'spilled': spilled}
+            self.rm_queue(key)
+        return results
 
     def test(self):
+        self = QueueServer(max_size=100, memory_size=10, spill=True)
+        key = 'test'
+        self.add_queue(key, refresh=True)
         for i in range(100):
-            self.add_queue(i)
-            for j in range(100):
-                self.put(i, j)
-                assert self.size(i) == j + 1, f'{self.size(i)} != {j + 1}'
-
-            size = self.size(i)
-            for j in range(100):
-                self.get(i)
-                assert self.size(i) == size - j -1, f'{self.size(i)} != {size - j -1}'
-
-        return  {'success': True, 'message': 'QueueServer test passed'}
-            
\ No newline at end of file
+            assert self.put(key, i) == i + 1
+        info = self.queue_info(key)
+        assert info['memory'] == 10 and info['spilled'] == 90, info
+        assert self.put_batch(key, [100])['put'] == 0, 'full queue accepted an item'
+
+        # order survives the spill
+        got = []
+        while not self.empty(key):
+            got += self.get_batch(key, batch_size=7)
+        assert got == list(range(100)), got
+        assert not os.path.exists(self.queues[key]['spill_path'])
+
+        # a waiting consumer is woken by a producer
+        t = time.time()
+        c.thread(lambda: (time.sleep(0.2), self.put(key, 'late')))
+        assert self.get(key, wait=5) == 'late' and 0.1 < time.time() - t < 2
+        assert self.get(key, wait=0.1) == None
+
+        # producers and consumers in parallel get every item once
+        producers = [c.submit(self.put_batch, kwargs={'key': key, 'values': list(range(p * 1000, (p + 1) * 1000)), 'wait': 10}) for p in range(4)]
+        consumers = [c.submit(self.get_batch, kwargs={'key': key, 'batch_size': 4000, 'wait': 1}) for _ in range(40)]
+        got = sum([f.result() for f in consumers], [])
+        assert [f.result()['put'] for f in producers] == [1000] * 4
+        got += sum(iter(lambda: self.get_batch(key, batch_size=100), []), [])
+        assert sorted(got) == list(range(4000)), len(got)
+        info = self.queue_info(key)
+        assert info['counts']['got'] == 4101 and info['size'] == 0, info
+        self.rm_queue(key)
+        return {'success': True, 'message': 'QueueServer test passed', 'info': info}
@@ -21,28 +21,36 @@ import commune as c
 import gc
 
 Task = c.module('router.task')
-
-NULL_ENTRY = (sys.maxsize, Task.null())
+TaskQueue = c.module('router.task_queue')
 
 class Router(c.Module):
-    """Base threadpool executor with a priority queue"""
+    """
+    Threadpool executor for module calls on top of a durable task queue.
+    Calls are enqueued in the wal of router.task_queue under <path>/<tag>, so queued calls survive a crash
+    and are run by the next router on the tag. A tag has one router at a time, a second one fails to open it.
+    Workers lease a call, run it and ack the result, failed calls are retried with backoff and dead lettered after max_retries.
+    """
 
     # Used to assign unique thread names when thread_name_prefix is not supplied.
     _counter = itertools.count().__next__
-    # submit.__doc__ = _base.Executor.submit.__doc__
-    threads_queues = weakref.WeakKeyDictionary()
+    poll_interval = 1 # seconds an idle worker waits on the queue before checking for shutdown
 
     def __init__(
         self,
         max_workers: int =None,
-        maxsize : int =-1,
         thread_name_prefix : str ="",
+        tag : str = None,
+        max_retries : int = 3,
+        visibility_timeout : float = 300,
     ):
-        """Initializes a new ThreadPoolExecutor instance.
+        """Initializes a new Router instance.
         Args:
             max_workers: The maximum number of threads that can be used to
                 execute the given calls.
             thread_name_prefix: An optional name prefix to give our threads.
+            tag: The queue to use, one router per tag, the next router on the tag runs the calls left over.
+            max_retries: Deliveries of a failing call before it is dead lettered.
+            visibility_timeout: Seconds a worker may run a call before it is redelivered, above the call timeout.
         """
 
         max_workers = (os.cpu_count() or 1) * 5 if max_workers == None else max_workers
@@ -50,42 +58,46 @@ class Router(c.Module):
             raise ValueError("max_workers must be greater than 0")
             
         self.max_workers = max_workers
-        self.task_queue = queue.PriorityQueue(maxsize=maxsize)
+        self.tag = tag
+        self.queue = TaskQueue(path=self.resolve_path(tag or 'base'), max_retries=max_retries, visibility_timeout=visibility_timeout)
+        self.futures = {} # job id -> Future of the calls made by this process
         self.idle_semaphore = threading.Semaphore(0)
         self.threads = []
         self.broken = False
-        self.shutdown = False
+        self.closed = False
         self.shutdown_lock = threading.Lock()
         self.thread_name_prefix = thread_name_prefix or ("ThreadPoolExecutor-%d" % self._counter() )
+        # calls left over by a previous process
+        for _ in range(min(self.queue.depth(), self.max_workers)):
+            self.adjust_thread_count()
 
     @property
     def is_empty(self):
-        return self.task_queue.empty()
-    
-    def task_path(self, status='pending', tag=None):
-        tag= tag or self.tag or "base"
-        path = self.resolve_path(tag) + '/' + status
-        return path
+        return self.queue.depth() == 0
 
+    def tasks(self, status='pending'):
+        if status == 'pending':
+            return self.queue.ids('ready') + self.queue.ids('leased')
+        return self.queue.ids({'complete': 'done', 'failed': 'dead'}.get(status, status))
 
-    def tasks(self, status='pending', tag=None):
-        return self.ls(self.task_path(status=status, tag=tag))
-    def completed(self,  tag=None):
-        return self.ls(self.task_path(status='complete', tag=tag))
+    def completed(self):
+        return self.tasks('complete')
     
-    def failed(self,  tag=None):
-        return self.ls(self.task_path(status='failed', tag=tag))
+    def failed(self):
+        return self.tasks('failed')
     
-    def refresh_tasks(self, tag=None):
-        tag= tag or self.tag or "base"
-        task_path = self.resolve_path(tag)
-        return c.rm(task_path)
+    def pending(self):
+        return self.tasks('pending')
 
-        
-    
-    def pending(self,  tag=None):
-        return self.ls(self.task_path(status='pending', tag=tag))
-    
+    def refresh_tasks(self):
+        return self.queue.clear()
+
+    def result(self, id: int) -> dict:
+        """ the state of a call by its id, with its result once it finished """
+        return self.queue.result(id)
+
+    def stats(self) -> dict:
+        return {**self.queue.stats(), 'threads': len(self.threads)}
 
     def submit(self,
                 module: str = 'module',
@@ -103,134 +115,94 @@ class Router(c.Module):
                 kwargs:dict=None, 
                 timeout=200, 
                 return_future:bool=False,
-                namespace = None,
                 network:str='local',
-                init_kwargs = None,
-                update=False, 
-                path:str=None, 
                 fn_seperator:str='/',
                 priority=1,
-                tag = None
-
                 ) -> Future:
-        
-        args = args or []
-        kwargs = kwargs or {}
-
-        tag = tag or self.tag or "base"
-        path = self.resolve_path(tag) 
+        return self.call_many([{'module': module, 'fn': fn, 'args': args, 'kwargs': kwargs, 'timeout': timeout,
+                                'network': network, 'fn_seperator': fn_seperator}],
+                              priority=priority, return_future=return_future)[0]
+
+    def call_many(self, calls: list, priority=1, return_future:bool=False) -> list:
+        """ enqueues a batch of calls ({module, fn, args, kwargs, timeout, network}) with one wal write """
+        payloads = []
+        for call in calls:
+            payload = {'module': 'module', 'fn': 'info', 'args': [], 'kwargs': {}, 'timeout': 200, 'network': 'local', **call}
+            fn_seperator = payload.pop('fn_seperator', '/')
+            if fn_seperator in str(payload['module']):
+                payload['module'], payload['fn'] = payload['module'].split(fn_seperator)
+            payload['args'] = payload['args'] or []
+            payload['kwargs'] = payload['kwargs'] or {}
+            payloads.append(payload)
 
         with self.shutdown_lock:
             if self.broken:
                 raise Exception("ThreadPoolExecutor is broken")
-            if self.shutdown:
+            if self.closed:
                 raise RuntimeError("cannot schedule new futures after shutdown")
-
-            task = Task(module=module, 
-                                 fn=fn, 
-                                 args=args,
-                                 kwargs=kwargs, 
-                                 timeout=timeout,
-                                 path=path, 
-                                 priority=priority, 
-                                 fn_seperator=fn_seperator, 
-                                 namespace=namespace, 
-                                 network=network, 
-                                 init_kwargs=init_kwargs, 
-                                 update=update)
-            
-            # add the work item to the queue
-            self.task_queue.put((task.priority, task), block=False)
-            # adjust the thread count to match the new task
-            self.adjust_thread_count()
-        k = c.timestamp()
-        self.tasks[k] = task
-        return {'ticket': k}
-    
-
-    futures = {}
+            futures = [Future() for _ in payloads]
+            # register the futures before the workers can see the jobs
+            with self.queue.lock:
+                ids = self.queue.enqueue_many(payloads, priority=priority)
+                self.futures.update(zip(ids, futures))
+            for _ in ids[:self.max_workers]:
+                self.adjust_thread_count()
+
+        if return_future:
+            return futures
+        return [future.result(timeout=payload['timeout']) for future, payload in zip(futures, payloads)]
 
     def adjust_thread_count(self):
         # if idle threads are available, don't spin new threads
         if self.idle_semaphore.acquire(timeout=0):
             return
 
-        # When the executor gets lost, the weakref callback will wake up
-        # the worker threads.
-        def weakref_cb(_, q=self.task_queue):
-            q.put(NULL_ENTRY)
-
         num_threads = len(self.threads)
         if num_threads < self.max_workers:
             thread_name = "%s_%d" % (self.thread_name_prefix or self, num_threads)
-            t = threading.Thread(
-                name=thread_name,
-                target=self.worker,
-                args=(
-                    weakref.ref(self, weakref_cb),
-                    self.task_queue,
-                ),
-            )
+            t = threading.Thread(name=thread_name, target=self.worker)
             t.daemon = True
             t.start()
             self.threads.append(t)
-            self.threads_queues[t] = self.task_queue
 
     def shutdown(self, wait=True):
         with self.shutdown_lock:
-            self.shutdown = True
-            self.task_queue.put(NULL_ENTRY)
+            self.closed = True
         if wait:
             for t in self.threads:
                 try:
                     t.join(timeout=2)
                 except Exception:
                     pass
+        self.queue.close()
 
-    @staticmethod
-    def worker(executor_reference, task_queue):
-        try:
-            while True:
-                work_item = task_queue.get(block=True)
-                priority = work_item[0]
-
-                if priority == sys.maxsize:
-                    # Wake up queue management thread.
-                    task_queue.put(NULL_ENTRY)
-                    break
-
-                item = work_item[1]
-
-                if item is not None:
-                    item.run()
-                    # Delete references to object. See issue16284
-                    del item
-                    continue
-
-                executor = executor_reference()
-                # Exit if:
-                #   - The interpreter is shutting down OR
-                #   - The executor that owns the worker has been collected OR
-                #   - The executor that owns the worker has been shutdown.
-                if executor is None or executor.shutdown:
-                    # Flag the executor as shutting down as early as possible if it
-                    # is not gc-ed yet.
-                    if executor is not None:
-                        executor.shutdown = True
-                    # Notice other workers
-                    task_queue.put(NULL_ENTRY)
-                    return
-                del executor
-        except Exception as e:
-            c.print(e, color='red')
-            c.print("work_item", work_item, color='red')
-
-            e = c.detailed_error(e)
-            c.print("Exception in worker", e, color='red')
+    def worker(self):
+        while not self.closed:
+            jobs = self.queue.dequeue(1, timeout=self.poll_interval)
+            if not jobs:
+                continue
+            job = jobs[0]
+            try:
+                self.run_job(job)
+            except Exception as e:
+                c.print("Exception in worker", c.detailed_error(e), color='red')
+            self.idle_semaphore.release()
+
+    def run_job(self, job: dict):
+        """ runs a leased call, acks it when it completes and retries it when it fails """
+        task = Task(**job['payload'], priority=job['priority'], save=False)
+        task.run()
+        if task.status == 'complete':
+            self.queue.ack(job['id'], task.data)
+        elif self.queue.nack(job['id'], task.data) == 'retry':
+            return
+        future = self.futures.pop(job['id'], None)
+        if future != None:
+            future.set_result(task.data)
 
     @property
     def num_tasks(self):
-        return self.task_queue.qsize()
+        return self.queue.depth()
 
     @classmethod
     def as_completed(futures: list):
@@ -248,13 +220,19 @@ class Router(c.Module):
     @classmethod
     def test(cls, tag=None):
         test_module_name = 'test_module'
+        c.deregister_server(test_module_name)
         module = c.serve(server_name=test_module_name)
-        output =  cls().call(module=test_module_name, fn='info', tag=tag)
+        c.wait_for_server(test_module_name)
+        self = cls(tag=tag)
+        output =  self.call(module=test_module_name, fn='info')
         c.print(output)
         assert isinstance( output, dict) and 'name' in output 
         assert output['name'] == test_module_name
         c.kill(test_module_name)
-        return {'success': True, 'msg': 'thread pool test passed'}
+        assert self.result(self.completed()[-1])['result'] == output
+        stats = self.stats()
+        self.shutdown()
+        return {'success': True, 'msg': 'thread pool test passed', 'stats': stats}
 
 
     @classmethod
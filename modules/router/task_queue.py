@@ -0,0 +1,428 @@
+import os
+import json
+import fcntl
+import time
+import heapq
+import threading
+from collections import deque
+from typing import *
+import commune as c
+
+class TaskQueue(c.Module):
+    """
+    A durable local job queue backed by an append-only write ahead log (WAL).
+    Every state change is one json line in <path>/wal.log, so a restarted process replays the log
+    and gets back every job that was not acked. Jobs are dequeued by priority (lower first) under a
+    visibility timeout lease: a worker that crashes or stalls past its lease gets the job redelivered.
+    Failed jobs are retried with backoff up to max_retries, then moved to the dead letters.
+    The log is compacted to the live jobs once it grows past compact_bytes and compact_ratio times
+    the bytes of the records that still describe live jobs, which are counted as they are applied.
+    One instance owns a path at a time (an flock on <path>/wal.lock held until close), a second one fails.
+    """
+    compact_bytes = 16 * 1024**2 # compact the wal above this size...
+    compact_ratio = 4 # ...when it is this many times larger than the live state
+    max_done = 10000 # finished results kept for result(), oldest dropped first
+    max_samples = 1000 # latency samples kept for stats()
+
+    def __init__(self,
+                 path: str = 'base',
+                 max_retries: int = 3, # deliveries before a job is dead lettered
+                 visibility_timeout: float = 60, # seconds a dequeued job stays leased
+                 retry_delay: float = 1, # first retry delay, doubles per attempt
+                 fsync: bool = False, # fsync every write, survives power loss and not only process crashes
+                 **kwargs):
+        self.dir = path if path.startswith('/') else self.resolve_path(path)
+        self.path = f'{self.dir}/wal.log'
+        self.max_retries = max_retries
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.fsync = fsync
+        self.lock = threading.RLock()
+        self.not_empty = threading.Condition(self.lock)
+        self.samples = {'wait': deque(maxlen=self.max_samples), 'run': deque(maxlen=self.max_samples)}
+        self.counts = {'enqueued': 0, 'dequeued': 0, 'acked': 0, 'retried': 0, 'dead': 0, 'expired': 0}
+        self.acquire()
+        self.replay()
+
+    def acquire(self):
+        """ takes the exclusive lock of the path, the in memory state is only valid for a single writer """
+        os.makedirs(self.dir, exist_ok=True)
+        self.lock_file = open(f'{self.dir}/wal.lock', 'a+')
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.seek(0)
+            owner = self.lock_file.read().strip()
+            self.lock_file.close()
+            raise RuntimeError(f'the task queue at {self.dir} is already open (pid {owner or "unknown"})')
+        self.lock_file.truncate(0)
+        self.lock_file.write(str(os.getpid()))
+        self.lock_file.flush()
+
+    # LOG
+
+    def replay(self):
+        """ rebuilds the in memory state from the wal, a torn last line from a crash is dropped """
+        self.jobs = {} # id -> job, every job that is not finished
+        self.done = {} # id -> finished job (insertion ordered, bounded)
+        self.dead = {} # id -> dead lettered job
+        self.ready = [] # heap of (priority, available_at, id), stale entries are skipped
+        self.leases = [] # heap of (lease_until, id), stale entries are skipped
+        self.seq = 0
+        self.live_bytes = 0 # wal bytes a compaction would keep, roughly
+        os.makedirs(self.dir, exist_ok=True)
+        valid_bytes = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        self.apply(json.loads(line), len(line))
+                    except ValueError:
+                        break
+                    valid_bytes += len(line)
+            if valid_bytes < os.path.getsize(self.path):
+                os.truncate(self.path, valid_bytes)
+        self.wal = open(self.path, 'ab')
+        self.wal_bytes = valid_bytes
+        for job in self.jobs.values():
+            self.push_ready(job) if job['status'] == 'ready' else heapq.heappush(self.leases, (job['lease_until'], job['id']))
+
+    def apply(self, record: list, size: int = 0):
+        """ applies one wal record of size bytes to the state, used both live and on replay """
+        op, id = record[0], record[1]
+        if op == 'put':
+            _, id, priority, payload, enqueued, max_retries = record
+            self.jobs[id] = {'id': id, 'priority': priority, 'payload': payload, 'enqueued': enqueued,
+                             'max_retries': max_retries, 'attempts': 0, 'status': 'ready', 'available_at': enqueued, 'size': size}
+            self.live_bytes += size
+            self.seq = max(self.seq, id)
+        elif op == 'lease':
+            job = self.jobs[id]
+            job.update(status='leased', lease_until=record[2], leased=record[3], attempts=job['attempts'] + 1)
+        elif op == 'extend':
+            self.jobs[id]['lease_until'] = record[2]
+        elif op == 'retry':
+            job = self.jobs[id]
+            job.update(status='ready', available_at=record[2], error=record[3])
+        elif op == 'ack':
+            job = self.jobs.pop(id)
+            # the payload is dropped, the result is kept
+            self.live_bytes += size - job['size']
+            job.update(status='done', result=record[2], finished=record[3], size=size)
+            job.pop('payload', None)
+            self.done[id] = job
+            while len(self.done) > self.max_done:
+                self.live_bytes -= self.done.pop(next(iter(self.done)))['size']
+        elif op == 'dead':
+            job = self.jobs.pop(id)
+            job.update(status='dead', error=record[2], finished=record[3], size=job['size'] + size)
+            self.live_bytes += size
+            self.dead[id] = job
+        elif op == 'forget':
+            job = self.done.pop(id, None) or self.dead.pop(id, None)
+            self.live_bytes -= job['size'] if job else 0
+        elif op == 'job':
+            # a whole job written by compaction
+            job = record[2]
+            job['size'] = size
+            self.live_bytes += size
+            {'done': self.done, 'dead': self.dead}.get(job['status'], self.jobs)[id] = job
+            self.seq = max(self.seq, id)
+        elif op == 'seq':
+            self.seq = max(self.seq, id)
+        else:
+            raise ValueError(f'unknown wal record {op}')
+
+    def log(self, records: List[list]):
+        """ applies and appends records in one write, the batch is durable once this returns """
+        lines = [json.dumps(record, separators=(',', ':')).encode() + b'\n' for record in records]
+        for record, line in zip(records, lines):
+            self.apply(record, len(line))
+        data = b''.join(lines)
+        self.wal.write(data)
+        self.wal.flush()
+        if self.fsync:
+            os.fsync(self.wal.fileno())
+        self.wal_bytes += len(data)
+        if self.wal_bytes > max(self.compact_bytes, self.compact_ratio * self.live_bytes):
+            self.compact()
+
+    def compact(self) -> dict:
+        """ rewrites the wal as the records of the live state and swaps it in atomically """
+        with self.lock:
+            # the seq survives even when every job it counted was dropped
+            lines = [json.dumps(['seq', self.seq]).encode() + b'\n']
+            for jobs in [self.dead, self.done, self.jobs]:
+                for id, job in jobs.items():
+                    lines.append(json.dumps(['job', id, job], separators=(',', ':')).encode() + b'\n')
+                    job['size'] = len(lines[-1])
+            data = b''.join(lines)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.wal.close()
+            os.replace(tmp_path, self.path)
+            self.wal = open(self.path, 'ab')
+            before, self.wal_bytes, self.live_bytes = self.wal_bytes, len(data), len(data)
+            return {'compacted': True, 'before': before, 'after': self.wal_bytes}
+
+    # QUEUE
+
+    def push_ready(self, job: dict):
+        heapq.heappush(self.ready, (job['priority'], job['available_at'], job['id']))
+
+    def enqueue(self, payload: Any, priority: float = 1, max_retries: int = None) -> int:
+        return self.enqueue_many([payload], priority=priority, max_retries=max_retries)[0]
+
+    def enqueue_many(self, payloads: List[Any], priority: Union[float, List[float]] = 1, max_retries: int = None) -> List[int]:
+        """ enqueues a batch with one wal write, returns the job ids """
+        priorities = priority if isinstance(priority, list) else [priority] * len(payloads)
+        max_retries = self.max_retries if max_retries == None else max_retries
+        now = time.time()
+        with self.lock:
+            ids = list(range(self.seq + 1, self.seq + 1 + len(payloads)))
+            self.log([['put', id, p, payload, now, max_retries] for id, p, payload in zip(ids, priorities, payloads)])
+            for id in ids:
+                self.push_ready(self.jobs[id])
+            self.counts['enqueued'] += len(ids)
+            self.not_empty.notify(len(ids))
+        return ids
+
+    def expire_leases(self, now: float) -> int:
+        """ returns the jobs whose lease ran out to the queue, or dead letters them (call under the lock) """
+        records = []
+        while self.leases and self.leases[0][0] <= now:
+            lease_until, id = heapq.heappop(self.leases)
+            job = self.jobs.get(id, None)
+            if job == None or job['status'] != 'leased' or job['lease_until'] != lease_until:
+                continue
+            if job['attempts'] >= job['max_retries']:
+                records.append(['dead', id, 'lease expired', now])
+            else:
+                records.append(['retry', id, now, 'lease expired'])
+        if records:
+            self.log(records)
+            for op, id, *_ in records:
+                if op == 'retry':
+                    self.push_ready(self.jobs[id])
+            self.counts['expired'] += len(records)
+            self.counts['dead'] += sum(r[0] == 'dead' for r in records)
+        return len(records)
+
+    def dequeue(self, n: int = 1, visibility_timeout: float = None, timeout: float = 0) -> List[dict]:
+        """
+        leases up to n ready jobs, highest priority first, waiting up to timeout seconds for one.
+        A job is redelivered if it is not acked within visibility_timeout.
+        """
+        visibility_timeout = self.visibility_timeout if visibility_timeout == None else visibility_timeout
+        deadline = time.time() + (timeout or 0)
+        with self.lock:
+            while True:
+                now = time.time()
+                self.expire_leases(now)
+                ids, delayed = [], []
+                while self.ready and len(ids) < n:
+                    priority, available_at, id = heapq.heappop(self.ready)
+                    job = self.jobs.get(id, None)
+                    if job == None or job['status'] != 'ready' or job['available_at'] != available_at:
+                        continue
+                    if available_at > now:
+                        delayed.append((priority, available_at, id))
+                        continue
+                    ids.append(id)
+                for entry in delayed:
+                    heapq.heappush(self.ready, entry)
+                if ids or now >= deadline:
+                    break
+                # wake up for new jobs, retries becoming available and leases running out
+                wakeups = [deadline] + [e[1] for e in delayed] + ([self.leases[0][0]] if self.leases else [])
+                self.not_empty.wait(max(min(wakeups) - now, 0.001))
+            if not ids:
+                return []
+            lease_until = now + visibility_timeout
+            self.log([['lease', id, lease_until, now] for id in ids])
+            jobs = []
+            for id in ids:
+                job = self.jobs[id]
+                heapq.heappush(self.leases, (lease_until, id))
+                self.samples['wait'].append(now - job['enqueued'])
+                jobs.append({k: job[k] for k in ['id', 'payload', 'priority', 'attempts', 'lease_until']})
+            self.counts['dequeued'] += len(ids)
+            return jobs
+
+    def ack(self, id: int, result: Any = None) -> bool:
+        return self.ack_many([id], [result])[0]
+
+    def ack_many(self, ids: List[int], results: List[Any] = None) -> List[bool]:
+        """ finishes leased jobs, an id whose lease already expired and was redelivered is not acked """
+        results = results if results != None else [None] * len(ids)
+        now = time.time()
+        with self.lock:
+            acked = [id in self.jobs and self.jobs[id]['status'] == 'leased' for id in ids]
+            for id, ok in zip(ids, acked):
+                if ok:
+                    self.samples['run'].append(now - self.jobs[id]['leased'])
+            self.log([['ack', id, result, now] for id, result, ok in zip(ids, results, acked) if ok])
+            self.counts['acked'] += sum(acked)
+        return acked
+
+    def nack(self, id: int, error: Any = None, delay: float = None) -> str:
+        """ a failed delivery: retried after a doubling delay while attempts are left, dead lettered after """
+        with self.lock:
+            job = self.jobs.get(id, None)
+            if job == None or job['status'] != 'leased':
+                return 'unknown'
+            now = time.time()
+            if job['attempts'] >= job['max_retries']:
+                self.log([['dead', id, error, now]])
+                self.counts['dead'] += 1
+                return 'dead'
+            delay = self.retry_delay * 2 ** (job['attempts'] - 1) if delay == None else delay
+            self.log([['retry', id, now + delay, error]])
+            self.push_ready(job)
+            self.counts['retried'] += 1
+            self.not_empty.notify()
+            return 'retry'
+
+    def extend(self, id: int, visibility_timeout: float = None) -> bool:
+        """ renews the lease of a job that is still being worked on """
+        visibility_timeout = self.visibility_timeout if visibility_timeout == None else visibility_timeout
+        with self.lock:
+            job = self.jobs.get(id, None)
+            if job == None or job['status'] != 'leased':
+                return False
+            lease_until = time.time() + visibility_timeout
+            self.log([['extend', id, lease_until]])
+            heapq.heappush(self.leases, (lease_until, id))
+            return True
+
+    def requeue_dead(self, ids: List[int] = None) -> List[int]:
+        """ enqueues dead lettered payloads again as new jobs """
+        with self.lock:
+            ids = list(self.dead.keys()) if ids == None else ids
+            jobs = [self.dead[id] for id in ids if id in self.dead]
+            self.log([['forget', job['id']] for job in jobs])
+        return [self.enqueue(job['payload'], priority=job['priority']) for job in jobs if job.get('payload', None) != None]
+
+    def result(self, id: int) -> Optional[dict]:
+        with self.lock:
+            job = self.jobs.get(id, None) or self.done.get(id, None) or self.dead.get(id, None)
+            return None if job == None else {k: v for k, v in job.items() if k not in ['payload', 'size']}
+
+    def ids(self, status: str = 'ready') -> List[int]:
+        with self.lock:
+            if status == 'done':
+                return list(self.done.keys())
+            if status == 'dead':
+                return list(self.dead.keys())
+            return [id for id, job in self.jobs.items() if status in [None, job['status']]]
+
+    def depth(self) -> int:
+        with self.lock:
+            return sum(job['status'] == 'ready' for job in self.jobs.values())
+
+    def stats(self) -> dict:
+        def quantiles(samples):
+            samples = sorted(samples)
+            if len(samples) == 0:
+                return None
+            return {q: round(samples[min(int(q * len(samples)), len(samples) - 1)], 6) for q in [0.5, 0.95, 0.99]}
+        with self.lock:
+            statuses = [job['status'] for job in self.jobs.values()]
+            return {'ready': statuses.count('ready'),
+                    'leased': statuses.count('leased'),
+                    'done': len(self.done),
+                    'dead': len(self.dead),
+                    'wal_bytes': self.wal_bytes,
+                    'counts': dict(self.counts),
+                    'wait_latency': quantiles(self.samples['wait']),
+                    'run_latency': quantiles(self.samples['run'])}
+
+    def clear(self):
+        with self.lock:
+            self.wal.close()
+            os.remove(self.path)
+            self.replay()
+        return {'success': True, 'msg': f'cleared {self.path}'}
+
+    def close(self):
+        with self.lock:
+            self.wal.close()
+            # closing the file releases the flock
+            self.lock_file.close()
+
+    @classmethod
+    def benchmark(cls, n: int = 50000, batch: int = 100) -> dict:
+        self = cls(path='benchmark')
+        self.clear()
+        payload = {'module': 'module', 'fn': 'info', 'args': [], 'kwargs': {}}
+        t = time.time()
+        for _ in range(n):
+            self.enqueue(payload)
+        enqueue_rate = n / (time.time() - t)
+        t = time.time()
+        for _ in range(n // batch):
+            self.enqueue_many([payload] * batch)
+        batch_rate = n / (time.time() - t)
+        t = time.time()
+        while True:
+            jobs = self.dequeue(batch)
+            if not jobs:
+                break
+            self.ack_many([job['id'] for job in jobs])
+        dequeue_rate = 2 * n / (time.time() - t)
+        wal_bytes = self.wal_bytes
+        self.close()
+        t = time.time()
+        self = cls(path='benchmark')
+        replay_time = time.time() - t
+        self.clear()
+        self.close()
+        return {'enqueue_per_s': enqueue_rate, 'enqueue_many_per_s': batch_rate,
+                'dequeue_ack_per_s': dequeue_rate, 'replay_s': replay_time, 'wal_bytes': wal_bytes}
+
+    @classmethod
+    def test(cls):
+        self = cls(path='test', max_retries=2, retry_delay=0)
+        self.clear()
+        ids = self.enqueue_many([{'i': i} for i in range(3)], priority=[3, 1, 2])
+        assert [job['payload']['i'] for job in self.dequeue(3)] == [1, 2, 0], 'priority order'
+        self.ack(ids[1], 'ok')
+        assert self.nack(ids[2], 'boom') == 'retry'
+
+        # a restart replays the wal: one done, one ready again, one still leased
+        self.close()
+        self = cls(path='test', max_retries=2, retry_delay=0)
+        assert self.result(ids[1])['result'] == 'ok'
+        assert self.dequeue(1, visibility_timeout=0.05)[0]['id'] == ids[2]
+        assert self.nack(ids[2], 'boom again') == 'dead' and ids[2] in self.ids('dead')
+
+        # the lease of the job that was never acked expires and it is redelivered once more
+        self.jobs[ids[0]]['lease_until'] = 0
+        heapq.heappush(self.leases, (0, ids[0]))
+        redelivered = self.dequeue(1, visibility_timeout=0.05)
+        assert redelivered[0]['id'] == ids[0] and redelivered[0]['attempts'] == 2
+        time.sleep(0.1)
+        assert self.dequeue(1) == [] and ids[0] in self.ids('dead')
+
+        # compaction keeps the state
+        before = {id: self.result(id) for id in ids}
+        self.compact()
+        self.close()
+        self = cls(path='test')
+        assert {id: self.result(id) for id in ids} == before
+
+        # a second writer on the same wal is refused
+        try:
+            cls(path='test')
+            assert False, 'opened a task queue twice'
+        except RuntimeError:
+            pass
+        stats = self.stats()
+        self.clear()
+        self.close()
+        return {'success': True, 'stats': stats}
@@ -1,121 +1,416 @@
 import commune as c
-import torch
+import os
+import json
+import shutil
+import numpy as np
+from typing import *
 
 class VectorStore(c.Module):
-    def __init__(self, 
+    """
+    Vector store over a growable float32 array. Search is an exact BLAS matmul, and an IVF index
+    (k-means coarse quantizer with inverted lists) is used once the collection is past ivf_threshold vectors.
+    Stores persist to npy files that are memory-mapped on load.
+    """
+    metrics = ['ip', 'cosine', 'l2']
+
+    def __init__(self,
                     config = None,
                     **kwargs
                  ):
-        self.set_config(config=config, kwargs=kwargs)
+        config = self.set_config(config=config, kwargs=kwargs)
+        assert config.metric in self.metrics, f'metric must be one of {self.metrics}'
+        self.metric = config.metric
+        self.model = None
+        self.reset(dim=config.dim, capacity=config.capacity)
+        if config.load:
+            self.load(config.name, mmap=config.mmap)
+
+    def reset(self, dim:int = None, capacity:int = 1024):
+        self.dim = dim
+        self.n = 0
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32) if dim else None
+        self.sq_norms = np.zeros(capacity, dtype=np.float32) # for l2 scores
+        self.index2k = []
         self.k2index = {}
-        self.index2k = {}
-        self.vectors = []
-        self.example_vector = None
-        config = self.set_config(config)
-        self.set_model(config.model)
-        
-        
+        self.metadata = []
+        self.reset_index()
+        return {'success': True, 'dim': dim, 'capacity': capacity}
+
+    def reset_index(self):
+        self.centroids = None # [nlist, dim]
+        self.assign = np.zeros(len(self.sq_norms), dtype=np.int32) # centroid of each vector
+        self.list_order = None # vector ids sorted by centroid
+        self.list_offsets = None # [nlist + 1] where each inverted list starts in list_order
+        self.n_indexed = 0 # vectors [0, n_indexed) are in the inverted lists, the rest are searched exactly
+
+    def __len__(self):
+        return self.n
 
     def set_model(self, model='model'):
         self.model = c.connect(model)
-        
-        
-        
-    def encode(self, text:str, **kwargs):
-        return self.model.encode(text, **kwargs)
-    
-
-    def resolve_vector(self, v:torch.Tensor):
-        
-        if isinstance(v, list):
-            v = torch.tensor(v)
-        elif isinstance(v, np.ndarray):
-            v = torch.from_numpy(v)
-            
-        assert isinstance(v, torch.Tensor), f'Expected a torch.Tensor, got {type(v)}'
-        if self.example_vector == None:
-            self.example_vector = v
-        assert self.example_vector.shape == v.shape, f'Expected a vector of shape {self.example_vector.shape}, got {v.shape}'
-        
-        return v
-    
-    @classmethod
+        return self.model
+
     def resolve_model(self, model=None):
         if model == None:
-            model = self.model
+            model = self.model or self.set_model(self.config.model)
         elif isinstance(model, str):
             model = c.connect(model)
-            
         return model
-        
+
+    def encode(self, text:str, model=None, **kwargs):
+        return self.resolve_model(model).encode(text, **kwargs)
 
     def embed(self, text:str, model=None, **kwargs):
-        model = self.resolve_model(model)
-        vectors = self.model.embed(text, **kwargs)
-    
-    def add_vector(self, k, v , verbose=True):
-    
-
-        v = self.resolve_vector(v)
-        stacked_vectors = []
-        if len(self.vectors) == 0:
-            stacked_vectors = [v]
-        else:
-            stacked_vectors = [self.vectors, v]
-        
-        self.vectors = torch.stack(stacked_vectors)
-        idx = len(self.vectors) - 1
+        return self.resolve_model(model).embed(text, **kwargs)
+
+    def resolve_vectors(self, v) -> np.ndarray:
+        if hasattr(v, 'detach'): # torch tensors
+            v = v.detach().cpu().numpy()
+        v = np.asarray(v, dtype=np.float32)
+        if v.ndim == 1:
+            v = v[None, :]
+        assert v.ndim == 2, f'Expected vectors of shape [n, dim], got {v.shape}'
+        if self.dim == None:
+            self.reset(dim=v.shape[1], capacity=max(len(self.sq_norms), len(v)))
+        assert v.shape[1] == self.dim, f'Expected vectors of dimension {self.dim}, got {v.shape[1]}'
+        if self.metric == 'cosine':
+            v = v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+        return v
+
+    def reserve(self, n:int):
+        """
+        Grows the storage geometrically so inserts are amortized O(1) copies.
+        """
+        capacity = len(self.sq_norms)
+        if n <= capacity and self.vectors.flags.writeable:
+            return capacity
+        capacity = max(n, 2 * capacity)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.n] = self.vectors[:self.n]
+        self.vectors = vectors # also moves a memory-mapped store into memory
+        for attr in ['sq_norms', 'assign']:
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, attr, new)
+        return capacity
+
+    def add_vectors(self, keys:List[str], vectors, metadata:List[dict] = None) -> dict:
+        """
+        Inserts a batch of vectors, keys that already exist are overwritten in place.
+        """
+        vectors = self.resolve_vectors(vectors)
+        keys = list(keys)
+        assert len(keys) == len(vectors), f'Expected {len(vectors)} keys, got {len(keys)}'
+        metadata = metadata if metadata != None else [{} for _ in keys]
+        assert len(metadata) == len(keys), f'Expected {len(keys)} metadata entries, got {len(metadata)}'
+
+        new_keys = [k for k in dict.fromkeys(keys) if k not in self.k2index]
+        self.reserve(self.n + len(new_keys))
+        for k in new_keys:
+            self.k2index[k] = len(self.index2k)
+            self.index2k.append(k)
+            self.metadata.append({})
+        idxs = np.array([self.k2index[k] for k in keys], dtype=np.int64)
+        n_before, self.n = self.n, len(self.index2k)
+        if len(idxs) > 0 and idxs.min() < n_before:
+            self.n_indexed = min(self.n_indexed, int(idxs.min())) # overwritten vectors leave the inverted lists
+        self.vectors[idxs] = vectors
+        self.sq_norms[idxs] = np.einsum('ij,ij->i', vectors, vectors)
+        for idx, m in zip(idxs.tolist(), metadata):
+            self.metadata[idx] = dict(m or {})
+        if self.centroids is not None:
+            self.assign[idxs] = self.nearest_centroids(vectors)
+        return {'success': True, 'added': len(new_keys), 'updated': len(keys) - len(new_keys), 'n': self.n}
+
+    def add_vector(self, k, v, metadata:dict = None, verbose=False):
+        output = self.add_vectors([k], v, metadata=[metadata])
         if verbose:
-            c.print(f'Adding vector {k} at index {idx}, {self.vectors}')
-        self.k2index[k] = idx
-        self.index2k[idx] = k
-        
+            c.print(f'Adding vector {k} at index {self.k2index[k]}')
+        return output
+
+    def rm_vectors(self, keys:List[str]) -> dict:
+        """
+        Removes a batch of vectors by moving the last vectors into the freed slots.
+        """
+        idxs = sorted({self.k2index[k] for k in keys if k in self.k2index}, reverse=True)
+        for idx in idxs: # descending, so the last slot is never one that is still to be removed
+            last_idx = self.n - 1
+            k = self.index2k[idx]
+            if idx != last_idx:
+                last_k = self.index2k[last_idx]
+                self.vectors[idx] = self.vectors[last_idx]
+                self.sq_norms[idx] = self.sq_norms[last_idx]
+                self.assign[idx] = self.assign[last_idx]
+                self.metadata[idx] = self.metadata[last_idx]
+                self.index2k[idx] = last_k
+                self.k2index[last_k] = idx
+            self.index2k.pop()
+            self.metadata.pop()
+            del self.k2index[k]
+            self.n -= 1
+        if len(idxs) > 0:
+            self.n_indexed = min(self.n_indexed, idxs[-1]) # moved vectors leave the inverted lists
+        return {'success': True, 'removed': len(idxs), 'n': self.n}
+
     def rm_vector(self, k):
-        last_idx = len(self.vectors) - 1
-        print(f'last_idx: {last_idx}')
-        # swap the vector to be removed with the last vector
-        idx = self.k2index[k]
-        last_k = self.index2k[last_idx]
-        last_v = self.vectors[last_idx]
-        self.vectors[idx] = last_v
-        self.k2index[last_k] = idx
-        self.index2k[idx] = last_k
-        # remove the last vector
-        del self.index2k[last_idx]
-        del self.k2index[last_k]
-        
-        self.vectors = self.vectors[:-1]
-
-
-
-
-    def search(self, query, top_k=10, chunks=1):
-        assert len(self.vectors) > 0, 'No vectors stored in the vector store'
-        c.print(f'query: {query}', 'vector shape:', self.vectors.shape)
-        query_vector = torch.tensor(query) 
-        if len(query_vector.shape) == 1:
-            query_vector = query_vector.unsqueeze(0)
-        # Convert the query into a tensor (assuming it's a vector representation)
-        print(query_vector.shape, self.vectors.shape)
-        similarities = torch.einsum('ij,kj->i', query_vector, self.vectors)  # Compute the similarity scores between the query and stored vectors
-        indices = similarities.argsort(descending=True)[:top_k]  # Sort the similarity scores and retrieve the indices of the top-k results
-        results = {}  # Create an empty dictionary to store the results
-        indices = indices.tolist()  # Convert the indices tensor to a list
-        for idx in indices:
-            key = self.index2k[idx]  # Retrieve the key corresponding to the index
-            score = similarities[idx].item()  # Retrieve the similarity score for the corresponding index
-            results[key] = score  # Store the key-score pair in the results dictionary
-        return results  # Return the dictionary of results
+        return self.rm_vectors([k])
+
+    def get_vector(self, k) -> np.ndarray:
+        return self.vectors[self.k2index[k]]
+
+    # SEARCH
+
+    def scores(self, queries:np.ndarray, idxs:np.ndarray = None) -> np.ndarray:
+        """
+        Scores [n_queries, n_vectors] of the vectors (all or idxs), higher is closer.
+        """
+        vectors = self.vectors[:self.n] if idxs is None else self.vectors[idxs]
+        scores = queries @ vectors.T
+        if self.metric == 'l2':
+            sq_norms = self.sq_norms[:self.n] if idxs is None else self.sq_norms[idxs]
+            scores = 2 * scores - sq_norms[None, :] - np.einsum('ij,ij->i', queries, queries)[:, None]
+        return scores
 
+    def filter_mask(self, filters:dict) -> np.ndarray:
+        """
+        Metadata filters, {field: value} matches equal values, a list matches any of its values
+        and a callable is used as the predicate.
+        """
+        def match(m):
+            for field, condition in filters.items():
+                value = m.get(field)
+                if callable(condition):
+                    if not condition(value):
+                        return False
+                elif isinstance(condition, (list, tuple, set)):
+                    if value not in condition:
+                        return False
+                elif value != condition:
+                    return False
+            return True
+        return np.fromiter((match(m) for m in self.metadata[:self.n]), dtype=bool, count=self.n)
+
+    @staticmethod
+    def topk(scores:np.ndarray, top_k:int) -> np.ndarray:
+        """
+        Indices of the top_k scores per row, sorted descending, without a full sort.
+        """
+        top_k = min(top_k, scores.shape[1])
+        if top_k == 0:
+            return np.zeros((len(scores), 0), dtype=np.int64)
+        idxs = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(-np.take_along_axis(scores, idxs, axis=1), axis=1)
+        return np.take_along_axis(idxs, order, axis=1)
+
+    def search(self, query, top_k=10, filters:dict = None, exact:bool = None, nprobe:int = None,
+               return_metadata:bool = False):
+        """
+        Returns {key: score} of the top_k vectors, or a list of those for a batch of queries.
+        """
+        assert self.n > 0, 'No vectors stored in the vector store'
+        single = np.ndim(query) == 1
+        queries = self.resolve_vectors(query)
+        if exact == None:
+            exact = self.centroids is None or self.n < self.config.ivf_threshold
+        mask = self.filter_mask(filters) if filters else None
+        if exact:
+            results = self.exact_search(queries, top_k=top_k, mask=mask)
+        else:
+            results = self.ivf_search(queries, top_k=top_k, mask=mask, nprobe=nprobe or self.config.nprobe)
+        outputs = []
+        for idxs, scores in results:
+            if return_metadata:
+                outputs += [{self.index2k[i]: {'score': float(s), 'metadata': self.metadata[i]} for i, s in zip(idxs, scores)}]
+            else:
+                outputs += [{self.index2k[i]: float(s) for i, s in zip(idxs, scores)}]
+        return outputs[0] if single else outputs
+
+    def exact_search(self, queries:np.ndarray, top_k:int = 10, mask:np.ndarray = None, batch_size:int = 256) -> list:
+        candidates = None if mask is None else np.flatnonzero(mask)
+        results = []
+        for i in range(0, len(queries), batch_size): # bounds the [batch, n] score matrix
+            scores = self.scores(queries[i:i+batch_size], idxs=candidates)
+            top = self.topk(scores, top_k)
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            if candidates is not None:
+                top = candidates[top]
+            results += list(zip(top.tolist(), top_scores.tolist()))
+        return results
+
+    # IVF INDEX
+
+    def nearest_centroids(self, vectors:np.ndarray, n:int = 1) -> np.ndarray:
+        # argmax of 2<x,c> - |c|^2 is the nearest centroid in l2
+        scores = 2 * vectors @ self.centroids.T - np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :]
+        if n == 1:
+            return scores.argmax(axis=1).astype(np.int32)
+        return self.topk(scores, n)
+
+    def train_index(self, nlist:int = None, n_iter:int = 10, sample_size:int = 65536, seed:int = 0) -> dict:
+        """
+        Trains the coarse quantizer with k-means on a sample and assigns every vector to its nearest centroid.
+        """
+        assert self.n > 0, 'No vectors to train the index on'
+        nlist = nlist or self.config.nlist or max(1, int(4 * np.sqrt(self.n)))
+        nlist = min(nlist, self.n)
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[rng.choice(self.n, size=min(sample_size, self.n), replace=False)]
+        self.centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = self.nearest_centroids(sample)
+            order = np.argsort(assign, kind='stable')
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+            self.centroids[~empty] = np.add.reduceat(sample[order], offsets, axis=0) / counts[~empty][:, None]
+            # reseed empty lists with random sample points
+            self.centroids[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        for i in range(0, self.n, 65536):
+            self.assign[i:i+65536] = self.nearest_centroids(self.vectors[i:i+65536])
+        self.n_indexed = 0
+        self.build_lists()
+        return {'success': True, 'nlist': nlist, 'n': self.n}
+
+    def build_lists(self):
+        self.list_order = np.argsort(self.assign[:self.n], kind='stable')
+        counts = np.bincount(self.assign[:self.n], minlength=len(self.centroids))
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.n_indexed = self.n
+
+    def ivf_search(self, queries:np.ndarray, top_k:int = 10, mask:np.ndarray = None, nprobe:int = 8) -> list:
+        if self.n_indexed < self.n // 2:
+            # most vectors changed since the lists were built, rebuild them
+            self.build_lists()
+        probes = self.nearest_centroids(queries, n=min(nprobe, len(self.centroids)))
+        probes = probes[:, None] if probes.ndim == 1 else probes
+        tail = np.arange(self.n_indexed, self.n) # not in the lists yet, searched exactly
+        results = []
+        for query, probe in zip(queries, probes):
+            candidates = np.concatenate([self.list_order[self.list_offsets[p]:self.list_offsets[p+1]] for p in probe])
+            candidates = np.concatenate([candidates[candidates < self.n_indexed], tail])
+            if mask is not None:
+                candidates = candidates[mask[candidates]]
+            scores = self.scores(query[None, :], idxs=candidates)
+            top = self.topk(scores, top_k)[0]
+            results += [(candidates[top].tolist(), scores[0, top].tolist())]
+        return results
+
+    # PERSISTENCE
+
+    def store_path(self, name:str = None) -> str:
+        return self.resolve_path(f'stores/{name or self.config.name}')
+
+    def save(self, name:str = None) -> dict:
+        """
+        Writes the store to npy files (vectors, norms, index) and a json manifest, each replaced atomically.
+        """
+        path = self.store_path(name)
+        os.makedirs(path, exist_ok=True)
+        def save_array(filename, array):
+            tmp_path = f'{path}/{filename}.{os.getpid()}.tmp.npy'
+            np.save(tmp_path, array)
+            os.replace(tmp_path, f'{path}/{filename}.npy')
+        save_array('vectors', self.vectors[:self.n])
+        save_array('sq_norms', self.sq_norms[:self.n])
+        save_array('assign', self.assign[:self.n])
+        if self.centroids is not None:
+            save_array('centroids', self.centroids)
+        manifest = {'dim': self.dim, 'n': self.n, 'metric': self.metric, 'keys': self.index2k,
+                    'metadata': self.metadata, 'indexed': self.centroids is not None, 'timestamp': c.time()}
+        tmp_path = f'{path}/manifest.{os.getpid()}.tmp.json'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, f'{path}/manifest.json')
+        return {'success': True, 'path': path, 'n': self.n}
+
+    def load(self, name:str = None, mmap:bool = True) -> dict:
+        """
+        Loads a saved store, with mmap the vectors are paged in on demand (copy on write) instead of read up front.
+        """
+        path = self.store_path(name)
+        if not os.path.exists(f'{path}/manifest.json'):
+            return {'success': False, 'msg': f'No store at {path}'}
+        with open(f'{path}/manifest.json') as f:
+            manifest = json.load(f)
+        mmap_mode = 'c' if mmap else None
+        self.metric = manifest['metric']
+        self.dim = manifest['dim']
+        self.n = manifest['n']
+        self.vectors = np.load(f'{path}/vectors.npy', mmap_mode=mmap_mode)
+        self.sq_norms = np.load(f'{path}/sq_norms.npy')
+        self.index2k = manifest['keys']
+        self.k2index = {k:i for i,k in enumerate(self.index2k)}
+        self.metadata = manifest['metadata']
+        self.reset_index()
+        self.assign = np.load(f'{path}/assign.npy')
+        if manifest['indexed']:
+            self.centroids = np.load(f'{path}/centroids.npy')
+            self.build_lists()
+        return {'success': True, 'path': path, 'n': self.n, 'mmap': mmap}
+
+    def snapshot(self, tag:str = None) -> dict:
+        tag = tag or str(int(c.time()))
+        return self.save(name=f'{self.config.name}/snapshots/{tag}')
+
+    def snapshots(self) -> List[str]:
+        path = self.store_path() + '/snapshots'
+        return sorted(os.listdir(path)) if os.path.exists(path) else []
+
+    def restore(self, tag:str = None, mmap:bool = True) -> dict:
+        snapshots = self.snapshots()
+        assert len(snapshots) > 0, 'No snapshots to restore'
+        tag = tag or snapshots[-1]
+        assert tag in snapshots, f'Snapshot {tag} not found, available {snapshots}'
+        return self.load(name=f'{self.config.name}/snapshots/{tag}', mmap=mmap)
+
+    def rm_snapshot(self, tag:str) -> dict:
+        shutil.rmtree(self.store_path() + f'/snapshots/{tag}')
+        return {'success': True, 'snapshots': self.snapshots()}
+
+    # BENCHMARK
+
+    @classmethod
+    def benchmark(cls, n:int = 200000, dim:int = 128, queries:int = 100, top_k:int = 10,
+                  nlist:int = None, nprobe:int = 8, clusters:int = 256, seed:int = 0) -> dict:
+        """
+        Recall@top_k and per query latency of the ivf index against exact search on clustered random vectors.
+        """
+        rng = np.random.default_rng(seed)
+        centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+        vectors = centers[rng.integers(clusters, size=n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+        query_vectors = vectors[rng.integers(n, size=queries)] + 0.1 * rng.normal(size=(queries, dim)).astype(np.float32)
+        self = cls(metric='l2', load=False)
+        t = c.time()
+        self.add_vectors(list(range(n)), vectors)
+        insert_seconds = c.time() - t
+        t = c.time()
+        self.train_index(nlist=nlist)
+        train_seconds = c.time() - t
+        t = c.time()
+        exact = self.search(query_vectors, top_k=top_k, exact=True)
+        exact_latency = (c.time() - t) / queries
+        t = c.time()
+        approx = self.search(query_vectors, top_k=top_k, exact=False, nprobe=nprobe)
+        approx_latency = (c.time() - t) / queries
+        recall = np.mean([len(set(e) & set(a)) / len(e) for e, a in zip(exact, approx)])
+        return {'n': n, 'dim': dim, 'nlist': len(self.centroids), 'nprobe': nprobe,
+                'recall': float(recall), 'exact_ms': exact_latency * 1000, 'ivf_ms': approx_latency * 1000,
+                'insert_per_second': n / insert_seconds, 'train_seconds': train_seconds}
 
     @classmethod
     def test(cls):
-        self = cls()
+        self = cls(load=False)
         self.add_vector('test', [1,2,3])
         assert self.search([1,2,3]) == {'test': 14.0}
         self.rm_vector('test')
-        assert len(self.vectors) == 0
+        assert len(self) == 0
+        self.add_vectors(['a', 'b', 'c'], [[1,0,0], [0,1,0], [0,0,1]], metadata=[{'x': 1}, {'x': 2}, {'x': 2}])
+        self.add_vector('d', [1,1,0], metadata={'x': 1})
+        assert list(self.search([1,0,0], top_k=2)) == ['a', 'd']
+        assert list(self.search([1,0,0], top_k=1, filters={'x': 2})) in [['b'], ['c']]
+        self.rm_vectors(['a', 'b'])
+        assert sorted(self.k2index) == ['c', 'd'] and len(self) == 2
+        assert list(self.search([1,0,0], top_k=1)) == ['d']
         print('test passed')
-        
-        
-        
+        return {'success': True}